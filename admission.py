@@ -0,0 +1,152 @@
+### LLM 호출 앞단 동시 실행 제한 + 대기열 (가득 차면 429 로 거절) ###
+
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Tuple
+
+PRIORITY_ONGOING = 0    # 대화 내역이 있는 세션 (먼저 처리)
+PRIORITY_NEW = 1        # 새 세션
+PRIORITY_BATCH = 2      # /chat/batch 항목
+
+
+class AdmissionRejected(Exception):
+    """대기열이 가득 찼거나 대기 시간을 넘김. retry_after 초 뒤 재시도 권장"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """
+    acquire 로 받은 자리 하나. async with 로 감쌀 수 없는 경우(스트리밍 응답 등) 용도.
+    release() 는 여러 번 불러도 한 번만 반납하므로 반납 경로를 여러 개 걸어 둬도 됨
+    """
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._start = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self._controller._finish(time.monotonic() - self._start)
+
+
+class AdmissionController:
+    """
+    동시에 max_concurrent 개까지만 LLM 을 호출하고, 나머지는 최대 max_queue 개까지 대기.
+    - 대기열이 가득 차면 바로 거절, max_wait_seconds 안에 차례가 안 오면 거절
+    - 대기열은 priority 가 작은 것부터, 같으면 먼저 온 순서
+    - 이벤트 루프 하나(워커 프로세스 하나) 안에서만 유효
+    """
+
+    def __init__(self, max_concurrent: int = 16, max_queue: int = 64, max_wait_seconds: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=1000)
+        self._avg_service = 1.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_seen = 0
+
+    def retry_after(self) -> int:
+        """대기열이 한 번 빠지는 데 걸릴 예상 시간 (초, 올림)"""
+        rounds = (len(self._waiters) + 1) / self.max_concurrent
+        return max(1, math.ceil(self._avg_service * rounds))
+
+    async def acquire(self, priority: int = PRIORITY_NEW):
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._admit(0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self.max_queue_seen = max(self.max_queue_seen, len(self._waiters))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # 자리를 넘겨받은 직후 취소/시간 초과된 경우
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+                self._admit(time.monotonic() - start)
+                return
+            future.cancel()
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise AdmissionRejected("queue_timeout", self.retry_after())
+        self._admit(time.monotonic() - start)
+
+    def release(self):
+        """자리를 반납. 대기 중인 요청이 있으면 자리를 바로 넘겨줌 (_active 유지)"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def _admit(self, waited: float):
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def _finish(self, service: float):
+        """자리를 쓴 시간을 Retry-After 추정치에 반영하고 반납"""
+        self._avg_service = 0.9 * self._avg_service + 0.1 * service
+        self.release()
+
+    async def ticket(self, priority: int = PRIORITY_NEW) -> AdmissionTicket:
+        await self.acquire(priority)
+        return AdmissionTicket(self)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NEW):
+        ticket = await self.ticket(priority)
+        try:
+            yield
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 1) if waits else 0.0
+
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self._active,
+            "queued": len(self._waiters),
+            "max_queue_seen": self.max_queue_seen,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+            "avg_llm_seconds": round(self._avg_service, 3),
+        }
@@ -0,0 +1,683 @@
+"""
+무도연애상담소 성능 벤치마크 (오프라인, API 키 불필요)
+
+사용법:
+    python benchmark.py sessions [--workers 4] [--requests 4000]
+    python benchmark.py history [--turns 50]
+    python benchmark.py imports [--max-ms 1500] [--top 15]
+    python benchmark.py index [--workers 4] [--vectors 20000] [--dim 1536]
+    python benchmark.py compress [--index vector_index_openai] [--specs "Flat;SQ8;IVF64,SQ8"] [--k 10] [--vectors 20000]
+      (--vectors: 실제 벡터를 재표집 + 노이즈로 늘린 합성 코퍼스 - 자료가 늘었을 때 예상치)
+    python benchmark.py retrieval [--index vector_index_openai] [--queries 200] [--k 3] [--embed-latency-ms 250] [--live]
+      (기본은 청크 일부를 질의로, 원본 청크 벡터를 질의 벡터로 쓰는 근사.
+       --live: 실제 임베딩 API 로 질의 임베딩 - API 키 필요)
+    python benchmark.py rag [--index vector_index_openai] [--queries rag_eval_queries.jsonl] [--k 3] [--spec Flat] [--live]
+      (정답 청크를 표시한 질의 세트로 모드/샤드별 recall@k, MRR, p50/p99. 기본은 청크를 해시 임베딩으로 다시 색인해
+       네트워크 없이 결정적으로 실행. --live: 저장된 인덱스 + 실제 임베딩 API - API 키 필요)
+    python benchmark.py postprocess [--corpus raw_responses.jsonl] [--baseline old_postprocessing.py]
+      (--corpus: final.py 의 RAW_RESPONSE_LOG_PATH 로 기록한 원본 응답,
+       --baseline: 예) git show <커밋>:postprocessing.py > old_postprocessing.py)
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+from postprocessing import postprocess_response, POSTPROCESS_POLICY
+from session_store import InMemorySessionStore, SQLiteSessionStore
+from prompt_budget import TokenCounter
+from history_summary import compact_session_history, format_history_with_summary
+
+SAMPLE_RAW_RESPONSE = (
+    "답변: **형님**, 그건 충분히 이해합니다. (웃음) 일단 연락해보세요! "
+    "그리고 너무 조급해하지 마세요. 하시길 바랍니다.\n- 진심으로 사과하세요."
+)
+
+
+def print_separator(title):
+    print("\n" + "=" * 70)
+    print(f"  {title}")
+    print("=" * 70)
+
+
+# 세션 저장소: 워커 1개 vs N개의 벽시계 처리량 (memory vs sqlite)
+# 요청마다 후처리(CPU) + 저장소 호출만 하고 LLM 대기는 뺌. SQLite 쓰기는 워커 수와 상관없이 직렬화되므로
+# 워커를 늘려도 저장소 부분은 빨라지지 않음. 실제 /chat 처리량은 LLM 대기 시간이 좌우함
+
+def _simulate_requests(store, n_requests: int, turns_per_session: int = 5) -> float:
+    """/chat 한 번 = 세션 조회 + 히스토리 읽기 + 히스토리 추가. 저장소 호출에 쓴 시간(초) 합계를 돌려줌"""
+    session_id = None
+    store_seconds = 0.0
+    for i in range(n_requests):
+        if i % turns_per_session == 0:
+            session_id = None
+        reply = postprocess_response("박명수", SAMPLE_RAW_RESPONSE)
+        start = time.perf_counter()
+        session_id = store.get_or_create(session_id)
+        store.history_text(session_id)
+        store.append(session_id, [f"User: 질문 {i}", f"박명수: {reply}"])
+        store_seconds += time.perf_counter() - start
+    return store_seconds
+
+
+def _sqlite_worker(args):
+    path, n_requests = args
+    store = SQLiteSessionStore(path, ttl_seconds=1800, max_history_lines=80)
+    return _simulate_requests(store, n_requests)
+
+
+def bench_sessions(workers: int, n_requests: int):
+    print_separator(f"세션 저장소 - 워커 수별 처리량 (요청 {n_requests}개, LLM 대기 제외)")
+    print("  (req/s = 전체 요청 수 / 벽시계 시간, 저장소 = 요청당 저장소 호출 시간. sqlite 는 잠금 대기 포함)")
+
+    store = InMemorySessionStore(ttl_seconds=1800, max_history_lines=80)
+    start = time.perf_counter()
+    memory = _simulate_requests(store, n_requests)
+    wall = time.perf_counter() - start
+    print(f"  {'memory, 프로세스 1개':20}: {n_requests / wall:9.0f} req/s  (저장소 {memory / n_requests * 1e6:7.1f} us/요청)")
+
+    throughput = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.sqlite")
+        SQLiteSessionStore(path, ttl_seconds=1800, max_history_lines=80)
+        for n_workers in sorted({1, workers}):
+            per_worker = n_requests // n_workers
+            total = per_worker * n_workers
+            with multiprocessing.Pool(n_workers) as pool:
+                # 프로세스 시작/DB 연결은 재지 않도록 먼저 한 번 돌려 둠
+                pool.map(_sqlite_worker, [(path, 0)] * n_workers, chunksize=1)
+                start = time.perf_counter()
+                spent = pool.map(_sqlite_worker, [(path, per_worker)] * n_workers, chunksize=1)
+                wall = time.perf_counter() - start
+            throughput[n_workers] = total / wall
+            label = f"sqlite, 워커 {n_workers}개"
+            print(f"  {label:20}: {throughput[n_workers]:9.0f} req/s  (저장소 {sum(spent) / total * 1e6:7.1f} us/요청)")
+    if len(throughput) > 1:
+        print(f"  -> 워커 {workers}개 / 1개 처리량: {throughput[workers] / throughput[1]:.2f}배")
+
+
+# 대화 내역 압축: 턴별 프롬프트(대화 내역 부분) 토큰 수
+
+SAMPLE_USER_MESSAGES = [
+    "형님, 썸녀가 있는데 고백할까 말까 고민이에요",
+    "근데 거절당하면 어떡하죠? 무서워요",
+    "지난주에 같이 성수동 카페 갔는데 분위기 좋았어요",
+    "카톡 답장이 좀 늦게 오는 편이에요",
+    "주말에 영화 보자고 해볼까요?",
+]
+
+
+async def _fake_summarize(previous_summary: str, lines):
+    """LLM 대신 쓰는 결정적 요약기: 사용자 발화 앞부분만 모아 600자 이내로"""
+    picked = [line[6:36] for line in lines if line.startswith("User: ")]
+    return ((previous_summary + " " if previous_summary else "") + " / ".join(picked))[-600:]
+
+
+async def _run_history_session(turns: int, compaction: bool, counter: TokenCounter):
+    store = InMemorySessionStore(ttl_seconds=1800, max_history_lines=80)
+    session_id = store.get_or_create(None)
+    tokens = []
+    for turn in range(turns):
+        message = SAMPLE_USER_MESSAGES[turn % len(SAMPLE_USER_MESSAGES)]
+        chat_history = format_history_with_summary(store.summary(session_id), store.history_text(session_id))
+        tokens.append(counter.count(chat_history) + counter.count(message))
+        reply = postprocess_response("유재석", SAMPLE_RAW_RESPONSE)
+        store.append(session_id, [f"User: {message}", f"유재석: {reply}"])
+        if compaction:
+            await compact_session_history(store, session_id, _fake_summarize, trigger_lines=16, keep_lines=8)
+    return tokens
+
+
+def bench_history(turns: int):
+    print_separator(f"대화 내역 압축 - {turns}턴 세션의 턴별 프롬프트 토큰 (대화 내역 + 사용자 메시지)")
+    counter = TokenCounter()
+    raw = asyncio.run(_run_history_session(turns, False, counter))
+    compacted = asyncio.run(_run_history_session(turns, True, counter))
+
+    print(f"  {'턴':>4} | {'원문 80줄':>10} | {'요약 + 최근 8줄':>14}")
+    for turn in range(0, turns, 5):
+        print(f"  {turn + 1:>4} | {raw[turn]:>10} | {compacted[turn]:>14}")
+    print(f"  {'평균':>4} | {sum(raw) / turns:>10.0f} | {sum(compacted) / turns:>14.0f}")
+    print(f"  {'합계':>4} | {sum(raw):>10} | {sum(compacted):>14}")
+
+
+# 후처리: 응답당 처리 시간 (+ 이전 구현과 결과 비교)
+
+_SAMPLE_PIECES = [
+    "답변: ", "**형님**, ", "그건 충분히 이해합니다. ", "(웃음) ", "[속마음] ", "일단 연락해보세요! ",
+    "너무 조급해하지 마세요. ", "하시길 바랍니다. ", "\n- 진심으로 사과하세요.", "ㅇㅇ님 ", "괜찮아요~ ",
+    "`진짜` 좋아요. ", "그래요? ", "내가 보기엔 말이야, ", "잘 될 거예요... ", "\n* 선물은 부담 없이",
+]
+
+
+def _load_corpus(path, n_samples: int):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return [(row["character"], row["raw"]) for row in rows]
+    rng = random.Random(0)
+    characters = list(POSTPROCESS_POLICY.keys())
+    return [
+        (characters[i % len(characters)], "".join(rng.choice(_SAMPLE_PIECES) for _ in range(rng.randint(3, 12))))
+        for i in range(n_samples)
+    ]
+
+
+def _load_module(path: str, name: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _time_per_response(fn, corpus, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for character, raw in corpus:
+            fn(character, raw)
+    return (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+
+def bench_postprocess(corpus_path, baseline_path, n_samples: int, repeat: int):
+    corpus = _load_corpus(corpus_path, n_samples)
+    print_separator(f"응답 후처리 (응답 {len(corpus)}개 x {repeat}회)")
+
+    impls = [("현재", postprocess_response)]
+    if baseline_path:
+        baseline = _load_module(baseline_path, "baseline_postprocessing")
+        impls.insert(0, ("이전", baseline.postprocess_response))
+        diff = [(c, r) for c, r in corpus if baseline.postprocess_response(c, r) != postprocess_response(c, r)]
+        print(f"  결과가 다른 응답: {len(diff)} / {len(corpus)}")
+        for character, raw in diff[:3]:
+            print(f"    [{character}] {raw!r}")
+
+    for label, fn in impls:
+        us = _time_per_response(fn, corpus, repeat)
+        print(f"  {label:4}: {us:8.1f} us/응답 ({1e6 / us:10.0f} 응답/s)")
+
+
+# 벡터 인덱스: 예전 FAISS(pickle, 워커마다 RAM 복사) vs mmap 인덱스(페이지 캐시 공유)
+
+def _pss_mb() -> float:
+    """현재 프로세스의 PSS (공유 페이지는 공유하는 프로세스 수로 나눈 값)"""
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _index_worker(kind, path, dim, barrier, results):
+    import numpy as np
+    from langchain_core.embeddings import FakeEmbeddings
+    before = _pss_mb()
+    start = time.perf_counter()
+    if kind == "faiss":
+        from langchain_community.vectorstores import FAISS
+        store = FAISS.load_local(path, FakeEmbeddings(size=dim), allow_dangerous_deserialization=True)
+    else:
+        from vector_index import MmapVectorStore
+        store = MmapVectorStore.load(path, FakeEmbeddings(size=dim))
+    store.similarity_search_by_vector(np.ones(dim, dtype=np.float32).tolist(), k=3)  # 전체 벡터 한 번 읽기
+    load_ms = (time.perf_counter() - start) * 1000
+    barrier.wait()  # 모든 워커가 인덱스를 들고 있는 상태에서 측정
+    results.put((load_ms, _pss_mb() - before))
+    barrier.wait()
+
+
+def _build_synthetic_indexes(tmp: str, n_vectors: int, dim: int):
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import FakeEmbeddings
+    from vector_index import save_index
+
+    vectors = np.random.default_rng(0).normal(size=(n_vectors, dim)).astype(np.float32)
+    documents = [Document(page_content=f"청크 {i} " + "연애 상담 내용 " * 20, metadata={"page": i % 19}) for i in range(n_vectors)]
+    index = faiss.IndexFlatL2(dim)
+    index.add(vectors)
+    ids = [str(i) for i in range(n_vectors)]
+    FAISS(FakeEmbeddings(size=dim), index, InMemoryDocstore(dict(zip(ids, documents))), dict(enumerate(ids))).save_local(
+        os.path.join(tmp, "faiss")
+    )
+    save_index(os.path.join(tmp, "mmap"), index, documents)
+
+
+def bench_index(workers: int, n_vectors: int, dim: int):
+    print_separator(f"벡터 인덱스 로드 (벡터 {n_vectors}개 x {dim}차원, 워커 {workers}개)")
+    with tempfile.TemporaryDirectory() as tmp:
+        _build_synthetic_indexes(tmp, n_vectors, dim)
+        print(f"  {'형식':14} | {'로드 ms (평균)':>14} | {'워커 PSS 합계 MB':>16}")
+        for kind, label in [("faiss", "FAISS + pickle"), ("mmap", "mmap + SQLite")]:
+            barrier = multiprocessing.Barrier(workers)
+            results = multiprocessing.Queue()
+            procs = [
+                multiprocessing.Process(target=_index_worker, args=(kind, os.path.join(tmp, kind), dim, barrier, results))
+                for _ in range(workers)
+            ]
+            for p in procs:
+                p.start()
+            rows = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            load_ms = sum(r[0] for r in rows) / len(rows)
+            pss = sum(r[1] for r in rows)
+            print(f"  {label:14} | {load_ms:14.1f} | {pss:16.1f}")
+        print(f"  (벡터 원본 크기 {n_vectors * dim * 4 / 1024 / 1024:.1f} MB)")
+
+
+# 압축 인덱스: Flat(정확) 대비 recall@k / 지연시간 / 디스크 / RAM
+
+def _default_specs(n: int, dim: int):
+    """코퍼스 크기에 맞춘 후보 (PQ 코드북 256개 학습에는 벡터가 최소 256개 필요 - 적으면 4비트)"""
+    nlist = max(2, int(n ** 0.5))
+    m = next(m for m in (dim // 16, dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+    pq = f"PQ{m}" if n >= 256 else f"PQ{m}x4"
+    return ["Flat", "SQfp16", "SQ8", pq, f"OPQ{m},{pq}", f"IVF{nlist},Flat", f"IVF{nlist},SQ8", f"IVF{nlist},{pq}"]
+
+
+def _compress_ram_worker(path, query, results):
+    import faiss
+    faiss.IndexFlatL2(query.shape[1]).search(query, 1)  # OpenMP 스레드 풀 등 인덱스와 무관한 할당을 먼저
+    before = _pss_mb()
+    index = faiss.read_index(path)
+    index.search(query, 1)
+    results.put(_pss_mb() - before)
+
+
+def bench_compress(index_path: str, specs, k: int, n_queries: int, n_vectors, nprobe: int):
+    import faiss
+    import numpy as np
+    from vector_index import MmapVectorStore, build_index
+
+    vectors = MmapVectorStore.load(index_path, None).vectors().astype(np.float32)
+    rng = np.random.default_rng(0)
+
+    def jitter(rows, scale):
+        noisy = vectors[rows] + rng.normal(scale=scale * vectors.std(), size=(len(rows), vectors.shape[1]))
+        return (noisy / np.linalg.norm(noisy, axis=1, keepdims=True)).astype(np.float32)
+
+    label = "실제 코퍼스"
+    if n_vectors:
+        vectors = jitter(rng.integers(len(vectors), size=n_vectors), 0.5)
+        label = "합성 코퍼스"
+    n, dim = vectors.shape
+    queries = jitter(rng.integers(n, size=n_queries), 0.3)
+    specs = specs or _default_specs(n, dim)
+    k = min(k, n)
+
+    print_separator(f"압축 인덱스 비교 ({label} {n}개 x {dim}차원, 질의 {n_queries}개, recall@{k}, nprobe={nprobe})")
+    exact = build_index(vectors, "Flat")
+    _, truth = exact.search(queries, k)
+    print(f"  {'index_spec':22} | {'recall@k':>8} | {'p50 us':>8} | {'p99 us':>8} | {'디스크 MB':>9} | "
+          f"{'RAM MB':>7} | {'학습 s':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for spec in specs:
+            start = time.perf_counter()
+            try:
+                index = build_index(vectors, spec)
+            except ValueError as e:
+                print(f"  {spec:22} | 생성 실패: {str(e)[:80]}")
+                continue
+            train_s = time.perf_counter() - start
+            ivf = faiss.try_extract_index_ivf(index)
+            if ivf is not None:
+                ivf.nprobe = nprobe
+            latencies = []
+            found = np.zeros_like(truth)
+            for i, q in enumerate(queries):
+                t = time.perf_counter()
+                _, found[i:i + 1] = index.search(q[None, :], k)
+                latencies.append((time.perf_counter() - t) * 1e6)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            path = os.path.join(tmp, "index.faiss")
+            faiss.write_index(index, path)
+            disk_mb = os.path.getsize(path) / 1024 / 1024
+            results = multiprocessing.Queue()
+            proc = multiprocessing.Process(target=_compress_ram_worker, args=(path, queries[:1], results))
+            proc.start()
+            ram_mb = results.get()
+            proc.join()
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"  {spec:22} | {recall:8.3f} | {p50:8.1f} | {p99:8.1f} | {disk_mb:9.2f} | {ram_mb:7.2f} | {train_s:6.2f}")
+    print(f"  (압축 인덱스는 증분 수집용 원본 vectors.npy {n * dim * 4 / 1024 / 1024:.1f} MB 를 디스크에 따로 둠 - 서버는 읽지 않음)")
+
+
+# 검색 모드: vector vs hybrid(BM25 + 벡터) vs lexical(BM25 만)
+
+class _ProxyQueryEmbeddings:
+    """오프라인 근사: 질의를 잘라 온 청크의 저장된 벡터를 질의 벡터로 돌려줌 (원격 호출 지연은 sleep 으로 흉내)"""
+
+    def __init__(self, vectors, latency: float):
+        self.vectors = vectors
+        self.latency = latency
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self.vectors[text]
+
+
+def _sample_queries(documents, n: int, chars: int, seed: int = 0):
+    """청크 안의 어절 경계에서 chars 글자 정도를 잘라 질의로 사용. [(질의, 원본 행 번호)]"""
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < n:
+        row = rng.randrange(len(documents))
+        words = documents[row].page_content.split()
+        if not words:
+            continue
+        start = rng.randrange(len(words))
+        text = ""
+        for word in words[start:]:
+            if len(text) >= chars:
+                break
+            text = f"{text} {word}".strip()
+        queries.append((text, row))
+    return queries
+
+
+def bench_retrieval(index_path: str, n_queries: int, k: int, embed_latency_ms: float, query_chars: int, live: bool):
+    import numpy as np
+    from vector_index import MmapVectorStore
+    from retrieval import HybridRetriever, MODES, MODE_VECTOR
+    from ingest import tag_sections
+
+    print_separator(f"검색 모드 비교 ({index_path}, 질의 {n_queries}개, k={k}, {'실제 임베딩' if live else '근사'})")
+    if not live:
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline-bench")
+        os.environ.setdefault("GOOGLE_API_KEY", "offline-bench")
+    import final  # CHARACTER_INFO (캐릭터 샤드), --live 면 임베딩
+    characters = list(final.CHARACTER_INFO)
+    if live:
+        if final.embeddings is None:
+            raise SystemExit("임베딩을 초기화하지 못했습니다. LLM_PROVIDER / API 키를 확인하세요.")
+        store = MmapVectorStore.load(index_path, final.embeddings.base)
+    else:
+        store = MmapVectorStore.load(index_path, None)
+    documents = store.docstore.all()
+    queries = _sample_queries(documents, n_queries, query_chars)
+    if not live:
+        vectors = store.vectors()
+        proxy = _ProxyQueryEmbeddings({q: vectors[row] for q, row in queries}, embed_latency_ms / 1000)
+        store = MmapVectorStore(proxy, store.index, store.docstore, store.manifest, store.path)
+        print(f"  (질의 임베딩 왕복 {embed_latency_ms:.0f}ms 가정)")
+    retriever = HybridRetriever.build(store, characters=characters)
+
+    # 청크 -> 멤버 태그 (태그 없는 예전 인덱스는 retriever 와 같은 방식으로 섹션 머리글에서)
+    if "characters" not in store.manifest:
+        tag_sections(documents, characters)
+    tags = {doc.page_content: doc.metadata.get("characters") or [] for doc in documents}
+    query_character = [(tags[documents[row].page_content] or [None])[0] for _, row in queries]
+
+    async def run(mode, sharded):
+        latencies, results = [], []
+        for (query, _), character in zip(queries, query_character):
+            start = time.perf_counter()
+            docs = await retriever.asearch(query, k=k, mode=mode, character=character if sharded else None)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append([doc.page_content for doc in docs])
+        return latencies, results
+
+    runs = {(mode, sharded): asyncio.run(run(mode, sharded)) for mode in MODES for sharded in (False, True)}
+    baseline = runs[(MODE_VECTOR, False)][1]
+    print(f"  캐릭터 샤드 크기: {retriever.stats()['shards']} (전체 {len(documents)}개)")
+    print(f"  {'모드':8} | {'범위':4} | {'p50 ms':>8} | {'p95 ms':>8} | {'vector 와 겹침@k':>15} | "
+          f"{'원본 청크 포함@k':>16} | {'같은 멤버 청크 비율':>18}")
+    for (mode, sharded), (latencies, results) in runs.items():
+        overlap = np.mean([len(set(r) & set(b)) / max(1, len(b)) for r, b in zip(results, baseline)])
+        hit = np.mean([documents[row].page_content in r for r, (_, row) in zip(results, queries)])
+        # 질의의 멤버 섹션이거나 공용 청크인 결과의 비율 (다른 멤버 청크가 컨텍스트 예산을 차지하지 않는지)
+        on_topic = np.mean([
+            np.mean([not tags[c] or character in tags[c] for c in r]) if r else 0.0
+            for r, character in zip(results, query_character) if character
+        ])
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(f"  {mode:8} | {'샤드' if sharded else '전체':4} | {p50:8.2f} | {p95:8.2f} | {overlap:15.2f} | "
+              f"{hit:16.2f} | {on_topic:18.2f}")
+
+
+# 검색 품질: 정답 청크를 표시한 질의 세트로 recall@k / MRR (검색 방식을 바꿀 때마다 전후 비교용)
+
+class _HashEmbeddings:
+    """
+    네트워크 없이 쓰는 결정적 임베딩: 문자 n-gram(retrieval.char_ngrams) 을 부호 있는 해시로 dim 칸에 모은 뒤 정규화.
+    의미는 모르고 글자 겹침만 보므로 절대값보다는 같은 조건에서의 전후 비교용
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _embed(self, text: str):
+        import numpy as np
+        from retrieval import char_ngrams
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for gram, tf in Counter(char_ngrams(text)).items():
+            h = zlib.crc32(gram.encode("utf-8"))  # hash() 는 프로세스마다 달라서 crc32
+            vector[h % self.dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(tf))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def _load_labeled_queries(path: str):
+    """jsonl 한 줄: {"character", "message", "expected": [정답 청크에 들어 있는 문구, ...]}"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _compact(text: str) -> str:
+    # PDF 추출 텍스트는 줄바꿈/공백이 제각각이라 공백을 모두 지우고 비교
+    return "".join(text.split())
+
+
+def bench_rag(index_path: str, queries_path: str, k: int, dim: int, index_spec: str, repeat: int, misses: int,
+              live: bool):
+    import numpy as np
+    from vector_index import MmapVectorStore, build_index
+    from retrieval import HybridRetriever, MODES
+
+    labeled = _load_labeled_queries(queries_path)
+    embedding_label = "실제 임베딩" if live else f"해시 임베딩 {dim}차원, {index_spec}"
+    print_separator(f"검색 품질 ({index_path}, 질의 {len(labeled)}개, k={k}, {embedding_label})")
+    if not live:
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline-bench")
+        os.environ.setdefault("GOOGLE_API_KEY", "offline-bench")
+    import final  # CHARACTER_INFO (캐릭터 샤드), --live 면 임베딩
+    if live:
+        if final.embeddings is None:
+            raise SystemExit("임베딩을 초기화하지 못했습니다. LLM_PROVIDER / API 키를 확인하세요.")
+        store = MmapVectorStore.load(index_path, final.embeddings.base)
+    else:
+        # 저장된 벡터는 원격 임베딩 모델 것이라 질의와 비교할 수 없음 -> 같은 청크를 해시 임베딩으로 다시 색인
+        store = MmapVectorStore.load(index_path, None)
+        embedding = _HashEmbeddings(dim)
+        texts = [doc.page_content for doc in store.docstore.all()]
+        index = build_index(np.array(embedding.embed_documents(texts), dtype=np.float32), index_spec)
+        store = MmapVectorStore(embedding, index, store.docstore, store.manifest, store.path)
+    retriever = HybridRetriever.build(store, characters=list(final.CHARACTER_INFO))
+    chunks = [_compact(doc.page_content) for doc in store.docstore.all()]
+
+    # 질의마다 정답 문구 -> 그 문구가 들어 있는 청크 행 번호 (청크 겹침 때문에 여러 개일 수 있음)
+    targets = []
+    for item in labeled:
+        phrases = [{row for row, chunk in enumerate(chunks) if _compact(phrase) in chunk} for phrase in item["expected"]]
+        targets.append([rows for rows in phrases if rows])
+    stale = sum(len(item["expected"]) - len(rows) for item, rows in zip(labeled, targets))
+    if stale:
+        print(f"  ⚠️ 어느 청크에도 없는 정답 문구 {stale}개 (PDF 가 바뀌었으면 {queries_path} 갱신 필요) - recall 분모에서 제외")
+
+    print(f"  {'모드':8} | {'범위':4} | {'recall@k':>8} | {'MRR':>6} | {'p50 ms':>8} | {'p99 ms':>8}")
+    for mode in MODES:
+        for sharded in (False, True):
+            latencies, recalls, reciprocal_ranks, missed = [], [], [], []
+            for item, phrases in zip(labeled, targets):
+                character = item["character"] if sharded else None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    rows = retriever.search_rows(item["message"], k=k, mode=mode, character=character)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                if not phrases:
+                    continue
+                recalls.append(np.mean([bool(target & set(rows)) for target in phrases]))
+                relevant = set().union(*phrases)
+                rank = next((i + 1 for i, row in enumerate(rows) if row in relevant), None)
+                reciprocal_ranks.append(1 / rank if rank else 0.0)
+                if rank is None:
+                    missed.append(item)
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"  {mode:8} | {'샤드' if sharded else '전체':4} | {np.mean(recalls):8.3f} | "
+                  f"{np.mean(reciprocal_ranks):6.3f} | {p50:8.2f} | {p99:8.2f}")
+            for item in missed[:misses]:
+                print(f"      놓침: [{item['character']}] {item['message']}")
+    if not live:
+        print("  (지연시간은 로컬 해시 임베딩 포함 검색 시간 - 원격 질의 임베딩 왕복은 benchmark.py retrieval 참고)")
+
+
+# 콜드 스타트: `python -X importtime -c "import final"` 분석
+
+# 기본 설정(openai, PDF 인덱스 이미 있음)에서 final.py 가 import 시점에 직접 불러오면 안 되는 모듈
+# (langchain_core 등 다른 패키지가 내부적으로 불러오는 것은 제외)
+LAZY_MODULES = [
+    "langchain_google_genai", "langchain_community", "langchain_text_splitters", "pypdf", "faiss", "tavily",
+]
+
+
+def _parse_importtime(stderr: str):
+    """-X importtime 출력 -> [(모듈, self_us, cumulative_us, 깊이)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def bench_imports(max_ms, top: int):
+    print_separator("콜드 스타트 - final.py import 시간 (-X importtime)")
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-offline-bench")
+    env.setdefault("GOOGLE_API_KEY", "offline-bench")
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import final"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    wall = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        sys.exit(proc.returncode)
+
+    rows = _parse_importtime(proc.stderr)
+    top_level = {}
+    for name, _, cumulative_us, depth in rows:
+        if depth == 1:
+            root = name.split(".")[0]
+            top_level[root] = top_level.get(root, 0) + cumulative_us
+    total_ms = next(cumulative_us for name, _, cumulative_us, depth in rows if name == "final" and depth == 0) / 1000
+
+    print(f"  {'최상위 패키지':30} | {'누적 ms':>8}")
+    for root, us in sorted(top_level.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"  {root:30} | {us / 1000:8.1f}")
+    print(f"  {'import final (모듈 초기화 포함)':30} | {total_ms:8.1f}")
+    print(f"  {'프로세스 전체':30} | {wall:8.1f}")
+
+    eager = [m for m in LAZY_MODULES if m in top_level]
+    print(f"  지연 import 대상 중 미리 로드된 모듈: {', '.join(eager) if eager else '없음'}")
+
+    failed = bool(eager)
+    if max_ms is not None and total_ms > max_ms:
+        print(f"  ❌ import 시간 {total_ms:.0f}ms > 기준 {max_ms:.0f}ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="무도연애상담소 오프라인 벤치마크")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_sessions = sub.add_parser("sessions", help="세션 저장소 요청당 비용 (memory / sqlite 워커 수별)")
+    p_sessions.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    p_sessions.add_argument("--requests", type=int, default=4000)
+
+    p_history = sub.add_parser("history", help="대화 내역 압축 전후 턴별 프롬프트 토큰")
+    p_history.add_argument("--turns", type=int, default=50)
+
+    p_index = sub.add_parser("index", help="벡터 인덱스 로드 시간 / 워커별 메모리 (FAISS pickle vs mmap)")
+    p_index.add_argument("--workers", type=int, default=4)
+    p_index.add_argument("--vectors", type=int, default=20000)
+    p_index.add_argument("--dim", type=int, default=1536)
+
+    p_compress = sub.add_parser("compress", help="압축 인덱스(IVF/PQ/OPQ/SQ) recall@k / 지연시간 / 크기 비교")
+    p_compress.add_argument("--index", default="vector_index_openai")
+    p_compress.add_argument("--specs", default=None, help="쉼표 대신 ';' 로 구분한 index_factory 문자열 (기본: 코퍼스 크기에 맞춘 후보)")
+    p_compress.add_argument("--k", type=int, default=10)
+    p_compress.add_argument("--queries", type=int, default=500)
+    p_compress.add_argument("--vectors", type=int, default=None, help="합성 코퍼스 크기")
+    p_compress.add_argument("--nprobe", type=int, default=8)
+
+    p_retrieval = sub.add_parser("retrieval", help="검색 모드별 지연시간 / vector 결과와 겹치는 정도")
+    p_retrieval.add_argument("--index", default="vector_index_openai")
+    p_retrieval.add_argument("--queries", type=int, default=200)
+    p_retrieval.add_argument("--k", type=int, default=3)
+    p_retrieval.add_argument("--embed-latency-ms", type=float, default=250, help="근사 모드의 질의 임베딩 왕복 시간")
+    p_retrieval.add_argument("--query-chars", type=int, default=40, help="청크에서 잘라 올 질의 길이")
+    p_retrieval.add_argument("--live", action="store_true", help="final.py 설정의 실제 임베딩으로 질의 임베딩 (API 키 필요)")
+
+    p_rag = sub.add_parser("rag", help="정답 표시 질의 세트로 검색 품질(recall@k / MRR) / 지연시간")
+    p_rag.add_argument("--index", default="vector_index_openai")
+    p_rag.add_argument("--queries", default="rag_eval_queries.jsonl", help="jsonl ({character, message, expected} 한 줄씩)")
+    p_rag.add_argument("--k", type=int, default=3)
+    p_rag.add_argument("--dim", type=int, default=256, help="해시 임베딩 차원")
+    p_rag.add_argument("--spec", default="Flat", help="해시 임베딩으로 만들 인덱스 종류 (index_factory 문자열)")
+    p_rag.add_argument("--repeat", type=int, default=5, help="지연시간 측정용 질의당 반복 횟수")
+    p_rag.add_argument("--misses", type=int, default=0, help="정답을 못 찾은 질의를 모드별로 몇 개까지 출력할지")
+    p_rag.add_argument("--live", action="store_true", help="저장된 인덱스 + final.py 설정의 실제 임베딩 (API 키 필요)")
+
+    p_imports = sub.add_parser("imports", help="final.py import 시간 (회귀 확인용, 실패 시 exit 1)")
+    p_imports.add_argument("--max-ms", type=float, default=None, help="import 합계 허용 기준 (ms)")
+    p_imports.add_argument("--top", type=int, default=15)
+
+    p_post = sub.add_parser("postprocess", help="응답 후처리 속도 (+ 이전 구현과 결과 비교)")
+    p_post.add_argument("--corpus", default=None, help="원본 응답 jsonl ({character, raw} 한 줄씩)")
+    p_post.add_argument("--baseline", default=None, help="비교할 이전 postprocessing.py 경로")
+    p_post.add_argument("--samples", type=int, default=2000, help="--corpus 가 없을 때 만드는 샘플 수")
+    p_post.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "sessions":
+        bench_sessions(args.workers, args.requests)
+    elif args.command == "history":
+        bench_history(args.turns)
+    elif args.command == "index":
+        bench_index(args.workers, args.vectors, args.dim)
+    elif args.command == "compress":
+        specs = [spec.strip() for spec in args.specs.split(";")] if args.specs else None
+        bench_compress(args.index, specs, args.k, args.queries, args.vectors, args.nprobe)
+    elif args.command == "retrieval":
+        bench_retrieval(args.index, args.queries, args.k, args.embed_latency_ms, args.query_chars, args.live)
+    elif args.command == "rag":
+        bench_rag(args.index, args.queries, args.k, args.dim, args.spec, args.repeat, args.misses, args.live)
+    elif args.command == "imports":
+        bench_imports(args.max_ms, args.top)
+    elif args.command == "postprocess":
+        bench_postprocess(args.corpus, args.baseline, args.samples, args.repeat)
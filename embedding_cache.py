@@ -0,0 +1,147 @@
+### 검색 쿼리 임베딩 캐시 (메모리 LRU + 선택적 SQLite 디스크 저장소) ###
+
+from __future__ import annotations
+import asyncio
+import hashlib
+import re
+import sqlite3
+import unicodedata
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query_text(text: str) -> str:
+    t = unicodedata.normalize("NFC", text or "")
+    t = re.sub(r"\s+", " ", t)
+    return t.strip().lower()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    임베딩 객체 앞에 두는 캐시 레이어.
+    - embed_query / aembed_query 결과를 (provider, model, 정규화 텍스트) 키로 캐시
+    - 메모리 LRU(max_size) + 선택적 디스크 저장소(disk_path, SQLite)
+    - 디스크 파일은 처음 조회할 때 열림 (import 만으로는 파일이 생기지 않음)
+    - aembed_query 의 디스크 조회/저장은 스레드에서 실행해서 이벤트 루프를 막지 않음
+    - embed_documents 는 그대로 통과 (인덱스 구축용이라 캐시 대상 아님)
+    """
+
+    def __init__(self, base: Embeddings, provider: str, model: str = "",
+                 max_size: int = 1024, disk_path: Optional[str] = None):
+        self.base = base
+        self.provider = provider
+        self.model = model or getattr(base, "model", "") or ""
+        self.max_size = max_size
+        self.disk_path = disk_path
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = Lock()      # LRU / 카운터 (짧게만 잡음)
+        self._db_lock = Lock()   # SQLite 연결 (디스크 I/O 동안 잡힘, 이벤트 루프에서는 잡지 않음)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        """_db_lock 을 잡은 상태에서 호출"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.provider}\x00{self.model}\x00{normalize_query_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _memory_lookup(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+            return vec
+
+    def _disk_lookup(self, key: str) -> Optional[List[float]]:
+        """메모리에 없을 때 디스크 조회. 디스크에도 없으면 miss 로 셈"""
+        vec = None
+        if self.disk_path:
+            with self._db_lock:
+                row = self._conn().execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+            if row:
+                vec = array("d", row[0]).tolist()
+        with self._lock:
+            if vec is None:
+                self.misses += 1
+            else:
+                self._remember(key, vec)
+                self.disk_hits += 1
+        return vec
+
+    def _remember(self, key: str, vec: List[float]):
+        """_lock 을 잡은 상태에서 호출"""
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _disk_store(self, key: str, vec: List[float]):
+        with self._db_lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                (key, array("d", vec).tobytes()),
+            )
+            db.commit()
+
+    def _store(self, key: str, vec: List[float]):
+        with self._lock:
+            self._remember(key, vec)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._memory_lookup(key)
+        if vec is None:
+            vec = self._disk_lookup(key)
+        if vec is None:
+            vec = self.base.embed_query(text)
+            self._store(key, vec)
+            if self.disk_path:
+                self._disk_store(key, vec)
+        return vec
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vec = self._memory_lookup(key)
+        if vec is None:
+            vec = await asyncio.to_thread(self._disk_lookup, key) if self.disk_path else self._disk_lookup(key)
+        if vec is None:
+            vec = await self.base.aembed_query(text)
+            self._store(key, vec)
+            if self.disk_path:
+                await asyncio.to_thread(self._disk_store, key, vec)
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.base.aembed_documents(texts)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._lru),
+                "hit_rate": round((self.hits + self.disk_hits) / total, 4) if total else 0.0,
+            }
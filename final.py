@@ -1,39 +1,97 @@
 import os
+import asyncio
 import uvicorn
 import re
-import time
-import uuid
-from threading import Lock
-from fastapi import FastAPI, HTTPException
+import json
+import secrets
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional, List
 from dotenv import load_dotenv
 
 # LLM Provider Libraries
+# provider SDK / PDF 로더 / FAISS / Tavily 는 실제로 쓰는 코드 경로에서만 import (콜드 스타트 단축)
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from tavily import TavilyClient
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from fastapi.middleware.cors import CORSMiddleware 
 
-from postprocessing import postprocess_response
+from postprocessing import postprocess_llm_output, StreamingPostprocessor
+from embedding_cache import CachedQueryEmbeddings
+from search_cache import SingleFlightTTLCache
+from response_cache import ResponseVariantCache, normalize_message
+from session_store import InMemorySessionStore, SQLiteSessionStore
+from prompt_budget import PromptSection, TokenCounter, PromptTokenStats, fit_sections
+from history_summary import SUMMARY_PROMPT, compact_session_history, format_history_with_summary
+from llm_router import HedgedChatModel
+from message_router import TrivialMessageClassifier, RouteStats, ROUTE_FULL, ROUTE_TRIVIAL
+from admission import AdmissionController, AdmissionRejected, PRIORITY_ONGOING, PRIORITY_NEW, PRIORITY_BATCH
 
 # Hyperparameters & Configurations
 LLM_PROVIDER = "openai" # google / openai 중 택1
+LLM_FALLBACK_PROVIDER = None    # 보조 백엔드 (google / openai / None). 주 백엔드가 느리면 헤지, 에러면 페일오버
+LLM_HEDGE_AFTER_SECONDS = 4.0   # 주 백엔드 지연 표본이 쌓이기 전 헤지 기준 (None 이면 헤지 없이 페일오버만)
+LLM_HEDGE_PERCENTILE = 0.95     # 표본이 쌓이면 주 백엔드 최근 지연시간의 이 분위수를 헤지 기준으로 사용
+TRIVIAL_ROUTE_ENABLED = True    # 인사/감사/맞장구 같은 가벼운 메시지는 RAG 없이 축약 프롬프트 + 작은 모델로 처리
+TRIVIAL_GOOGLE_MODEL_NAME = "gemini-2.5-flash-lite"
+TRIVIAL_OPENAI_MODEL_NAME = "gpt-4.1-nano"
+TRIVIAL_HISTORY_LINES = 4       # 가벼운 메시지 프롬프트에 넣을 최근 대화 줄 수
 GOOGLE_MODEL_NAME = "gemini-2.5-flash" 
 OPENAI_MODEL_NAME = "gpt-4o-mini"      
 Temperature = 0.85
 SESSION_TTL_SECONDS = 30 * 60 
+SESSION_MAX_COUNT = 10000               # 동시에 유지할 최대 세션 수 (초과 시 가장 오래 안 쓴 세션부터 제거)
+SESSION_MAX_BYTES = 64 * 1024 * 1024    # 전체 히스토리 최대 용량 (memory 저장소)
+SESSION_STORE = "memory"                # memory / sqlite 중 택1 (워커 2개 이상이면 sqlite 필수)
+SESSION_DB_PATH = "./sessions.sqlite"
+UVICORN_WORKERS = 1
 MAX_HISTORY_LINES = 80         
+HISTORY_COMPACTION_ENABLED = True
+HISTORY_COMPACT_TRIGGER_LINES = 16  # 히스토리가 이 줄 수를 넘으면 오래된 턴을 요약으로 접음
+HISTORY_KEEP_RECENT_LINES = 8       # 원문 그대로 남길 최근 줄 수 (User/캐릭터 한 쌍 = 2줄)
+HISTORY_SUMMARY_MAX_CHARS = 600
+RAG_TIMEOUT_SECONDS = 3.0
+WEB_SEARCH_TIMEOUT_SECONDS = 5.0
+SEARCH_CACHE_TTL_SECONDS = 60 * 60
+SEARCH_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_ENABLED = False  # 첫 턴(대화 내역 없음) 응답 캐시 사용 여부 (opt-in)
+RESPONSE_CACHE_VARIANTS = 3     # 키마다 모아서 돌려쓸 서로 다른 응답 수
+RESPONSE_CACHE_MAX_KEYS = 2000
+PROMPT_TOKEN_BUDGET = 4500      # 프롬프트 + 답변 전체 토큰 예산
+PROMPT_OUTPUT_RESERVE_TOKENS = 500  # 그중 답변용으로 남겨 둘 토큰 (프롬프트에는 나머지만 사용)
+TOKENIZER_MODE = "auto"         # auto(tiktoken, 안 되면 근사치 + 경고) / tiktoken(안 되면 시작 실패) / approx(항상 근사치)
+TIKTOKEN_CACHE_DIR = "./tiktoken_cache"  # tiktoken 인코딩 파일 캐시. 오프라인 배포 시 미리 채워 둘 것
+PROMPT_SECTION_PRIORITY = ["system", "user_message", "web_search", "rag", "summary", "history"] # 예산 배분 순서
+BATCH_MAX_ITEMS = 200           # /chat/batch 한 번에 받을 최대 요청 수
+BATCH_MAX_CONCURRENCY = 8       # /chat/batch 에서 동시에 보낼 LLM 호출 수 (요청에서 더 낮게 지정 가능)
+LLM_MAX_CONCURRENCY = 16        # 동시에 진행할 LLM 호출 수 (워커 프로세스당)
+LLM_MAX_QUEUE = 64              # LLM 호출 대기열 길이 (가득 차면 429 + Retry-After)
+LLM_QUEUE_TIMEOUT_SECONDS = 10.0
+LLM_PRIORITIZE_ONGOING = True   # 대기열에서 진행 중인 대화(히스토리 있음)를 새 세션보다 먼저 처리
+RAW_RESPONSE_LOG_PATH = None    # 경로를 지정하면 LLM 원본 응답을 jsonl 로 기록 (후처리 벤치마크 코퍼스용)
 
 # RAG Config
-PDF_PATH = "./data/document.pdf"
-VECTOR_DB_PATH = f"./vector_db_{LLM_PROVIDER}" 
+DATA_DIR = "./data"             # 상담 자료 PDF 폴더 (추가/변경 후 python ingest.py 로 증분 수집)
+VECTOR_DB_PATH = f"./vector_db_{LLM_PROVIDER}"         # 예전 LangChain FAISS 형식 (index.pkl). 있으면 시작 시 한 번 변환
+VECTOR_INDEX_PATH = f"./vector_index_{LLM_PROVIDER}"   # mmap 인덱스 + SQLite 문서 저장소 (pickle 없음)
+VECTOR_INDEX_TYPE = "Flat"      # faiss index_factory 문자열. Flat(정확) / SQfp16 / SQ8 / IVF64,SQ8 / OPQ96,PQ96 ... (benchmark.py compress 로 비교)
+VECTOR_INDEX_NPROBE = 8         # IVF 인덱스에서 검색할 클러스터 수
+RAG_QUERY_K = 3
+PERSONA_CONTEXT_K = 2           # 캐릭터별로 미리 계산해 두는 페르소나 청크 수
+RAG_CONTEXT_MAX_CHARS = 1500
+RAG_PERSONA_MAX_CHARS = 500     # 질문 검색 결과와 함께 넣을 때 페르소나 청크에 쓰는 최대 글자 수 (나머지는 질문 검색 결과 몫)
+EMBEDDING_CACHE_SIZE = 2048
+EMBEDDING_CACHE_PATH = f"./embedding_cache_{LLM_PROVIDER}.sqlite" # None 이면 메모리 캐시만 사용
+RAG_RETRIEVAL_MODE = "hybrid"   # vector / hybrid(BM25 + 벡터) / lexical(BM25 만, 네트워크 호출 없음) 중 택1
+RAG_EMBED_TIMEOUT_SECONDS = 1.5 # 질의 임베딩이 이보다 늦거나 실패하면 BM25 결과로 대신 응답
+RAG_LEXICAL_WEIGHT = 1.0        # hybrid 에서 BM25 순위의 가중치 (벡터 순위 = 1.0)
+RAG_CHARACTER_SHARDS = True     # 캐릭터별로 그 멤버 섹션 청크 + 공용 청크 안에서만 검색
+INDEX_AUTO_REBUILD = True       # 시작 시 인덱스가 PDF/임베딩 모델/청크 설정과 다르면 백그라운드에서 재구축 (그동안 기존 인덱스로 응답)
+INDEX_RELOAD_CHECK_SECONDS = 30.0   # 다른 워커/ingest.py 가 교체한 인덱스를 따라가기 위해 manifest 를 확인하는 주기
 
 load_dotenv(override=True)
 
@@ -51,7 +109,26 @@ elif LLM_PROVIDER == "openai":
 if not os.getenv("TAVILY_API_KEY"):
     print("Warning: TAVILY_API_KEY is not set. Web search will be disabled.")
 
-app = FastAPI(title=f"무도연애상담소 Server ({LLM_PROVIDER.upper()} + RAG)")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # /admin/* 용. 없으면 /admin/* 전체가 꺼짐 (로컬 요청도 거부)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 워커 프로세스마다 실행됨 (workers > 1 이면 __main__ 블록은 워커에서 실행되지 않음)
+    # 토크나이저는 import 가 아니라 여기서 불러옴 (내려받기/근사치 전환 경고가 첫 요청 전에 끝나도록)
+    print(f"[토큰] 토크나이저: {token_counter.load()}")
+    for persona in character_prompts.values():
+        static_prefix_tokens(persona)
+    if vectorstore is None:
+        initialize_rag()
+    rebuild_task = None
+    if index_manager is not None and INDEX_AUTO_REBUILD:
+        # 오래된 인덱스면 기존 인덱스로 응답하면서 백그라운드에서 재구축 후 교체
+        rebuild_task = index_manager.start_rebuild()
+    yield
+    if rebuild_task is not None and not rebuild_task.done():
+        rebuild_task.cancel()
+
+app = FastAPI(title=f"무도연애상담소 Server ({LLM_PROVIDER.upper()} + RAG)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -65,67 +142,179 @@ app.add_middleware(
 llm = None
 embeddings = None
 
+def build_chat_model(provider: str, model_name: Optional[str] = None):
+    if provider == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(model=model_name or GOOGLE_MODEL_NAME, temperature=Temperature)
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=model_name or OPENAI_MODEL_NAME, temperature=Temperature)
+    return None
+
+def build_embeddings(provider: str):
+    if provider == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    return None
+
+def has_api_key(provider: str) -> bool:
+    if provider == "google":
+        return bool(os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY"))
+    return bool(os.getenv("OPENAI_API_KEY"))
+
 print(f"🔄 현재 설정된 LLM Provider: [{LLM_PROVIDER.upper()}]")
 
 if LLM_PROVIDER == "google":
-    llm = ChatGoogleGenerativeAI(
-        model=GOOGLE_MODEL_NAME,
-        temperature=Temperature
-    )
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+    llm = build_chat_model("google")
+    embeddings = build_embeddings("google")
     print(f"✅ Google Gemini & Embeddings 로드 완료!")
 
 elif LLM_PROVIDER == "openai":
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL_NAME,
-        temperature=Temperature
-    )
-    embeddings = OpenAIEmbeddings()
+    llm = build_chat_model("openai")
+    embeddings = build_embeddings("openai")
     print(f"✅ OpenAI GPT & Embeddings 로드 완료!")
 
-# Tavily Client Initialization
+# 보조 백엔드 (임베딩/벡터 DB 는 주 백엔드 것을 계속 사용)
+if llm is not None and LLM_FALLBACK_PROVIDER and LLM_FALLBACK_PROVIDER != LLM_PROVIDER:
+    if LLM_FALLBACK_PROVIDER == "google" and not os.getenv("GOOGLE_API_KEY") and os.getenv("GEMINI_API_KEY"):
+        os.environ["GOOGLE_API_KEY"] = os.getenv("GEMINI_API_KEY")
+    if has_api_key(LLM_FALLBACK_PROVIDER):
+        llm = HedgedChatModel(
+            primary=llm,
+            secondary=build_chat_model(LLM_FALLBACK_PROVIDER),
+            primary_name=LLM_PROVIDER,
+            secondary_name=LLM_FALLBACK_PROVIDER,
+            hedge_after_seconds=LLM_HEDGE_AFTER_SECONDS,
+            hedge_percentile=LLM_HEDGE_PERCENTILE
+        )
+        print(f"✅ 보조 LLM [{LLM_FALLBACK_PROVIDER.upper()}] 연결 (헤지/페일오버)")
+    else:
+        print(f"Warning: {LLM_FALLBACK_PROVIDER} API 키가 없어 보조 LLM 없이 실행합니다.")
+
+# 가벼운 메시지용 작은 모델 (None 이면 기본 llm 사용)
+fast_llm = None
+if llm is not None and TRIVIAL_ROUTE_ENABLED:
+    fast_llm = build_chat_model(
+        LLM_PROVIDER, TRIVIAL_GOOGLE_MODEL_NAME if LLM_PROVIDER == "google" else TRIVIAL_OPENAI_MODEL_NAME
+    )
+
+# 검색 쿼리 임베딩 캐시 (같은 문구면 원격 임베딩 호출 생략)
+if embeddings is not None:
+    embeddings = CachedQueryEmbeddings(
+        embeddings,
+        provider=LLM_PROVIDER,
+        max_size=EMBEDDING_CACHE_SIZE,
+        disk_path=EMBEDDING_CACHE_PATH
+    )
+
+# Tavily Client Initialization (async 클라이언트 - 이벤트 루프를 막지 않음)
 tavily_client = None
 if os.getenv("TAVILY_API_KEY"):
-    tavily_client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+    from tavily import AsyncTavilyClient
+    tavily_client = AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+search_cache = SingleFlightTTLCache(SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_MAX_ENTRIES)
+
+# Prompt Token Budget
+llm_admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_SECONDS)
+token_counter = TokenCounter(OPENAI_MODEL_NAME, TOKENIZER_MODE, TIKTOKEN_CACHE_DIR)
+prompt_token_stats = PromptTokenStats()
 
 
 # RAG Initialization
 vectorstore = None
+persona_docs = {}   # 캐릭터 -> 인덱스를 불러올 때 미리 검색해 둔 페르소나 청크
+rag_retriever = None    # vectorstore + BM25 색인 (retrieval.HybridRetriever)
+index_manager = None    # 인덱스 버전 확인 / 백그라운드 재구축 / 교체 (index_manager.VectorIndexManager)
 
 def initialize_rag():
-    global vectorstore, embeddings
+    global index_manager
     if embeddings is None: return
 
     try:
-        if os.path.exists(VECTOR_DB_PATH):
-            print(f"[RAG] 기존 벡터 DB 로드 중: {VECTOR_DB_PATH}")
-            vectorstore = FAISS.load_local(VECTOR_DB_PATH, embeddings, allow_dangerous_deserialization=True)
-            print(f"[RAG] 벡터 DB 로드 완료!")
-        elif os.path.exists(PDF_PATH):
-            print(f"[RAG] PDF 문서 로드 중: {PDF_PATH}")
-            loader = PyPDFLoader(PDF_PATH)
-            documents = loader.load()
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-            splits = text_splitter.split_documents(documents)
-            vectorstore = FAISS.from_documents(splits, embeddings)
-            vectorstore.save_local(VECTOR_DB_PATH)
-            print(f"[RAG] 벡터 DB 생성 및 저장 완료.")
-        else:
-            print(f"[RAG 경고] PDF 없음. RAG 비활성화.")
-            vectorstore = None
+        from index_manager import VectorIndexManager
+        index_manager = VectorIndexManager(
+            VECTOR_INDEX_PATH, DATA_DIR, embeddings,
+            legacy_path=VECTOR_DB_PATH,
+            prepare=prepare_rag,
+            on_swap=set_vectorstore,
+            check_interval=INDEX_RELOAD_CHECK_SECONDS,
+            characters=list(CHARACTER_INFO),
+            index_spec=VECTOR_INDEX_TYPE,
+            nprobe=VECTOR_INDEX_NPROBE
+        )
+        index_manager.load_initial()
     except Exception as e:
         print(f"[RAG 에러] 초기화 실패: {str(e)}")
-        vectorstore = None
+        set_vectorstore(None, None)
+
+def prepare_rag(store) -> tuple:
+    """새 인덱스마다 한 번 (교체 전에 스레드에서 실행): 같은 청크로 BM25 색인을 만들고 페르소나 청크를 미리 검색"""
+    from retrieval import HybridRetriever
+    retriever = HybridRetriever.build(
+        store,
+        characters=list(CHARACTER_INFO) if RAG_CHARACTER_SHARDS else (),
+        mode=RAG_RETRIEVAL_MODE,
+        embed_timeout=RAG_EMBED_TIMEOUT_SECONDS,
+        lexical_weight=RAG_LEXICAL_WEIGHT
+    )
+    return retriever, load_persona_contexts(retriever)
 
-def get_character_context(character: str, query: str = "") -> str:
-    if not vectorstore: return ""
+def load_persona_contexts(retriever) -> dict:
+    """CHARACTER_INFO 멤버별 기본 페르소나 청크를 인덱스마다 한 번만 검색해 둠"""
+    from retrieval import MODE_LEXICAL
+    loaded = {}
+    for character in CHARACTER_INFO:
+        try:
+            loaded[character] = retriever.search(character, k=PERSONA_CONTEXT_K, character=character)
+        except Exception as e:
+            # 임베딩 API 가 안 되면 BM25 로라도 준비
+            print(f"[RAG 에러] {character} 페르소나 컨텍스트 준비 실패 - BM25 로 대신 준비: {str(e)}")
+            loaded[character] = retriever.search(
+                character, k=PERSONA_CONTEXT_K, mode=MODE_LEXICAL, character=character
+            )
+    print(f"[RAG] 페르소나 컨텍스트 준비 완료 ({len(loaded)}명)")
+    return loaded
+
+def set_vectorstore(store, prepared: Optional[tuple]):
+    """인덱스 교체. 전역을 await 없이 함께 바꿔서 요청이 새 인덱스와 옛 BM25 색인/페르소나 청크를 섞어 쓰지 않게 함"""
+    global vectorstore, rag_retriever, persona_docs
+    retriever, docs = prepared or (None, {})
+    vectorstore, rag_retriever, persona_docs = store, retriever, docs
+
+def clip_context(text: str, max_chars: int) -> str:
+    return text[:max_chars] + "..." if len(text) > max_chars else text
+
+def merge_context_docs(base_docs: list, extra_docs: list) -> str:
+    """
+    질문 검색 결과(중복 제외)를 앞에, 페르소나 청크를 뒤에 둠.
+    페르소나는 RAG_PERSONA_MAX_CHARS 까지만 쓰고 나머지 예산은 질문 검색 결과에 줘서 긴 페르소나 청크에 밀려 잘리지 않게 함
+    """
+    seen = {doc.page_content for doc in base_docs}
+    extra_docs = [doc for doc in extra_docs if doc.page_content not in seen]
+    persona = clip_context("\n\n".join(doc.page_content for doc in base_docs), RAG_PERSONA_MAX_CHARS)
+    hits = clip_context("\n\n".join(doc.page_content for doc in extra_docs),
+                        max(RAG_CONTEXT_MAX_CHARS - len(persona), 0))
+    return "\n\n".join(part for part in (hits, persona) if part)
+
+async def get_character_context(character: str, query: str = "") -> str:
+    # 검색 도중 인덱스가 교체되어도 이 요청은 시작할 때의 인덱스로 끝까지 처리
+    retriever, personas = rag_retriever, persona_docs
+    if not retriever: return ""
     try:
-        search_query = f"{character} {query}" if query else character
-        docs = vectorstore.similarity_search(search_query, k=3)
-        if docs:
-            context = "\n\n".join([doc.page_content for doc in docs])
-            return context[:1500] + "..." if len(context) > 1500 else context
-        return ""
+        base_docs = personas.get(character)
+        if base_docs is None:
+            search_query = f"{character} {query}" if query else character
+            # BM25 는 로컬, 임베딩은 aembed_query, FAISS 검색은 executor 에서 실행됨
+            docs = await retriever.asearch(search_query, k=RAG_QUERY_K, character=character)
+            return clip_context("\n\n".join(doc.page_content for doc in docs), RAG_CONTEXT_MAX_CHARS)
+        # 길이가 아니라 내용으로 판단: 인사/감사/맞장구만 있는 메시지는 검색할 거리가 없음
+        if not query.strip() or trivial_classifier.classify(query):
+            return clip_context("\n\n".join(doc.page_content for doc in base_docs), RAG_CONTEXT_MAX_CHARS)
+        extra_docs = await retriever.asearch(query, k=RAG_QUERY_K, character=character)
+        return merge_context_docs(base_docs, extra_docs)
     except Exception as e:
         print(f"[RAG 검색 에러] {str(e)}")
         return ""
@@ -232,44 +421,163 @@ CHARACTER_INFO = {
     }
 }
 
+# Character Prompt Templates
+# 프롬프트 앞부분(캐릭터 페르소나 + 규칙)은 캐릭터별로 바이트 단위까지 고정 -> 시작 시 한 번만 만들고,
+# 성별/RAG/검색/대화 내역 같은 요청별 내용은 모두 그 뒤에 붙임 (provider 쪽 프롬프트 캐시 적중용)
+DYNAMIC_PROMPT_TEMPLATE = "\n{dynamic_system}\n\n[대화 내역]\n{chat_history}\n\n[사용자]\n{user_message}\n\n[답변]"
+
+character_prompts = {}  # 캐릭터 -> {"static_prefix", "tokens", "template", "lite_template"}
+character_chains = {}   # (캐릭터, route) -> (llm, chain)
+
+def build_persona_block(character: str) -> str:
+    char_data = CHARACTER_INFO.get(character, CHARACTER_INFO["박명수"])
+    return f"""
+당신은 무한도전의 '{character}'입니다.
+
+[캐릭터 설정]
+- MBTI: {char_data['mbti']}
+- 말투 톤: {char_data['tone']}
+- 연기 가이드: {char_data['style_guide']}
+- **주의:** 유행어({", ".join(char_data['keywords'])})는 문맥에 맞을 때만 가끔 사용하십시오. 앵무새처럼 반복 금지.
+
+[오프닝(첫 마디) 가이드라인 - 매우 중요]
+- **고정된 첫인사를 하지 마십시오.**
+- 아래 예시들 중 하나와 비슷한 뉘앙스로 시작하거나, 사용자의 질문에 바로 반응하십시오.
+- 오프닝 예시들: {", ".join(char_data.get('opening_samples', []))}
+- **지침:** 1. 사용자가 질문을 던졌다면 -> 인사 생략하고 즉시 답변/호통/반응.
+  2. 사용자가 인사만 했다면 -> 캐릭터 성격에 맞는 다양한 인사로 응대.
+
+[호칭 및 태도 규칙 (절대 준수)]
+1. **사용자 성별:** 아래 [사용자 정보] 참고.
+2. **호칭 트리거:** 사용자가 '형/오빠/누나/언니/선배'라고 부르면 -> 즉시 친근한 반말(야, 너, 동생아) 사용.
+3. **기본 호칭:** 호칭이 없으면 -> '{char_data['default_call']}' 사용.
+4. **금지:** 문맥 없이 '형님/누님' 금지(노홍철 제외). 이름을 모를 땐 'ㅇㅇ님' 대신 '자기', '그쪽' 사용.
+
+[정보 제공 규칙]
+- 웹 검색 결과가 있으면 그 안의 **실제 상호명/장소**만 추천하십시오. 절대 없는 장소를 지어내지 마십시오.
+- [대화 내역]을 참고하여 문맥을 자연스럽게 이으십시오.
+"""
+
+def build_lite_persona_block(character: str) -> str:
+    """가벼운 메시지(인사/감사/맞장구/작별)용 축약 페르소나 - RAG/검색 규칙 없음"""
+    char_data = CHARACTER_INFO.get(character, CHARACTER_INFO["박명수"])
+    return f"""
+당신은 무한도전의 '{character}'입니다. 말투 톤: {char_data['tone']}
+사용자가 인사/감사/맞장구/작별 인사만 했습니다. 캐릭터 말투로 한두 문장만 짧게 받아주고,
+대화를 이어갈 상황이면 연애 고민을 털어놓도록 자연스럽게 유도하십시오.
+- 말투 예시: {", ".join(char_data.get('opening_samples', []))}
+- 기본 호칭: '{char_data['default_call']}'. 이름을 모를 땐 'ㅇㅇ님' 대신 '자기', '그쪽' 사용.
+"""
+
+def build_dynamic_system(user_gender: str, rag_context: str = "", web_search_context: str = "") -> str:
+    """고정 프롬프트 뒤에 붙는 요청별 부분 (사용자 정보 + 배경 지식 + 검색 결과)"""
+    dynamic_system = f"[사용자 정보]\n- 사용자 성별: {user_gender}\n"
+    if rag_context:
+        dynamic_system += f"\n[배경 지식]\n{rag_context}\n"
+    if web_search_context:
+        dynamic_system += f"\n[최신 검색 정보]\n{web_search_context}\n"
+    return dynamic_system
+
+def _make_template(static_prefix: str) -> PromptTemplate:
+    escaped = static_prefix.replace("{", "{{").replace("}", "}}")
+    return PromptTemplate(
+        template=escaped + DYNAMIC_PROMPT_TEMPLATE,
+        input_variables=["dynamic_system", "chat_history", "user_message"]
+    )
+
+def _compile_character_prompt(character: str) -> dict:
+    static_prefix = build_persona_block(character)
+    return {
+        "static_prefix": static_prefix,
+        "tokens": None,     # static_prefix_tokens 에서 처음 쓸 때 셈
+        "template": _make_template(static_prefix),
+        "lite_template": _make_template(build_lite_persona_block(character))
+    }
+
+def static_prefix_tokens(persona: dict) -> int:
+    """고정 프롬프트의 토큰 수. import 할 때 토크나이저(tiktoken)를 불러오지 않도록 처음 쓸 때 세고 저장"""
+    if persona["tokens"] is None:
+        persona["tokens"] = token_counter.count(persona["static_prefix"])
+    return persona["tokens"]
+
+def get_character_prompt(character: str) -> dict:
+    # CHARACTER_INFO 밖의 이름은 캐시하지 않음 (임의 문자열로 캐시가 커지는 것 방지)
+    return character_prompts.get(character) or _compile_character_prompt(character)
+
+def get_character_chain(character: str, route: str = ROUTE_FULL):
+    model = llm if route == ROUTE_FULL else (fast_llm or llm)
+    cached = character_chains.get((character, route))
+    if cached and cached[0] is model:
+        return cached[1]
+    prompt = get_character_prompt(character)
+    template = prompt["template"] if route == ROUTE_FULL else prompt["lite_template"]
+    chain = template | model | StrOutputParser()
+    if character in character_prompts:
+        character_chains[(character, route)] = (model, chain)
+    return chain
+
+def compile_character_prompts():
+    for character in CHARACTER_INFO:
+        character_prompts[character] = _compile_character_prompt(character)
+        if llm is not None:
+            get_character_chain(character, ROUTE_FULL)
+            get_character_chain(character, ROUTE_TRIVIAL)
+    print(f"[프롬프트] 캐릭터별 고정 프롬프트/체인 준비 완료 ({len(character_prompts)}명)")
+
+compile_character_prompts()
+
 # Session Management
-sessions = {}
-sessions_lock = Lock()
-
-def cleanup_sessions():
-    now = time.time()
-    with sessions_lock:
-        expired = [sid for sid, data in sessions.items()
-                   if now - data["last_seen"] > SESSION_TTL_SECONDS]
-        for sid in expired: del sessions[sid]
-
-def get_or_create_session(session_id: Optional[str]) -> str:
-    cleanup_sessions()
-    with sessions_lock:
-        if session_id and session_id in sessions:
-            sessions[session_id]["last_seen"] = time.time()
-            return session_id
-        new_id = str(uuid.uuid4())
-        sessions[new_id] = {"history": [], "last_seen": time.time()}
-        return new_id
-
-def append_history(session_id: str, lines: List[str]):
-    with sessions_lock:
-        if session_id not in sessions: return
-        sessions[session_id]["history"].extend(lines)
-        sessions[session_id]["last_seen"] = time.time()
-        if len(sessions[session_id]["history"]) > MAX_HISTORY_LINES:
-            sessions[session_id]["history"] = sessions[session_id]["history"][-MAX_HISTORY_LINES:]
-
-def get_history_text(session_id: str) -> str:
-    with sessions_lock:
-        return "\n".join(sessions.get(session_id, {"history": []})["history"])
-
-def perform_web_search(query: str, max_results: int = 3) -> str:
-    if not tavily_client: return ""
+if SESSION_STORE == "sqlite":
+    session_store = SQLiteSessionStore(SESSION_DB_PATH, SESSION_TTL_SECONDS, MAX_HISTORY_LINES, SESSION_MAX_COUNT)
+else:
+    session_store = InMemorySessionStore(SESSION_TTL_SECONDS, MAX_HISTORY_LINES, SESSION_MAX_COUNT, SESSION_MAX_BYTES)
+
+# SQLite 저장소는 디스크를 기다리므로 스레드에서 실행 (session_store.call)
+async def get_or_create_session(session_id: Optional[str]) -> str:
+    return await session_store.call("get_or_create", session_id)
+
+async def append_history(session_id: str, lines: List[str]):
+    await session_store.call("append", session_id, lines)
+
+async def get_history_text(session_id: str) -> str:
+    return await session_store.call("history_text", session_id)
+
+async def get_history_lines(session_id: str) -> List[str]:
+    return await session_store.call("history_lines", session_id)
+
+async def get_history_summary(session_id: str) -> str:
+    return await session_store.call("summary", session_id)
+
+async def reset_session_history(session_id: str) -> bool:
+    return await session_store.call("reset", session_id)
+
+async def summarize_history(previous_summary: str, lines: List[str]) -> str:
+    prompt = PromptTemplate(
+        template=SUMMARY_PROMPT,
+        input_variables=["max_chars", "previous_summary", "new_lines"]
+    )
+    chain = prompt | llm | StrOutputParser()
+    # 요약도 같은 LLM 을 쓰므로 대기열을 거침 (배치와 같은 가장 낮은 우선순위)
+    async with llm_admission.slot(PRIORITY_BATCH):
+        summary = await chain.ainvoke({
+            "max_chars": HISTORY_SUMMARY_MAX_CHARS,
+            "previous_summary": previous_summary or "(없음)",
+            "new_lines": "\n".join(lines)
+        })
+    return summary[:HISTORY_SUMMARY_MAX_CHARS]
+
+async def compact_history(session_id: str):
+    """응답을 보낸 뒤 백그라운드에서 실행: 오래된 턴을 요약으로 접음"""
+    if not HISTORY_COMPACTION_ENABLED or llm is None: return
+    await compact_session_history(
+        session_store, session_id, summarize_history,
+        HISTORY_COMPACT_TRIGGER_LINES, HISTORY_KEEP_RECENT_LINES
+    )
+
+async def _tavily_search(query: str, max_results: int) -> str:
     try:
         print(f"[검색] {query}")
-        response = tavily_client.search(query=query, max_results=max_results, search_depth="advanced")
+        response = await tavily_client.search(query=query, max_results=max_results, search_depth="advanced")
         summary = ""
         if response.get("results"):
             summary += "[검색 결과 (사실 기반)]\n"
@@ -280,16 +588,64 @@ def perform_web_search(query: str, max_results: int = 3) -> str:
         print(f"[검색 에러] {str(e)}")
         return ""
 
-def detect_search_need(message: str) -> Optional[str]:
+async def perform_web_search(query: str, max_results: int = 3, cache_key: Optional[tuple] = None) -> str:
+    if not tavily_client: return ""
+    if cache_key is None:
+        return await _tavily_search(query, max_results)
+    return await search_cache.get_or_fetch(
+        (cache_key, max_results), lambda: _tavily_search(query, max_results)
+    )
+
+async def fetch_with_timeout(coro, timeout: float, label: str) -> str:
+    """컨텍스트 제공자 하나를 제한 시간 안에 실행. 시간 초과 시 빈 문자열(프롬프트에서 제외)"""
+    try:
+        return await asyncio.wait_for(coro, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"[{label} 타임아웃] {timeout}s 초과 - 프롬프트에서 제외")
+        return ""
+
+SEARCH_PLACE_KEYWORDS = ["맛집", "카페", "데이트", "코스", "추천", "핫플", "어디"]
+SEARCH_TREND_KEYWORDS = ["유행", "트렌드", "요즘", "mz", "인기", "순위"]
+SEARCH_REGIONS = ["서울", "강남", "홍대", "성수", "이태원", "부산", "제주", "대구", "대전", "인천"]
+SEARCH_STOPWORDS = {"좀", "거", "것", "곳", "수", "알려줘", "알려주세요", "해줘", "해주세요", "추천해줘",
+                    "추천해주세요", "있어", "있어요", "있을까요", "좋은", "좋을까요", "가면", "형", "형님", "누나"}
+_JOSA_RE = re.compile(r"(에서|으로|이랑|까지|부터|하기|하는|해요|에|은|는|이|가|을|를|로|도|랑|동|해)$")
+
+def detect_search_intent(message: str) -> Optional[tuple]:
+    """(intent, region) 반환. 검색이 필요 없으면 None"""
     msg = message.lower()
-    if any(k in msg for k in ["맛집", "카페", "데이트", "코스", "추천", "핫플", "어디"]):
-        regions = ["서울", "강남", "홍대", "성수", "이태원", "부산", "제주", "대구", "대전", "인천"]
-        region = next((r for r in regions if r in msg), "서울")
-        return f"{region} {message} 추천 2025 리뷰좋은곳"
-    if any(k in msg for k in ["유행", "트렌드", "요즘", "mz", "인기", "순위"]):
-        return f"2025년 {message} 최신 정보"
+    if any(k in msg for k in SEARCH_PLACE_KEYWORDS):
+        region = next((r for r in SEARCH_REGIONS if r in msg), "서울")
+        return ("place", region)
+    if any(k in msg for k in SEARCH_TREND_KEYWORDS):
+        return ("trend", None)
     return None
 
+def detect_search_need(message: str) -> Optional[str]:
+    intent = detect_search_intent(message)
+    if intent is None:
+        return None
+    kind, region = intent
+    if kind == "place":
+        return f"{region} {message} 추천 2025 리뷰좋은곳"
+    return f"2025년 {message} 최신 정보"
+
+def search_cache_key(message: str) -> Optional[tuple]:
+    """검색 캐시 키: 원문이 아니라 (intent, region, 키워드 집합) 으로 정규화"""
+    intent = detect_search_intent(message)
+    if intent is None:
+        return None
+    kind, region = intent
+    keywords = set()
+    for token in re.findall(r"[가-힣a-z0-9]+", message.lower()):
+        if token in SEARCH_STOPWORDS:
+            continue
+        if len(token) > 1:
+            token = _JOSA_RE.sub("", token) or token
+        if token not in SEARCH_STOPWORDS and token != region:
+            keywords.add(token)
+    return (kind, region, frozenset(keywords))
+
 # API Models & Endpoints
 class ChatRequest(BaseModel):
     session_id: Optional[str] = None
@@ -302,96 +658,405 @@ class ChatResponse(BaseModel):
     response: str
     web_search_used: bool = False
     rag_used: bool = False
+    route: str = ROUTE_FULL     # full / trivial (가벼운 메시지 경로)
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: ChatRequest):
-    try:
-        if llm is None: raise HTTPException(status_code=500, detail="LLM Init Failed")
-        
-        session_id = get_or_create_session(req.session_id)
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest]
+    max_concurrency: Optional[int] = None
 
-        rag_context = get_character_context(req.character, req.message)
-        
-        search_query = detect_search_need(req.message)
-        web_search_context = ""
-        if search_query and tavily_client:
-            web_search_context = perform_web_search(search_query)
+class ChatBatchItem(BaseModel):
+    session_id: Optional[str] = None
+    response: Optional[str] = None
+    web_search_used: bool = False
+    rag_used: bool = False
+    route: str = ROUTE_FULL
+    error: Optional[str] = None     # 이 항목만 실패한 경우 에러 메시지 (나머지 항목은 정상 응답)
 
-        char_data = CHARACTER_INFO.get(req.character, CHARACTER_INFO["박명수"])
-        
-        system_instruction = f"""
-당신은 무한도전의 '{req.character}'입니다.
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItem]
 
-[캐릭터 설정]
-- MBTI: {char_data['mbti']}
-- 말투 톤: {char_data['tone']}
-- 연기 가이드: {char_data['style_guide']}
-- **주의:** 유행어({", ".join(char_data['keywords'])})는 문맥에 맞을 때만 가끔 사용하십시오. 앵무새처럼 반복 금지.
+def clean_llm_response(character: str, raw_response: str) -> str:
+    if RAW_RESPONSE_LOG_PATH:
+        record_raw_response(character, raw_response)
+    return postprocess_llm_output(character, raw_response)
 
-[오프닝(첫 마디) 가이드라인 - 매우 중요]
-- **고정된 첫인사를 하지 마십시오.**
-- 아래 예시들 중 하나와 비슷한 뉘앙스로 시작하거나, 사용자의 질문에 바로 반응하십시오.
-- 오프닝 예시들: {", ".join(char_data.get('opening_samples', []))}
-- **지침:** 1. 사용자가 질문을 던졌다면 -> 인사 생략하고 즉시 답변/호통/반응.
-  2. 사용자가 인사만 했다면 -> 캐릭터 성격에 맞는 다양한 인사로 응대.
+def record_raw_response(character: str, raw_response: str):
+    """후처리 벤치마크용 원본 응답 기록 (benchmark.py postprocess --corpus)"""
+    try:
+        with open(RAW_RESPONSE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"character": character, "raw": raw_response}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[기록 에러] {str(e)}")
 
-[호칭 및 태도 규칙 (절대 준수)]
-1. **사용자 성별:** {req.user_gender}
-2. **호칭 트리거:** 사용자가 '형/오빠/누나/언니/선배'라고 부르면 -> 즉시 친근한 반말(야, 너, 동생아) 사용.
-3. **기본 호칭:** 호칭이 없으면 -> '{char_data['default_call']}' 사용.
-4. **금지:** 문맥 없이 '형님/누님' 금지(노홍철 제외). 이름을 모를 땐 'ㅇㅇ님' 대신 '자기', '그쪽' 사용.
+def _shared_fetch(shared: Optional[dict], key: tuple, make_coro):
+    """shared 가 주어지면 같은 key 의 작업은 한 번만 실행하고 결과를 나눠 씀 (/chat/batch 용)"""
+    if shared is None:
+        return make_coro()
+    task = shared.get(key)
+    if task is None:
+        task = shared[key] = asyncio.ensure_future(make_coro())
+    # 한 항목의 타임아웃이 공유 작업 자체를 취소하지 않도록 shield
+    return asyncio.shield(task)
 
-[정보 제공 규칙]
-- 웹 검색 결과가 있으면 그 안의 **실제 상호명/장소**만 추천하십시오. 절대 없는 장소를 지어내지 마십시오.
-- [대화 내역]을 참고하여 문맥을 자연스럽게 이으십시오.
-"""
+trivial_classifier = TrivialMessageClassifier(
+    list(CHARACTER_INFO) + [name[1:] for name in CHARACTER_INFO if len(name) == 3]  # 박명수 -> 명수
+)
+route_stats = RouteStats()
 
-        if rag_context:
-            system_instruction += f"\n[배경 지식]\n{rag_context}\n"
-        if web_search_context:
-            system_instruction += f"\n[최신 검색 정보]\n{web_search_context}\n"
+async def prepare_chat(req: ChatRequest, session_id: str, history: List[str], shared: Optional[dict] = None):
+    """
+    컨텍스트 수집 + 프롬프트 구성. (chain, chain 입력, rag_context, web_search_context, route) 반환
+    history: 요청 처음에 한 번 읽은 대화 내역 (캐시 키 / 우선순위 판단과 같은 것을 씀)
+    shared: 배치 안에서 같은 RAG 검색 / 웹 검색을 한 번만 실행하기 위한 작업 공유 dict
+    """
+    # 인사/감사 같은 가벼운 메시지는 검색 없이 축약 프롬프트 + 작은 모델로 (맞장구는 대화 첫 메시지일 때만)
+    category = trivial_classifier.classify(req.message, has_history=bool(history)) if TRIVIAL_ROUTE_ENABLED else None
+    if category:
+        route_stats.record(ROUTE_TRIVIAL, category)
+        print(f"[라우팅] trivial ({category})")
+        recent = history[-TRIVIAL_HISTORY_LINES:]
+        inputs = {
+            "dynamic_system": build_dynamic_system(req.user_gender),
+            "chat_history": "\n".join(recent),
+            "user_message": req.message
+        }
+        return get_character_chain(req.character, ROUTE_TRIVIAL), inputs, "", "", ROUTE_TRIVIAL
+    route_stats.record(ROUTE_FULL)
+    if index_manager is not None:
+        index_manager.check_disk()
 
-        prompt = PromptTemplate(
-            template="{system_instruction}\n\n[대화 내역]\n{chat_history}\n\n[사용자]\n{user_message}\n\n[답변]",
-            input_variables=["system_instruction", "chat_history", "user_message"]
+    # RAG 와 웹 검색을 동시에 시작하고 각자의 제한 시간으로 함께 기다림
+    search_query = detect_search_need(req.message)
+    rag_task = fetch_with_timeout(
+        _shared_fetch(shared, ("rag", req.character, req.message),
+                      lambda: get_character_context(req.character, req.message)),
+        RAG_TIMEOUT_SECONDS, "RAG"
+    )
+    if search_query and tavily_client:
+        cache_key = search_cache_key(req.message)
+        search_task = fetch_with_timeout(
+            _shared_fetch(shared, ("search", cache_key or search_query),
+                          lambda: perform_web_search(search_query, cache_key=cache_key)),
+            WEB_SEARCH_TIMEOUT_SECONDS, "검색"
         )
+    else:
+        search_task = asyncio.sleep(0, result="")
+    rag_context, web_search_context = await asyncio.gather(rag_task, search_task)
+
+    persona = get_character_prompt(req.character)
+
+    # 토큰 예산에 맞춰 섹션별로 자르기 (system / user_message 는 항상 포함)
+    fitted, token_report = fit_sections([
+        PromptSection("system", persona["static_prefix"], required=True, tokens=static_prefix_tokens(persona)),
+        PromptSection("user_info", build_dynamic_system(req.user_gender), required=True),
+        PromptSection("rag", rag_context),
+        PromptSection("web_search", web_search_context),
+        PromptSection("summary", await get_history_summary(session_id)),
+        PromptSection("history", "\n".join(history), trim="head"),
+        PromptSection("user_message", req.message, required=True),
+    ], PROMPT_TOKEN_BUDGET, PROMPT_SECTION_PRIORITY, token_counter, reserve=PROMPT_OUTPUT_RESERVE_TOKENS)
+    prompt_token_stats.record(token_report)
+    print("[프롬프트 토큰] " + " ".join(f"{k}={v['used']}/{v['original']}" for k, v in token_report.items()))
+    rag_context, web_search_context = fitted["rag"], fitted["web_search"]
+
+    inputs = {
+        "dynamic_system": build_dynamic_system(req.user_gender, rag_context, web_search_context),
+        "chat_history": format_history_with_summary(fitted["summary"], fitted["history"]),
+        "user_message": req.message
+    }
+    return get_character_chain(req.character), inputs, rag_context, web_search_context, ROUTE_FULL
 
-        chain = prompt | llm | StrOutputParser()
-        chat_history_text = get_history_text(session_id)
+def llm_priority(history: List[str]) -> int:
+    if LLM_PRIORITIZE_ONGOING and history:
+        return PRIORITY_ONGOING
+    return PRIORITY_NEW
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """provider 쪽 rate limit (openai RateLimitError / google ResourceExhausted / HTTP 429)"""
+    if type(e).__name__ in ("RateLimitError", "ResourceExhausted"):
+        return True
+    return getattr(e, "status_code", None) == 429 or getattr(e, "code", None) == 429
+
+def too_many_requests(retry_after: int, detail: str) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+response_cache = ResponseVariantCache(RESPONSE_CACHE_VARIANTS, RESPONSE_CACHE_MAX_KEYS)
+
+def response_cache_key(req: ChatRequest, history: List[str]) -> Optional[tuple]:
+    """첫 턴 + 웹 검색이 필요 없는 메시지만 캐시 대상. 대상이 아니면 None"""
+    if not RESPONSE_CACHE_ENABLED: return None
+    if history: return None
+    if detect_search_intent(req.message) is not None: return None
+    # RAG 인덱스가 교체되면 새 버전 키로 다시 모음 (이전 버전 키는 LRU 로 밀려남)
+    index_version = index_manager.version if index_manager is not None else None
+    return (index_version, req.character, req.user_gender, normalize_message(req.message))
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(req: ChatRequest, background_tasks: BackgroundTasks):
+    try:
+        if llm is None: raise HTTPException(status_code=500, detail="LLM Init Failed")
         
-        raw_response = chain.invoke({
-            "system_instruction": system_instruction,
-            "chat_history": chat_history_text,
-            "user_message": req.message
-        })
+        session_id = await get_or_create_session(req.session_id)
+        history = await get_history_lines(session_id)
+
+        cache_key = response_cache_key(req, history)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached:
+            clean_response, meta = cached
+            await append_history(session_id, [f"User: {req.message}", f"{req.character}: {clean_response}"])
+            return ChatResponse(session_id=session_id, response=clean_response, **meta)
 
-        clean_response = re.sub(r"[\(\[].*?[\)\]]", "", raw_response)
-        clean_response = clean_response.replace("ㅇㅇ님", "자기야")
-        clean_response=postprocess_response(req.character, clean_response)
-        clean_response=clean_response.strip()
-        final_response=clean_response
+        chain, inputs, rag_context, web_search_context, route = await prepare_chat(req, session_id, history)
 
-        append_history(session_id, [f"User: {req.message}", f"{req.character}: {clean_response}"])
+        async with llm_admission.slot(llm_priority(history)):
+            raw_response = await chain.ainvoke(inputs)
+        clean_response = clean_llm_response(req.character, raw_response)
+        if cache_key:
+            response_cache.add(cache_key, clean_response, {
+                "web_search_used": bool(web_search_context),
+                "rag_used": bool(rag_context),
+                "route": route
+            })
+
+        await append_history(session_id, [f"User: {req.message}", f"{req.character}: {clean_response}"])
+        background_tasks.add_task(compact_history, session_id)
 
         return ChatResponse(
             session_id=session_id, 
             response=clean_response,
             web_search_used=bool(web_search_context),
-            rag_used=bool(rag_context)
+            rag_used=bool(rag_context),
+            route=route
         )
 
+    except AdmissionRejected as e:
+        print(f"[대기열] 거절 ({e.reason}) - Retry-After {e.retry_after}s")
+        raise too_many_requests(e.retry_after, "서버가 혼잡합니다. 잠시 후 다시 시도해 주세요.")
+    except Exception as e:
+        if is_rate_limit_error(e):
+            print(f"[Rate Limit] {str(e)}")
+            raise too_many_requests(llm_admission.retry_after(), "LLM 호출 한도를 초과했습니다. 잠시 후 다시 시도해 주세요.")
+        print(f"[Error] {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """
+    SSE 스트리밍 버전의 /chat.
+    이벤트 순서: meta(세션/RAG/검색 여부) -> delta(후처리된 문장 단위) ... -> done(최종본)
+    """
+    if llm is None: raise HTTPException(status_code=500, detail="LLM Init Failed")
+
+    session_id = await get_or_create_session(req.session_id)
+    try:
+        history = await get_history_lines(session_id)
+        chain, inputs, rag_context, web_search_context, route = await prepare_chat(req, session_id, history)
+        # 429 를 돌려줄 수 있도록 스트림 시작 전에 자리를 받아 둠 (반납은 스트림이 끝날 때)
+        ticket = await llm_admission.ticket(llm_priority(history))
+    except AdmissionRejected as e:
+        print(f"[대기열] 거절 ({e.reason}) - Retry-After {e.retry_after}s")
+        raise too_many_requests(e.retry_after, "서버가 혼잡합니다. 잠시 후 다시 시도해 주세요.")
     except Exception as e:
         print(f"[Error] {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_stream():
+        # 클라이언트가 중간에 끊으면 yield 지점에서 aclose() 되므로 첫 yield 부터 finally 로 감쌈
+        try:
+            yield _sse("meta", {
+                "session_id": session_id,
+                "web_search_used": bool(web_search_context),
+                "rag_used": bool(rag_context),
+                "route": route
+            })
+            processor = StreamingPostprocessor(req.character)
+            try:
+                async for token in chain.astream(inputs):
+                    text = processor.feed(token)
+                    if text:
+                        yield _sse("delta", {"text": text})
+                text = processor.flush()
+                if text:
+                    yield _sse("delta", {"text": text})
+            except Exception as e:
+                print(f"[Stream Error] {str(e)}")
+                yield _sse("error", {"detail": str(e)})
+                return
+        finally:
+            ticket.release()
+
+        # 히스토리에는 /chat 과 동일한 전체 후처리 결과를 저장
+        clean_response = clean_llm_response(req.character, processor.raw_text)
+        await append_history(session_id, [f"User: {req.message}", f"{req.character}: {clean_response}"])
+        yield _sse("done", {"session_id": session_id, "response": clean_response})
+
+    async def after_stream():
+        # 스트림이 한 번도 돌지 않고 끝난 경우에도 자리를 반납 (이미 반납했으면 아무 일도 안 함)
+        ticket.release()
+        await compact_history(session_id)
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        background=BackgroundTask(after_stream)
+    )
+
+def _batch_waves(requests: List[ChatRequest]) -> List[List[int]]:
+    """
+    같은 session_id 항목은 순서대로 (앞 항목의 답변이 히스토리에 들어간 뒤) 처리해야 하므로
+    세션 안에서 k번째 항목들끼리 묶어 k번째 wave 로 만듦. session_id 가 없는 항목은 모두 첫 wave
+    """
+    waves: List[List[int]] = []
+    position = {}
+    for i, req in enumerate(requests):
+        k = position.get(req.session_id, 0) if req.session_id else 0
+        if req.session_id:
+            position[req.session_id] = k + 1
+        if k == len(waves):
+            waves.append([])
+        waves[k].append(i)
+    return waves
+
+async def _resolve_batch_sessions(requests: List[ChatRequest]) -> dict:
+    """
+    요청된 session_id 마다 get_or_create 를 배치 전체에서 한 번만 호출.
+    없거나 만료된 id 를 공유하는 항목들이 wave 마다 서로 다른 새 세션을 받지 않도록 모든 wave 에서 이 결과를 씀
+    """
+    requested = list(dict.fromkeys(req.session_id for req in requests if req.session_id))
+    resolved = await asyncio.gather(*[get_or_create_session(s) for s in requested], return_exceptions=True)
+    return dict(zip(requested, resolved))
+
+async def _run_batch_wave(requests: List[ChatRequest], wave: List[int], results: list,
+                          sessions: dict, shared: dict, max_concurrency: int):
+    limit = asyncio.Semaphore(max_concurrency)
+
+    async def prepare(i: int):
+        req = requests[i]
+        if req.session_id:
+            session_id = sessions[req.session_id]
+            if isinstance(session_id, Exception):
+                raise session_id
+        else:
+            session_id = await get_or_create_session(None)
+        results[i] = ChatBatchItem(session_id=session_id)
+        async with limit:
+            history = await get_history_lines(session_id)
+            return await prepare_chat(req, session_id, history, shared)
+
+    prepared = await asyncio.gather(*[prepare(i) for i in wave], return_exceptions=True)
+
+    ready = []
+    for i, item in zip(wave, prepared):
+        if isinstance(item, Exception):
+            results[i] = ChatBatchItem(session_id=results[i].session_id if results[i] else None, error=str(item))
+            continue
+        chain, inputs, rag_context, web_search_context, route = item
+        results[i].rag_used = bool(rag_context)
+        results[i].web_search_used = bool(web_search_context)
+        results[i].route = route
+        ready.append((i, (chain, inputs)))
+    if not ready:
+        return
+
+    # 캐릭터/경로마다 체인이 달라서 (체인, 입력) 쌍을 한 번의 abatch 로 실행
+    # 항목마다 대화 요청보다 낮은 우선순위로 대기열을 거침
+    async def admitted_call(job):
+        chain, inputs = job
+        async with llm_admission.slot(PRIORITY_BATCH):
+            return await chain.ainvoke(inputs)
+
+    raw_responses = await RunnableLambda(admitted_call).abatch(
+        [job for _, job in ready],
+        config=RunnableConfig(max_concurrency=max_concurrency),
+        return_exceptions=True
+    )
+    for (i, _), raw_response in zip(ready, raw_responses):
+        req, item = requests[i], results[i]
+        if isinstance(raw_response, Exception):
+            print(f"[Batch Error] {i}: {str(raw_response)}")
+            item.error = str(raw_response)
+            continue
+        item.response = clean_llm_response(req.character, raw_response)
+        await append_history(item.session_id, [f"User: {req.message}", f"{req.character}: {item.response}"])
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_endpoint(batch: ChatBatchRequest, background_tasks: BackgroundTasks):
+    """
+    여러 ChatRequest 를 한 번에 처리해서 같은 순서로 돌려줌 (야간 평가 / 일괄 응답 작업용).
+    - 같은 RAG 검색 / 웹 검색은 배치 안에서 한 번만 실행
+    - 같은 session_id 항목은 (없는 id 여도) 하나의 세션을 이어서 씀
+    - 실패한 항목은 error 필드로 돌려주고 나머지는 정상 응답
+    """
+    if llm is None: raise HTTPException(status_code=500, detail="LLM Init Failed")
+    if len(batch.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"한 번에 최대 {BATCH_MAX_ITEMS}개까지 요청할 수 있습니다.")
+    max_concurrency = max(1, min(batch.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+
+    results: List[Optional[ChatBatchItem]] = [None] * len(batch.requests)
+    sessions = await _resolve_batch_sessions(batch.requests)
+    shared = {}
+    for wave in _batch_waves(batch.requests):
+        await _run_batch_wave(batch.requests, wave, results, sessions, shared, max_concurrency)
+
+    for session_id in dict.fromkeys(item.session_id for item in results if item.response is not None):
+        background_tasks.add_task(compact_history, session_id)
+    return ChatBatchResponse(results=results)
+
+@app.get("/stats")
+async def stats_endpoint():
+    return {
+        "sessions": await session_store.call("stats"),
+        "embedding_cache": embeddings.stats() if embeddings is not None else None,
+        "search_cache": search_cache.stats(),
+        "prompt_tokens": prompt_token_stats.stats(),
+        "tokenizer": token_counter.stats(),
+        "response_cache": response_cache.stats() if RESPONSE_CACHE_ENABLED else None,
+        "llm_admission": llm_admission.stats(),
+        "llm_backends": llm.stats() if isinstance(llm, HedgedChatModel) else None,
+        "routes": route_stats.stats(),
+        "vector_index": index_manager.stats() if index_manager is not None else None,
+        "retrieval": rag_retriever.stats() if rag_retriever is not None else None
+    }
+
+def require_admin(x_admin_token: Optional[str]):
+    """/admin/* 공통 인증. 프록시 뒤에서는 접속 주소를 믿을 수 없으므로 토큰만 봄"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="ADMIN_TOKEN 이 설정되지 않아 /admin 이 꺼져 있습니다.")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="관리자 토큰이 필요합니다.")
+
+@app.post("/admin/reload_index")
+async def reload_index_endpoint(rebuild: bool = False, force: bool = False, wait: bool = False,
+                                x_admin_token: Optional[str] = Header(None)):
+    """
+    재시작 없이 인덱스 교체.
+    rebuild=false: 디스크의 인덱스(ingest.py 로 갱신한 것)가 바뀌었으면 다시 읽음
+    rebuild=true : 오래된 인덱스면 (force 면 무조건) 백그라운드에서 재구축 후 교체. wait=true 면 끝날 때까지 기다림
+    """
+    require_admin(x_admin_token)
+    if index_manager is None:
+        raise HTTPException(status_code=503, detail="RAG 가 비활성화되어 있습니다.")
+    if not rebuild:
+        return await index_manager.reload()
+    if index_manager.busy:
+        return {"status": "already_running", "version": index_manager.version}
+    task = index_manager.start_rebuild(force)
+    if wait:
+        return await task
+    return {"status": "started", "version": index_manager.version}
+
 @app.post("/reset_session")
 async def reset_session(session_id: str):
-    with sessions_lock:
-        if session_id in sessions:
-            sessions[session_id] = {"history": [], "last_seen": time.time()}
-            return {"ok": True}
-    return {"ok": False}
+    return {"ok": await reset_session_history(session_id)}
 
 if __name__ == "__main__":
-    initialize_rag()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = UVICORN_WORKERS
+    if workers > 1 and SESSION_STORE != "sqlite":
+        print("Warning: memory 세션 저장소는 워커 간 공유가 안 됩니다. 워커 1개로 실행합니다.")
+        workers = 1
+    if workers > 1:
+        uvicorn.run("final:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,59 @@
+### 긴 대화 내역 압축: 오래된 턴을 누적 요약으로 접고 최근 턴만 원문으로 유지 ###
+
+from __future__ import annotations
+from typing import Awaitable, Callable, List, Set
+
+from session_store import SessionStore
+
+SUMMARY_PROMPT = """다음은 연애 상담 챗봇과 사용자의 대화입니다.
+[기존 요약]과 [새 대화]를 합쳐 상담 맥락을 유지하는 데 필요한 정보만 {max_chars}자 이내 한국어로 요약하십시오.
+- 사용자의 상황, 고민, 이미 받은 조언, 사용자가 밝힌 사실(이름/장소/일정 등)을 우선 남길 것
+- 캐릭터 말투나 인사말은 생략
+
+[기존 요약]
+{previous_summary}
+
+[새 대화]
+{new_lines}
+
+[요약]"""
+
+Summarizer = Callable[[str, List[str]], Awaitable[str]]
+
+_compacting: Set[str] = set()
+
+
+def format_history_with_summary(summary: str, history_text: str) -> str:
+    if not summary:
+        return history_text
+    return f"(이전 대화 요약) {summary}\n{history_text}" if history_text else f"(이전 대화 요약) {summary}"
+
+
+async def compact_session_history(store: SessionStore, session_id: str, summarize: Summarizer,
+                                  trigger_lines: int, keep_lines: int) -> bool:
+    """
+    히스토리가 trigger_lines 줄을 넘으면 최근 keep_lines 줄만 남기고 나머지를 요약에 접음.
+    응답을 돌려준 뒤 백그라운드에서 호출하는 용도. 같은 세션은 동시에 한 번만 압축함.
+    요약(LLM 호출)하는 동안 히스토리 generation 이 바뀌면 결과를 적용하지 않음.
+    """
+    if session_id in _compacting:
+        return False
+    _compacting.add(session_id)
+    try:
+        generation, lines = await store.call("history_snapshot", session_id)
+        if len(lines) <= trigger_lines:
+            return False
+        folded = lines[:len(lines) - keep_lines]
+        summary = await summarize(await store.call("summary", session_id), folded)
+        if not summary:
+            return False
+        # 요약하는 동안 초기화되거나 상한 초과로 앞부분이 잘렸으면 folded 가 더 이상 맨 앞 줄이 아니므로 버림
+        if not await store.call("apply_summary", session_id, summary.strip(), len(folded), generation):
+            print(f"[요약] 요약하는 동안 대화 내역이 바뀌어 결과를 버립니다 ({session_id})")
+            return False
+        return True
+    except Exception as e:
+        print(f"[요약 에러] {str(e)}")
+        return False
+    finally:
+        _compacting.discard(session_id)
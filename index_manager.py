@@ -0,0 +1,185 @@
+### 벡터 인덱스 교체 관리: 버전 확인(staleness) -> 백그라운드 재구축 -> 원자적 교체 ###
+
+from __future__ import annotations
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from ingest import find_pdfs, ingest_files, load_pdf_chunks, stale_reasons
+from vector_index import DEFAULT_INDEX_SPEC, MmapVectorStore, convert_faiss_dir, index_lock, is_mmap_index, read_manifest
+
+
+def manifest_version(manifest: Dict[str, Any]) -> str:
+    # 예전 형식에서 변환한 인덱스는 version 이 없어서 생성 시각으로 구분
+    return manifest.get("version") or f"created-{manifest.get('created_at')}"
+
+
+class VectorIndexManager:
+    """
+    현재 인덱스를 들고 있다가 새 인덱스가 준비되면 한 번에 바꿔 끼움.
+    - 재구축(ingest)과 새 인덱스 로드, prepare(store)(페르소나 청크 미리 검색 등)는 스레드에서 실행하고
+      그동안 기존 인덱스로 계속 응답
+    - 준비가 끝나면 on_swap(store, prepared) 를 이벤트 루프에서 await 없이 호출 (요청 도중에 반쯤 바뀐 상태가 없음)
+    - 다른 워커나 python ingest.py 가 디스크의 인덱스를 바꾼 경우 check_interval 마다 manifest 버전을 보고 따라감
+    - 재구축은 인덱스 쓰기 잠금(vector_index.index_lock)을 잡은 프로세스 하나만 함.
+      워커가 여러 개면 나머지는 임베딩하지 않고, 새 버전이 디스크에 생기면 check_disk 로 다시 읽기만 함
+    """
+
+    def __init__(self, index_path: str, data_dir: str, embedding: Embeddings, legacy_path: Optional[str] = None,
+                 prepare: Optional[Callable[[MmapVectorStore], Any]] = None,
+                 on_swap: Optional[Callable[[Optional[MmapVectorStore], Any], None]] = None,
+                 check_interval: float = 30.0,
+                 load_chunks: Callable[[str], List[Document]] = load_pdf_chunks,
+                 characters: Sequence[str] = (),
+                 index_spec: str = DEFAULT_INDEX_SPEC, nprobe: int = 8):
+        self.index_path = index_path
+        self.data_dir = data_dir
+        self.embedding = embedding
+        self.legacy_path = legacy_path
+        self.prepare = prepare or (lambda store: None)
+        self.on_swap = on_swap or (lambda store, prepared: None)
+        self.check_interval = check_interval
+        self.load_chunks = load_chunks
+        self.characters = list(characters)
+        self.index_spec = index_spec
+        self.nprobe = nprobe
+        self.store: Optional[MmapVectorStore] = None
+        self.version: Optional[str] = None
+        self.rebuilding = False
+        self.stale: List[str] = []
+        self.swaps = 0
+        self.last_swap: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._last_check = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def _load_prepared(self):
+        store = MmapVectorStore.load(self.index_path, self.embedding, self.nprobe)
+        return store, self.prepare(store)
+
+    def _swap(self, store: Optional[MmapVectorStore], prepared: Any):
+        self.on_swap(store, prepared)
+        self.store = store
+        self.version = manifest_version(store.manifest) if store else None
+        self.swaps += 1
+        self.last_swap = time.time()
+        print(f"[인덱스] 교체 완료 (version={self.version}, {store.index.ntotal if store else 0}개 청크)")
+
+    def load_initial(self):
+        """
+        시작 시 (동기). 인덱스가 아예 없을 때만 여기서 만들고, 오래된 인덱스는 일단 그대로 씀.
+        워커 여러 개가 동시에 시작해도 잠금을 먼저 잡은 하나만 만들고, 나머지는 기다렸다가 그 인덱스를 읽음
+        """
+        if not is_mmap_index(self.index_path):
+            with index_lock(self.index_path):
+                if not is_mmap_index(self.index_path) and self.legacy_path and os.path.exists(self.legacy_path):
+                    print(f"[인덱스] 예전 형식 변환 중: {self.legacy_path} -> {self.index_path}")
+                    convert_faiss_dir(self.legacy_path, self.index_path)
+                if not is_mmap_index(self.index_path):
+                    pdfs = find_pdfs(self.data_dir)
+                    if not pdfs:
+                        print(f"[RAG 경고] PDF 없음. RAG 비활성화.")
+                        return
+                    print(f"[인덱스] PDF 에서 새로 구축 중: {self.data_dir}")
+                    ingest_files(self.index_path, pdfs, self.embedding, load_chunks=self.load_chunks,
+                                 characters=self.characters, index_spec=self.index_spec)
+        self._swap(*self._load_prepared())
+
+    def staleness(self) -> List[str]:
+        manifest = read_manifest(self.index_path) if is_mmap_index(self.index_path) else None
+        return stale_reasons(manifest, find_pdfs(self.data_dir), self.embedding, self.characters, self.index_spec)
+
+    async def rebuild(self, force: bool = False) -> Dict[str, Any]:
+        """
+        오래된 인덱스면 (force 면 무조건) 백그라운드에서 증분 재구축 후 교체.
+        다른 프로세스가 인덱스를 쓰는 중이면 기다리지 않고 busy_elsewhere (그쪽 결과는 check_disk 로 따라감)
+        """
+        if self._lock.locked():
+            return {"status": "already_running"}
+        async with self._lock:
+            reasons = self.stale = await asyncio.to_thread(self.staleness)
+            if not reasons and not force:
+                return {"status": "up_to_date", "version": self.version}
+            pdfs = find_pdfs(self.data_dir)
+            if not pdfs:
+                # 원본이 전부 사라졌으면 빈 인덱스로 바꾸지 않고 기존 인덱스를 유지
+                return {"status": "no_sources", "version": self.version, "reasons": reasons}
+            self.rebuilding = True
+            try:
+                def build():
+                    with index_lock(self.index_path, blocking=False) as acquired:
+                        if not acquired:
+                            return None
+                        # 검사와 잠금 사이에 다른 프로세스가 이미 새로 만들었으면 임베딩 없이 읽기만
+                        if force or self.staleness():
+                            print(f"[인덱스] 재구축 시작: {', '.join(reasons) or '강제 재구축'}")
+                            ingest_files(self.index_path, pdfs, self.embedding, load_chunks=self.load_chunks,
+                                         characters=self.characters, index_spec=self.index_spec)
+                        return self._load_prepared()
+                built = await asyncio.to_thread(build)
+                if built is None:
+                    print("[인덱스] 다른 프로세스가 인덱스를 쓰는 중 - 재구축하지 않고 끝나면 디스크에서 다시 읽음")
+                    return {"status": "busy_elsewhere", "version": self.version, "reasons": reasons}
+                self._swap(*built)
+                self.stale = []
+                self.last_error = None
+                return {"status": "rebuilt", "version": self.version, "reasons": reasons}
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[인덱스 에러] 재구축 실패 - 기존 인덱스로 계속 응답: {str(e)}")
+                return {"status": "failed", "error": str(e), "version": self.version}
+            finally:
+                self.rebuilding = False
+
+    async def reload(self) -> Dict[str, Any]:
+        """디스크의 인덱스 버전이 바뀌었으면 다시 읽어서 교체 (재구축 없음)"""
+        async with self._lock:
+            if not is_mmap_index(self.index_path):
+                return {"status": "missing", "version": self.version}
+            disk_version = manifest_version(read_manifest(self.index_path))
+            if disk_version == self.version:
+                return {"status": "up_to_date", "version": self.version}
+            try:
+                self._swap(*await asyncio.to_thread(self._load_prepared))
+                return {"status": "reloaded", "version": self.version}
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[인덱스 에러] 다시 읽기 실패 - 기존 인덱스로 계속 응답: {str(e)}")
+                return {"status": "failed", "error": str(e), "version": self.version}
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def start_rebuild(self, force: bool = False) -> asyncio.Task:
+        return asyncio.create_task(self.rebuild(force))
+
+    def check_disk(self):
+        """요청 경로에서 호출: check_interval 마다 한 번 manifest 버전만 보고, 바뀌었으면 백그라운드에서 reload"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval or self._lock.locked():
+            return
+        self._last_check = now
+        try:
+            disk_version = manifest_version(read_manifest(self.index_path)) if is_mmap_index(self.index_path) else None
+        except (OSError, ValueError):
+            return
+        if disk_version and disk_version != self.version and (self._reload_task is None or self._reload_task.done()):
+            self._reload_task = asyncio.create_task(self.reload())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "chunks": self.store.index.ntotal if self.store else 0,
+            "index_spec": self.store.manifest.get("index_spec", DEFAULT_INDEX_SPEC) if self.store else None,
+            "stale_reasons": self.stale,
+            "rebuilding": self.rebuilding,
+            "swaps": self.swaps,
+            "last_swap": self.last_swap,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,275 @@
+"""
+상담 자료 증분 수집 (data/ 의 PDF -> 벡터 인덱스)
+
+- 청크 본문의 sha256 으로 중복/변경을 판단해서 새 청크만 임베딩하고, 기존 벡터는 그대로 재사용
+- data/ 에서 사라졌거나 내용이 바뀐 청크의 벡터는 인덱스에서 제거
+- 바뀌지 않은 파일(파일 sha256 동일)은 PDF 를 다시 읽지 않고, manifest 에 기록한 그 파일의 청크 해시로 기존 청크를 찾아 씀
+  (파일끼리 겹치는 청크는 인덱스에 하나만 있고 출처가 다른 파일일 수 있으므로 출처 경로가 아니라 해시로 찾음)
+- manifest.json 에 파일별 해시/청크 수/청크 해시, 임베딩 모델, 청크 분할 설정과 이를 합친 version 을 기록
+  임베딩 모델이 바뀌면 전체를 다시 임베딩, 청크 분할 설정이 바뀌면 전체를 다시 분할
+- 실행 중인 서버는 manifest 의 version 이 바뀐 것을 보고 새 인덱스로 교체함 (index_manager.py)
+- 청크마다 어느 멤버 섹션("- 박명수 ..." 머리글 아래)에 속하는지 metadata["characters"] 로 기록 (캐릭터별 검색 범위)
+  머리글이 없는 자료(일반 연애 상담 등)는 빈 목록 = 모든 캐릭터가 함께 쓰는 공용 자료
+- index_spec(Flat / SQ8 / IVF..,PQ.. 등)이 바뀌면 저장된 원본 벡터로 인덱스만 다시 만듦 (재임베딩 없음)
+
+사용법:
+    python ingest.py [--data-dir ./data] [--rebuild] [--dry-run]
+"""
+from __future__ import annotations
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from vector_index import DEFAULT_INDEX_SPEC, MmapVectorStore, build_index, index_lock, is_mmap_index, save_index
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 64
+
+
+def chunk_hash(text: str) -> str:
+    """공백만 다른 청크(PDF 추출기 버전 차이 등)는 같은 청크로 봄"""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def embedding_model_id(embedding: Embeddings) -> str:
+    provider = getattr(embedding, "provider", "")
+    model = getattr(embedding, "model", "") or type(embedding).__name__
+    return f"{provider}:{model}" if provider else model
+
+
+def chunking_params() -> Dict[str, int]:
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+
+def index_version(files: Dict[str, Dict], model_id: str, chunking: Dict[str, int],
+                  characters: Sequence[str] = (), index_spec: str = DEFAULT_INDEX_SPEC) -> str:
+    """원본 파일 해시 + 임베딩 모델 + 청크 분할 설정 (+ 섹션 태그용 캐릭터 목록, 인덱스 종류)으로 만든 인덱스 버전"""
+    stamp = {"files": {p: f["sha256"] for p, f in files.items()}, "embedding_model": model_id, "chunking": chunking}
+    if characters:
+        stamp["characters"] = list(characters)
+    if index_spec != DEFAULT_INDEX_SPEC:
+        stamp["index_spec"] = index_spec
+    return hashlib.sha256(json.dumps(stamp, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def stale_reasons(manifest: Optional[Dict], paths: List[str], embedding: Embeddings,
+                  characters: Sequence[str] = (), index_spec: str = DEFAULT_INDEX_SPEC) -> List[str]:
+    """인덱스가 현재 원본/설정과 다른 이유 목록 (비어 있으면 최신)"""
+    if manifest is None:
+        return ["인덱스 없음"]
+    reasons = []
+    model_id = embedding_model_id(embedding)
+    if manifest.get("embedding_model") != model_id:
+        reasons.append(f"임베딩 모델: {manifest.get('embedding_model')} -> {model_id}")
+    if manifest.get("chunking") != chunking_params():
+        reasons.append(f"청크 분할 설정: {manifest.get('chunking')} -> {chunking_params()}")
+    if manifest.get("characters", []) != list(characters):
+        reasons.append(f"캐릭터 목록: {manifest.get('characters', [])} -> {list(characters)}")
+    if manifest.get("index_spec", DEFAULT_INDEX_SPEC) != index_spec:
+        reasons.append(f"인덱스 종류: {manifest.get('index_spec', DEFAULT_INDEX_SPEC)} -> {index_spec}")
+    recorded = manifest.get("files", {})
+    for path in paths:
+        if path not in recorded:
+            reasons.append(f"새 파일: {path}")
+        elif recorded[path].get("sha256") != file_hash(path):
+            reasons.append(f"변경된 파일: {path}")
+    for path in recorded:
+        if path not in paths:
+            reasons.append(f"삭제된 파일: {path}")
+    return reasons
+
+
+def section_pattern(characters: Sequence[str]) -> "re.Pattern":
+    # 줄 맨 앞의 "-  박명수  ..." 형태 머리글
+    return re.compile(r"(?:^|\n)[ \t]*-[ \t]+(" + "|".join(map(re.escape, characters)) + r")(?=\s)")
+
+
+def tag_sections(chunks: List[Document], characters: Sequence[str]) -> List[Document]:
+    """
+    한 파일의 청크(문서 순서)에 metadata["characters"] 를 붙임.
+    직전 머리글의 멤버 + 청크 안에서 새로 시작하는 머리글의 멤버. 첫 머리글 전의 청크는 [] (공용)
+    """
+    if not characters:
+        return chunks
+    pattern = section_pattern(characters)
+    current = None
+    for doc in chunks:
+        text = doc.page_content
+        headers = list(pattern.finditer(text))
+        tags = []
+        if current and (not headers or text[:headers[0].start()].strip()):
+            tags.append(current)
+        for m in headers:
+            if m.group(1) not in tags:
+                tags.append(m.group(1))
+        if headers:
+            current = headers[-1].group(1)
+        doc.metadata = {**(doc.metadata or {}), "characters": tags}
+    return chunks
+
+
+def find_pdfs(data_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_dir, "*.pdf")))
+
+
+def load_pdf_chunks(path: str) -> List[Document]:
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+    return splitter.split_documents(PyPDFLoader(path).load())
+
+
+def ingest_files(index_path: str, paths: List[str], embedding: Embeddings,
+                 load_chunks: Callable[[str], List[Document]] = load_pdf_chunks,
+                 rebuild: bool = False, dry_run: bool = False, characters: Sequence[str] = (),
+                 index_spec: str = DEFAULT_INDEX_SPEC) -> Dict[str, int]:
+    """
+    paths 의 최신 내용으로 index_path 인덱스를 갱신. 결과 요약 dict 반환
+    characters: 섹션 태그(metadata["characters"])를 붙일 멤버 이름 목록
+    index_spec: faiss.index_factory 문자열 (Flat 이 아니면 원본 벡터를 vectors.npy 로 함께 저장)
+    (embedded: 새로 임베딩, kept: 재사용, removed: 제거, duplicates: 중복 청크, files_reparsed: 다시 읽은 파일)
+    기존 인덱스 읽기 -> 임베딩 -> 저장 -> 교체를 인덱스 쓰기 잠금(index_lock) 안에서 함.
+    다른 프로세스(서버 워커 / python ingest.py)가 쓰는 중이면 끝날 때까지 기다렸다가 그 결과 위에서 이어서 수집
+    """
+    with index_lock(index_path):
+        return _ingest_locked(index_path, paths, embedding, load_chunks, rebuild, dry_run, characters, index_spec)
+
+
+def _ingest_locked(index_path: str, paths: List[str], embedding: Embeddings,
+                   load_chunks: Callable[[str], List[Document]], rebuild: bool, dry_run: bool,
+                   characters: Sequence[str], index_spec: str) -> Dict[str, int]:
+    model_id = embedding_model_id(embedding)
+    chunking = chunking_params()
+    old_docs: List[Document] = []
+    old_vectors: Optional[np.ndarray] = None
+    old_files: Dict[str, Dict] = {}
+    if is_mmap_index(index_path) and not rebuild:
+        store = MmapVectorStore.load(index_path, embedding)
+        previous_model = store.manifest.get("embedding_model")
+        if previous_model and previous_model != model_id:
+            print(f"[수집] 임베딩 모델 변경 ({previous_model} -> {model_id}) - 전체를 다시 임베딩합니다.")
+        else:
+            old_docs = store.docstore.all()
+            old_vectors = store.vectors()
+            # 청크 분할 설정/캐릭터 목록이 바뀌었으면 파일은 모두 다시 분할 (같은 청크의 벡터는 재사용)
+            if (store.manifest.get("chunking") == chunking
+                    and store.manifest.get("characters", []) == list(characters)):
+                old_files = store.manifest.get("files", {})
+
+    # 파일별 청크 (바뀌지 않은 파일은 기록된 청크 해시로 기존 청크를 그대로 사용)
+    digests = {path: file_hash(path) for path in paths}
+    unchanged = {path for path in paths if old_files.get(path, {}).get("sha256") == digests[path]}
+    old_by_hash: Dict[str, Document] = {}
+    for doc in old_docs:
+        old_by_hash.setdefault(chunk_hash(doc.page_content), doc)
+    files: Dict[str, Dict] = {}
+    chunks: List[Document] = []
+    reparsed = 0
+    for path in paths:
+        file_chunks = None
+        if path in unchanged and "chunk_hashes" in old_files[path]:
+            reused = [old_by_hash.get(h) for h in old_files[path]["chunk_hashes"]]
+            # 남겨 둔 청크의 메타데이터(출처/페이지)가 그대로 유효할 때만 재사용. 아니면 다시 분할 (임베딩은 재사용)
+            if all(doc is not None and doc.metadata.get("source") in unchanged for doc in reused):
+                file_chunks = reused
+        if file_chunks is None:
+            file_chunks = tag_sections(load_chunks(path), characters)
+            reparsed += 1
+        files[path] = {"sha256": digests[path], "chunks": len(file_chunks),
+                       "chunk_hashes": [chunk_hash(doc.page_content) for doc in file_chunks]}
+        chunks.extend(file_chunks)
+
+    # 청크 해시로 중복 제거
+    wanted: Dict[str, Document] = {}
+    duplicates = 0
+    for doc in chunks:
+        h = chunk_hash(doc.page_content)
+        if h in wanted:
+            duplicates += 1
+            continue
+        wanted[h] = doc
+
+    # 기존 행은 순서를 유지한 채 남은 것만 보존, 새 청크는 뒤에 추가
+    kept_rows, kept_docs, seen = [], [], set()
+    for row, doc in enumerate(old_docs):
+        h = chunk_hash(doc.page_content)
+        if h in wanted and h not in seen:
+            seen.add(h)
+            kept_rows.append(row)
+            kept_docs.append(wanted[h])  # 메타데이터(페이지 번호 등)는 최신 값으로
+    new_docs = [doc for h, doc in wanted.items() if h not in seen]
+    summary = {
+        "embedded": len(new_docs),
+        "kept": len(kept_docs),
+        "removed": len(old_docs) - len(kept_docs),
+        "duplicates": duplicates,
+        "files_reparsed": reparsed,
+    }
+    if dry_run:
+        return summary
+
+    new_vectors = []
+    for start in range(0, len(new_docs), EMBED_BATCH_SIZE):
+        batch = new_docs[start:start + EMBED_BATCH_SIZE]
+        new_vectors.extend(embedding.embed_documents([doc.page_content for doc in batch]))
+    parts = []
+    if kept_rows:
+        parts.append(old_vectors[kept_rows])
+    if new_vectors:
+        parts.append(np.array(new_vectors, dtype=np.float32))
+    if not parts:
+        raise ValueError("수집할 청크가 없습니다.")
+    vectors = np.vstack(parts)
+
+    compressed = index_spec != DEFAULT_INDEX_SPEC
+    save_index(index_path, build_index(vectors, index_spec), kept_docs + new_docs, source="ingest", extra={
+        "embedding_model": model_id,
+        "chunking": chunking,
+        "files": files,
+        "characters": list(characters),
+        "index_spec": index_spec,
+        "version": index_version(files, model_id, chunking, characters, index_spec),
+    }, raw_vectors=vectors if compressed else None)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="상담 자료 증분 수집")
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--rebuild", action="store_true", help="기존 벡터를 재사용하지 않고 전부 다시 임베딩")
+    parser.add_argument("--dry-run", action="store_true", help="임베딩/저장 없이 변경 내역만 출력")
+    args = parser.parse_args()
+
+    import final  # 서버와 같은 provider / 임베딩 / 인덱스 경로 설정 사용
+
+    pdfs = find_pdfs(args.data_dir)
+    if not pdfs:
+        raise SystemExit(f"{args.data_dir} 에 PDF 가 없습니다.")
+    if final.embeddings is None:
+        raise SystemExit("임베딩을 초기화하지 못했습니다. LLM_PROVIDER / API 키를 확인하세요.")
+    if not is_mmap_index(final.VECTOR_INDEX_PATH) and os.path.exists(final.VECTOR_DB_PATH):
+        from vector_index import convert_faiss_dir
+        convert_faiss_dir(final.VECTOR_DB_PATH, final.VECTOR_INDEX_PATH)
+
+    result = ingest_files(final.VECTOR_INDEX_PATH, pdfs, final.embeddings, rebuild=args.rebuild, dry_run=args.dry_run,
+                          characters=list(final.CHARACTER_INFO), index_spec=final.VECTOR_INDEX_TYPE)
+    print(f"[수집] {final.VECTOR_INDEX_PATH} ({'dry-run' if args.dry_run else '저장 완료'})")
+    for key, value in result.items():
+        print(f"  {key:15}: {value}")
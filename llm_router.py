@@ -0,0 +1,150 @@
+### 여러 LLM 백엔드 묶기: 주 백엔드가 늦으면 보조 백엔드에 헤지 요청, 실패하면 페일오버 ###
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    primary 를 먼저 호출하고
+    - hedge_delay() 안에 답이 없으면 secondary 에도 같은 요청을 보내서 먼저 온 정상 답변을 사용 (진 쪽은 취소)
+    - primary 가 에러면 바로 secondary 로 페일오버
+    hedge_delay 는 primary 의 최근 지연시간 hedge_percentile (예: p95). 표본이 min_samples 보다 적으면 hedge_after_seconds.
+    hedge_after_seconds 가 None 이면 헤지 없이 페일오버만 함.
+    스트리밍은 첫 조각이 오기까지를 기준으로 헤지/페일오버 (조각을 보낸 뒤에는 바꾸지 않음).
+    """
+    primary: BaseChatModel
+    secondary: Optional[BaseChatModel] = None
+    primary_name: str = "primary"
+    secondary_name: str = "secondary"
+    hedge_after_seconds: Optional[float] = 4.0
+    hedge_percentile: float = 0.95
+    hedge_min_seconds: float = 0.5
+    min_samples: int = 20
+
+    _latencies: deque = PrivateAttr(default_factory=lambda: deque(maxlen=200))
+    _counts: Dict[str, int] = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged"
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge_after_seconds is None:
+            return None
+        if len(self._latencies) < self.min_samples:
+            return self.hedge_after_seconds
+        ordered = sorted(self._latencies)
+        p = ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+        return max(self.hedge_min_seconds, p)
+
+    def _count(self, key: str):
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    async def _race(self, call: Callable[[BaseChatModel], Awaitable[Any]],
+                    discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Any:
+        """call(model) 을 primary 로 시작해서 헤지/페일오버 규칙대로 먼저 성공한 결과를 돌려줌"""
+        start = time.monotonic()
+        primary = asyncio.ensure_future(call(self.primary))
+        tasks = {primary: self.primary_name}
+        try:
+            if self.secondary is not None:
+                done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+                if not done:
+                    self._count("hedged")
+                    print(f"[LLM 헤지] {self.primary_name} {time.monotonic() - start:.1f}s 무응답 - {self.secondary_name} 에도 요청")
+                elif primary.exception() is not None:
+                    self._count("failover")
+                    print(f"[LLM 페일오버] {self.primary_name} 에러: {primary.exception()}")
+                if not done or primary.exception() is not None:
+                    tasks[asyncio.ensure_future(call(self.secondary))] = self.secondary_name
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [t for t in done if t.exception() is None]
+                for t in done:
+                    if t.exception() is not None:
+                        error = error or t.exception()
+                if winners:
+                    winner = primary if primary in winners else winners[0]
+                    for t in winners:
+                        if t is not winner and discard is not None:
+                            await discard(t.result())
+                    if winner is primary:
+                        self._latencies.append(time.monotonic() - start)
+                    self._count(f"wins_{tasks[winner]}")
+                    return winner.result()
+            self._count("errors")
+            raise error
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+                    if t is primary:
+                        # 취소된 primary 도 '최소 이만큼 걸림' 으로 기록해서 p95 가 낮게 쏠리지 않게 함
+                        self._latencies.append(time.monotonic() - start)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        message = await self._race(lambda model: model.ainvoke(messages, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        # 동기 경로는 헤지 없이 페일오버만
+        try:
+            message = self.primary.invoke(messages, stop=stop, **kwargs)
+            self._count(f"wins_{self.primary_name}")
+        except Exception as e:
+            if self.secondary is None:
+                self._count("errors")
+                raise
+            self._count("failover")
+            print(f"[LLM 페일오버] {self.primary_name} 에러: {e}")
+            message = self.secondary.invoke(messages, stop=stop, **kwargs)
+            self._count(f"wins_{self.secondary_name}")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async def first_chunk(model: BaseChatModel) -> Tuple[AsyncIterator, Any]:
+            stream = model.astream(messages, stop=stop, **kwargs)
+            try:
+                return stream, await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close(result: Tuple[AsyncIterator, Any]):
+            await result[0].aclose()
+
+        stream, chunk = await self._race(first_chunk, discard=close)
+        try:
+            while True:
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            "primary": self.primary_name,
+            "secondary": self.secondary_name if self.secondary is not None else None,
+            "hedge_delay_seconds": round(delay, 3) if delay is not None else None,
+            "samples": len(self._latencies),
+            **self._counts,
+        }
@@ -0,0 +1,73 @@
+### 가벼운 메시지(인사/감사/맞장구/작별) 판별: RAG 없이 작은 프롬프트로 처리할지 결정 ###
+
+from __future__ import annotations
+import re
+from threading import Lock
+from typing import Dict, Iterable, Optional
+
+ROUTE_FULL = "full"         # RAG/검색 + 전체 페르소나 프롬프트 + 기본 모델
+ROUTE_TRIVIAL = "trivial"   # RAG/검색 없음 + 축약 프롬프트 + 작은 모델
+
+TRIVIAL_PHRASES = {
+    "greeting": ["안녕", "안녕하세요", "안녕하십니까", "하이", "헬로", "hi", "hello", "ㅎㅇ", "반가워", "반가워요",
+                 "반갑습니다", "방가방가", "좋은아침", "굿모닝", "처음뵙겠습니다", "왔어", "왔어요", "저왔어요"],
+    "thanks": ["고마워", "고마워요", "고맙습니다", "감사", "감사해요", "감사합니다", "땡큐", "thanks", "thankyou",
+               "ㄳ", "ㄱㅅ", "덕분이에요", "덕분에"],
+    "ack": ["네", "넵", "넹", "응", "웅", "ㅇㅇ", "ㅇㅋ", "오케이", "ok", "okay", "알겠어", "알겠어요",
+            "알겠습니다", "그래", "그래요", "좋아", "좋아요", "맞아", "맞아요", "그렇구나", "그렇군요", "아하"],
+    "farewell": ["잘가", "잘가요", "안녕히계세요", "안녕히", "바이", "bye", "다음에봐", "다음에봐요",
+                 "수고하세요", "수고했어", "수고하셨습니다", "잘자", "잘자요"],
+}
+# 대화 중에는 앞 질문("고백해 볼래?")에 대한 대답일 수 있어서 히스토리가 없을 때만 가벼운 메시지로 봄
+CONTEXT_DEPENDENT_CATEGORIES = {"ack"}
+ADDRESS_WORDS = ["형님", "형", "누님", "누나", "언니", "오빠", "선배님", "선배", "쌤", "님", "씨", "야", "아", "요"]
+FILLER_RE = re.compile(r"[ㅋㅎㅠㅜ]{2,}|[^0-9a-z가-힣ㄱ-ㅎㅏ-ㅣ]")
+
+
+class TrivialMessageClassifier:
+    """
+    규칙 기반 로컬 분류기 (모델 호출 없음).
+    웃음/이모티콘/문장부호/호칭(형님, 캐릭터 이름 등)을 빼고 남은 내용이 전부 인사/감사/맞장구/작별 문구면
+    해당 카테고리를, 아니면 None 을 돌려줌. 길이가 max_chars 를 넘으면 항상 None (상담 질문일 가능성)
+    맞장구(CONTEXT_DEPENDENT_CATEGORIES)는 has_history 면 None
+    """
+
+    def __init__(self, names: Iterable[str] = (), max_chars: int = 30):
+        self.max_chars = max_chars
+        self._category = {p: c for c, phrases in TRIVIAL_PHRASES.items() for p in phrases}
+        fillers = sorted(set(ADDRESS_WORDS) | {n.lower().replace(" ", "") for n in names if n}, key=len, reverse=True)
+        phrases = sorted(self._category, key=len, reverse=True)
+        self._phrase_re = re.compile("|".join(map(re.escape, phrases)))
+        self._full_re = re.compile("(?:" + "|".join(map(re.escape, phrases + fillers)) + ")+")
+
+    def classify(self, message: str, has_history: bool = False) -> Optional[str]:
+        text = (message or "").strip().lower()
+        if not text or len(text) > self.max_chars:
+            return None
+        text = FILLER_RE.sub("", text)
+        if not text or not self._full_re.fullmatch(text):
+            return None
+        first = self._phrase_re.search(text)
+        category = self._category[first.group(0)] if first else None
+        if has_history and category in CONTEXT_DEPENDENT_CATEGORIES:
+            return None
+        return category
+
+
+class RouteStats:
+    """경로별 요청 수 (/stats)"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.counts: Dict[str, int] = {}
+
+    def record(self, route: str, category: Optional[str] = None):
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            if category:
+                key = f"{route}:{category}"
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
@@ -2,30 +2,33 @@
 
 from __future__ import annotations
 import re
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 
-# 공통 후처리 함수들
+# 공통 후처리 함수들 (정규식은 모듈 로드 시 한 번만 컴파일)
 
 _SENT_END_RE = re.compile(r"(?<=[\.\!\?\~…])\s+")
+_BRACKET_RE = re.compile(r"[\(\[].*?[\)\]]")
+# 줄 앞 글머리표 / ** / ` 를 한 번에 제거 (글머리표를 먼저 시도해야 기존 순차 처리와 결과가 같음)
+_MARKDOWN_RE = re.compile(r"^[\*\-]\s*|\*\*|`", re.MULTILINE)
+_PREFIX_RE = re.compile(r"^(답변|대답|BOT|AI|assistant)\s*[:：]\s*", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_DOUBLE_PUNCT_RE = re.compile(r"([!?~])\1{3,}")
+
+def _fix_placeholder_names(text: str) -> str:
+    return text.replace("ㅇㅇ님", "자기야")
 
 def _remove_bracketed(text: str) -> str:
-    return re.sub(r"[\(\[].*?[\)\]]", "", text)
+    return _BRACKET_RE.sub("", text)
 
 def _remove_bullets_and_markdown(text: str) -> str:
-    t = re.sub(r"^[\*\-]\s*", "", text, flags=re.MULTILINE)
-    t = t.replace("**", "").replace("`", "")
-    return t
+    return _MARKDOWN_RE.sub("", text)
 
 def _remove_common_prefixes(text: str) -> str:
-    t = text.strip()
-    t = re.sub(r"^(답변|대답|BOT|AI|assistant)\s*[:：]\s*", "", t, flags=re.IGNORECASE)
-    return t
+    return _PREFIX_RE.sub("", text.strip(), count=1)
 
 def _normalize_whitespace(text: str) -> str:
-    t = text.replace("\n", " ")
-    t = re.sub(r"\s+", " ", t)
-    return t.strip()
+    return _WHITESPACE_RE.sub(" ", text).strip()
 
 def _split_sentences(text: str) -> List[str]:
     t = text.strip()
@@ -43,8 +46,7 @@ def _truncate_sentences(text: str, max_sentences: int) -> str:
     return " ".join(parts[:max_sentences]).strip()
 
 def _fix_double_punct(text: str) -> str:
-    t = re.sub(r"([!?~])\1{3,}", r"\1\1", text)
-    return t
+    return _DOUBLE_PUNCT_RE.sub(r"\1\1", text)
 
 
 # 캐릭터 규칙
@@ -61,31 +63,76 @@ POSTPROCESS_POLICY: Dict[str, Dict[str, Any]] = {
     },
 }
 
+# 반말화 치환표를 정규식 하나로 처리.
+# - 기존 순차 치환(형님/누님/누나/형 -> 요 제거 -> 입니다/합니다/하세요/드립니다/됩니다)과 결과가 같도록,
+#   '요' 규칙은 원문 기준 lookbehind 로 검사하고 '하세요' 는 '요' 규칙이 먼저 적용되는 경우를 제외함
+_POLITE_END = r"(?=[\.\!\?\~…\s]|$)"
+_POLITE_TABLE = {
+    "형님": "야", "누님": "야", "누나": "야", "형": "야",
+    "입니다": "이야", "합니다": "해", "하세요": "해", "드립니다": "줘", "됩니다": "돼",
+}
+_POLITE_RE = re.compile(
+    r"형님|누님|누나|형|(?<=[가-힣])요" + _POLITE_END
+    + r"|입니다|합니다|하세요(?![\.\!\?\~…\s]|$)|드립니다|됩니다"
+)
+
 def _strip_polite_korean(text: str) -> str:
     """
     존댓말을 완벽히 반말로 바꾸는 건 어렵지만,
     "상담사 톤"을 줄이는 목적의 '가벼운' 변환만 합니다.
     (너무 과격하면 의미가 깨질 수 있어서 최소만)
     """
-    t = text
-    t = t.replace("형님", "야").replace("누님", "야").replace("누나", "야").replace("형", "야")
-    t = re.sub(r"([가-힣])요(?=[\.\!\?\~…\s]|$)", r"\1", t)
-    t = t.replace("입니다", "이야")
-    t = t.replace("합니다", "해")
-    t = t.replace("하세요", "해")
-    t = t.replace("드립니다", "줘")
-    t = t.replace("됩니다", "돼")
+    return _POLITE_RE.sub(lambda m: _POLITE_TABLE.get(m.group(0), ""), text)
 
-    return t
 
-def _apply_ban_phrases(text: str, ban_phrases: List[str]) -> str:
+class CompiledPolicy:
     """
-    금지문구는 '삭제'로 처리(과하게 재작성하면 의미 깨질 수 있어서).
+    POSTPROCESS_POLICY 항목 하나를 미리 컴파일한 객체.
+    금지문구는 하나의 alternation 정규식으로 먼저 검사해서, 하나도 없으면(대부분의 경우) 한 번의 탐색으로 끝남.
+    금지문구가 있을 때만 기존 순차 삭제를 수행 (문구끼리 겹치는 경우까지 결과가 같도록).
     """
-    t = text
-    for ph in ban_phrases:
-        t = t.replace(ph, "")
-    return _normalize_whitespace(t)
+
+    def __init__(self, policy: Dict[str, Any]):
+        self.source = policy
+        self.ban_phrases: List[str] = list(policy.get("ban_phrases", []))
+        self.ban_re = re.compile("|".join(map(re.escape, self.ban_phrases))) if self.ban_phrases else None
+        self.strip_polite = bool(policy.get("strip_polite"))
+        self.max_sentences = int(policy.get("max_sentences", 0) or 0)
+        self.prefixes: List[str] = list(policy.get("force_prefix", []))
+
+    def apply_ban_phrases(self, text: str) -> str:
+        """금지문구는 '삭제'로 처리(과하게 재작성하면 의미 깨질 수 있어서)."""
+        if self.ban_re is None or not self.ban_re.search(text):
+            return _normalize_whitespace(text)
+        t = text
+        for ph in self.ban_phrases:
+            t = t.replace(ph, "")
+        return _normalize_whitespace(t)
+
+    def apply(self, text: str) -> str:
+        t = text
+        if self.ban_re is not None:
+            t = self.apply_ban_phrases(t)
+        if self.strip_polite:
+            t = _strip_polite_korean(t)
+        if self.max_sentences:
+            t = _truncate_sentences(t, self.max_sentences)
+        if self.prefixes:
+            t = _ensure_prefix(t, self.prefixes)
+        return t.strip()
+
+
+_compiled_policies: Dict[str, CompiledPolicy] = {}
+
+def _compiled_policy(character: str) -> Optional[CompiledPolicy]:
+    policy = POSTPROCESS_POLICY.get(character)
+    if not policy:
+        return None
+    compiled = _compiled_policies.get(character)
+    if compiled is None or compiled.source is not policy:
+        compiled = CompiledPolicy(policy)
+        _compiled_policies[character] = compiled
+    return compiled
 
 def _ensure_prefix(text: str, prefixes: List[str]) -> str:
     t = text.strip()
@@ -97,47 +144,132 @@ def _ensure_prefix(text: str, prefixes: List[str]) -> str:
     return f"{prefixes[0]} {t}".strip()
 
 def _apply_character_policy(character: str, text: str) -> str:
-    policy = POSTPROCESS_POLICY.get(character)
-    if not policy:
+    compiled = _compiled_policy(character)
+    if compiled is None:
         return text
+    return compiled.apply(text)
 
-    t = text
 
-    ban_phrases = policy.get("ban_phrases", [])
-    if ban_phrases:
-        t = _apply_ban_phrases(t, ban_phrases)
-
-    if policy.get("strip_polite"):
-        t = _strip_polite_korean(t)
+# 메인 후처리 함수
 
-    max_sentences = int(policy.get("max_sentences", 0) or 0)
-    if max_sentences:
-        t = _truncate_sentences(t, max_sentences)
+def _postprocess(character: str, text: str, server_output: bool) -> str:
+    t = text or ""
+    if server_output:
+        # 예전 final.py 순서: 괄호 제거 -> ㅇㅇ님 치환 -> postprocess_response
+        t = _fix_placeholder_names(_remove_bracketed(t))
 
-    prefixes = policy.get("force_prefix", [])
-    if prefixes:
-        t = _ensure_prefix(t, prefixes)
+    t = _remove_common_prefixes(t.strip())
+    if not server_output:
+        t = _remove_bracketed(t)
+    t = _remove_bullets_and_markdown(t)
+    t = _normalize_whitespace(t)
+    t = _fix_double_punct(t)
 
-    return t.strip()
+    t = _apply_character_policy(character or "", t)
 
+    if not t:
+        t = "야, 몰라. 다시 말해봐."
 
-# 메인 후처리 함수
+    return t
 
 def postprocess_response(character: str, text: str) -> str:
     """
     raw_response -> final_response 로 다듬기
     """
-    t = (text or "").strip()
+    return _postprocess(character, text, server_output=False)
 
-    t = _remove_common_prefixes(t)
-    t = _remove_bracketed(t)
-    t = _remove_bullets_and_markdown(t)
-    t = _normalize_whitespace(t)
-    t = _fix_double_punct(t)
+def postprocess_llm_output(character: str, raw_response: str) -> str:
+    """
+    서버(/chat, /chat/stream)용: 괄호 제거 + 'ㅇㅇ님' -> '자기야' 치환을 맨 먼저 한 번만 수행.
+    (예전 final.py 의 '괄호 제거 -> ㅇㅇ님 치환 -> postprocess_response' 와 같은 결과. 괄호 제거를 두 번 하지 않음)
+    """
+    return _postprocess(character, raw_response, server_output=True)
 
-    t = _apply_character_policy(character or "", t)
 
-    if not t:
-        t = "야, 몰라. 다시 말해봐."
+# 스트리밍(증분) 후처리
 
-    return t
+_UNCLOSED_BRACKET_RE = re.compile(r"[\(\[]")
+
+class StreamingPostprocessor:
+    """
+    토큰 스트림을 받아 '완성된 문장' 단위로 후처리해서 내보내는 증분 모드.
+    문장 하나에 postprocess_response 와 같은 단계(괄호/마크다운 제거, 금지문구, 반말화,
+    문장 수 제한, 접두어)를 적용합니다.
+    스트리밍 조각은 미리보기용이고, 최종본은 raw_text 전체에 postprocess_llm_output 을 적용한 결과입니다.
+    """
+
+    def __init__(self, character: str):
+        self.character = character or ""
+        self.policy = _compiled_policy(self.character)
+        self._raw: List[str] = []
+        self._pending = ""
+        self._first_segment = True
+        self._emitted_any = False
+        self._sentences_left = (self.policy.max_sentences or None) if self.policy else None
+
+    @property
+    def raw_text(self) -> str:
+        return "".join(self._raw)
+
+    def feed(self, chunk: str) -> str:
+        """토큰 조각을 넣고, 새로 완성된 문장들의 후처리 결과를 돌려줌 (없으면 빈 문자열)"""
+        self._raw.append(chunk or "")
+        self._pending += chunk or ""
+        out = []
+        while True:
+            cut = self._find_sentence_end()
+            if cut is None:
+                break
+            segment, self._pending = self._pending[:cut], self._pending[cut:]
+            out.append(self._process_segment(segment))
+        return " ".join(o for o in out if o)
+
+    def flush(self) -> str:
+        """스트림 종료 시 남은 텍스트를 처리"""
+        segment, self._pending = self._pending, ""
+        t = self._process_segment(segment)
+        if not t and not self._emitted_any:
+            self._emitted_any = True
+            return "야, 몰라. 다시 말해봐."
+        return t
+
+    def _find_sentence_end(self) -> Optional[int]:
+        # 문장부호 + 공백이 나오고, 그 앞에 닫히지 않은 괄호가 없을 때만 문장 완성으로 봄
+        for m in _SENT_END_RE.finditer(self._pending):
+            head = self._pending[:m.start()]
+            if not _UNCLOSED_BRACKET_RE.search(_remove_bracketed(head)):
+                return m.start()
+        return None
+
+    def _process_segment(self, segment: str) -> str:
+        if self._sentences_left == 0:
+            return ""
+
+        t = _fix_placeholder_names(segment)
+        if self._first_segment:
+            t = _remove_common_prefixes(t)
+            self._first_segment = False
+        t = _remove_bracketed(t)
+        t = _remove_bullets_and_markdown(t)
+        t = _normalize_whitespace(t)
+        t = _fix_double_punct(t)
+
+        if self.policy and self.policy.ban_re is not None:
+            t = self.policy.apply_ban_phrases(t)
+        if self.policy and self.policy.strip_polite:
+            t = _strip_polite_korean(t)
+
+        if self._sentences_left is not None:
+            parts = _split_sentences(t)
+            if len(parts) > self._sentences_left:
+                t = " ".join(parts[:self._sentences_left])
+            self._sentences_left = max(self._sentences_left - len(parts), 0)
+
+        t = t.strip()
+        if not t:
+            return ""
+
+        if self.policy and self.policy.prefixes and not self._emitted_any:
+            t = _ensure_prefix(t, self.policy.prefixes)
+        self._emitted_any = True
+        return t
@@ -0,0 +1,189 @@
+### 토큰 예산 기반 프롬프트 조립 (섹션별 토큰 수 측정 + 우선순위대로 예산 배분) ###
+
+from __future__ import annotations
+import os
+import re
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+_HANGUL_RE = re.compile(r"[가-힣ㄱ-ㅎㅏ-ㅣ]")
+
+
+TOKENIZER_AUTO = "auto"          # tiktoken, 안 되면 근사치 (경고 로그 + stats 에 표시)
+TOKENIZER_TIKTOKEN = "tiktoken"  # tiktoken 만 사용, 안 되면 예외
+TOKENIZER_APPROX = "approx"      # 항상 근사치 (네트워크/인코딩 파일 불필요)
+
+
+class TokenCounter:
+    """
+    tiktoken 으로 토큰 수를 셈. 인코딩 파일은 처음 한 번 내려받아 cache_dir(TIKTOKEN_CACHE_DIR)에 저장되고
+    이후에는 오프라인으로 동작함. 네트워크가 없는 배포 환경은 cache_dir 을 미리 채워 두거나 approx 모드를 쓸 것.
+    근사치: 한글 1글자 = 1토큰, 나머지 4글자 = 1토큰.
+    실제로 어느 쪽으로 세는지는 mode (tiktoken / approx) 로 확인.
+    """
+
+    def __init__(self, model: str = "gpt-4o-mini", tokenizer: str = TOKENIZER_AUTO,
+                 cache_dir: Optional[str] = None):
+        if tokenizer not in (TOKENIZER_AUTO, TOKENIZER_TIKTOKEN, TOKENIZER_APPROX):
+            raise ValueError(f"알 수 없는 토크나이저 모드: {tokenizer}")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.cache_dir = cache_dir
+        self.mode: Optional[str] = TOKENIZER_APPROX if tokenizer == TOKENIZER_APPROX else None
+        self.fallback_reason: Optional[str] = None
+        self._encoding = None
+        self._loaded = tokenizer == TOKENIZER_APPROX
+
+    def _load(self):
+        self._loaded = True
+        try:
+            if self.cache_dir:
+                os.environ.setdefault("TIKTOKEN_CACHE_DIR", self.cache_dir)
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")
+            self.mode = TOKENIZER_TIKTOKEN
+        except Exception as e:
+            if self.tokenizer == TOKENIZER_TIKTOKEN:
+                raise RuntimeError(f"tiktoken 인코딩을 불러오지 못함: {type(e).__name__}: {e}") from e
+            self._encoding = None
+            self.mode = TOKENIZER_APPROX
+            self.fallback_reason = type(e).__name__
+            print(f"[토큰] 경고: tiktoken 인코딩을 불러오지 못함 ({type(e).__name__}) - 근사치로 계산합니다. "
+                  f"오프라인 환경이면 TIKTOKEN_CACHE_DIR 에 인코딩 파일을 미리 받아 두세요.")
+
+    def load(self) -> str:
+        """인코딩을 바로 불러오고 실제 모드를 돌려줌 (서버 시작 시 호출해서 첫 요청 지연/경고를 앞당김)"""
+        if not self._loaded:
+            self._load()
+        return self.mode
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if not self._loaded:
+            self._load()
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        hangul = len(_HANGUL_RE.findall(text))
+        return hangul + (len(text) - hangul + 3) // 4
+
+    def stats(self) -> Dict[str, Optional[str]]:
+        return {"mode": self.mode, "model": self.model, "fallback_reason": self.fallback_reason}
+
+
+@dataclass
+class PromptSection:
+    """
+    name: 섹션 이름 (report 키)
+    text: 섹션 내용
+    required: True 면 예산과 상관없이 항상 포함
+    trim: 예산이 부족할 때 자르는 방향 - "tail"(뒤를 버림) / "head"(앞을 버림, 히스토리용)
+    tokens: 미리 계산해 둔 토큰 수 (고정 텍스트라면 매 요청 다시 세지 않도록)
+    """
+    name: str
+    text: str
+    required: bool = False
+    trim: str = "tail"
+    tokens: Optional[int] = None
+
+
+def _trim_lines(text: str, budget: int, counter: TokenCounter, keep: str) -> str:
+    """
+    줄 단위로 budget 토큰 이하가 될 때까지 잘라냄. keep="tail" 이면 뒤쪽(최근) 줄을 남김.
+    keep="head" 일 때는 마지막에 걸친 줄도 글자 단위로 잘라 남은 예산을 채움
+    """
+    lines = text.split("\n")
+    ordered = reversed(lines) if keep == "tail" else iter(lines)
+    kept: List[str] = []
+    used = 0
+    for line in ordered:
+        cost = counter.count(line + "\n")
+        if used + cost > budget:
+            if keep == "head":
+                partial = _trim_chars(line, budget - used, counter)
+                if partial:
+                    kept.append(partial)
+            break
+        kept.append(line)
+        used += cost
+    if keep == "tail":
+        kept.reverse()
+    return "\n".join(kept)
+
+
+def _trim_chars(text: str, budget: int, counter: TokenCounter) -> str:
+    if budget <= 0:
+        return ""
+    cut = max(len(text) * budget // max(counter.count(text), 1), 0)
+    while cut > 0 and counter.count(text[:cut] + "...") > budget:
+        cut = cut * 9 // 10
+    return text[:cut] + "..." if cut else ""
+
+
+def fit_sections(sections: List[PromptSection], budget: int, priority: List[str],
+                 counter: TokenCounter, reserve: int = 0) -> Tuple[Dict[str, str], Dict[str, Dict[str, int]]]:
+    """
+    priority 순서대로 예산을 배분해서 섹션별 최종 텍스트와 report 를 돌려줌.
+    reserve: 답변(출력)용으로 남겨 둘 토큰. 프롬프트에는 budget - reserve 만 씀
+    report[name] = {"original": 원래 토큰 수, "used": 실제 포함된 토큰 수}
+    """
+    by_name = {s.name: s for s in sections}
+    order = [n for n in priority if n in by_name] + [s.name for s in sections if s.name not in priority]
+    original = {s.name: s.tokens if s.tokens is not None else counter.count(s.text) for s in sections}
+
+    remaining = budget - reserve - sum(original[s.name] for s in sections if s.required)
+    fitted: Dict[str, str] = {s.name: s.text for s in sections if s.required}
+    for name in order:
+        section = by_name[name]
+        if section.required:
+            continue
+        if original[name] <= remaining:
+            fitted[name] = section.text
+            remaining -= original[name]
+        elif remaining > 0:
+            keep = "tail" if section.trim == "head" else "head"
+            fitted[name] = _trim_lines(section.text, remaining, counter, keep)
+            remaining -= counter.count(fitted[name])
+        else:
+            fitted[name] = ""
+
+    report = {
+        s.name: {
+            "original": original[s.name],
+            "used": original[s.name] if fitted[s.name] == s.text else counter.count(fitted[s.name]),
+        }
+        for s in sections
+    }
+    return fitted, report
+
+
+class PromptTokenStats:
+    """요청별 섹션 토큰 report 를 누적해서 평균을 보여줌 (/stats)"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = 0
+        self.totals: Dict[str, Dict[str, int]] = {}
+
+    def record(self, report: Dict[str, Dict[str, int]]):
+        with self._lock:
+            self.requests += 1
+            for name, counts in report.items():
+                total = self.totals.setdefault(name, {"original": 0, "used": 0})
+                total["original"] += counts["original"]
+                total["used"] += counts["used"]
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            n = self.requests or 1
+            return {
+                "requests": self.requests,
+                "avg_tokens": {
+                    name: {"original": round(t["original"] / n, 1), "used": round(t["used"] / n, 1)}
+                    for name, t in self.totals.items()
+                },
+            }
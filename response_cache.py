@@ -0,0 +1,77 @@
+### 대화 내역이 없는 첫 턴 응답 캐시 (키마다 여러 변형을 모아 돌려가며 응답) ###
+
+from __future__ import annotations
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from embedding_cache import normalize_query_text
+
+
+def normalize_message(message: str) -> str:
+    t = normalize_query_text(message)
+    return re.sub(r"[\.\!\?\~…\s]+$", "", t)
+
+
+class ResponseVariantCache:
+    """
+    (RAG 인덱스 버전, 캐릭터, 성별, 정규화 메시지) -> 서로 다른 응답 variants 개까지 모아두는 풀.
+    - 풀이 다 차기 전에는 get() 이 None 을 돌려줘서 새로 생성하게 함 (다양성 확보)
+      단, 생성을 variants*2 번 시도해도 중복만 나오면 모인 것만으로 응답
+    - 풀이 차면 순서대로 돌려가며 응답
+    - 키 수는 max_keys 로 제한, 넘치면 가장 오래 안 쓴 키부터 제거
+    - 프로세스 메모리에만 있으므로 캐릭터 설정/프롬프트/후처리를 바꿔 서버를 다시 띄우면 비어서 시작
+    """
+
+    def __init__(self, variants: int = 3, max_keys: int = 1000):
+        self.variants = variants
+        self.max_keys = max_keys
+        self._pools: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None or not self._ready(pool):
+                self.misses += 1
+                return None
+            self._pools.move_to_end(key)
+            item = pool["items"][pool["next"] % len(pool["items"])]
+            pool["next"] += 1
+            self.hits += 1
+            return item
+
+    def _ready(self, pool: Dict[str, Any]) -> bool:
+        if not pool["items"]:
+            return False
+        return len(pool["items"]) >= self.variants or pool["attempts"] >= self.variants * 2
+
+    def add(self, key: Hashable, response: str, meta: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = {"items": [], "next": 0, "attempts": 0}
+                self._pools[key] = pool
+            self._pools.move_to_end(key)
+            pool["attempts"] += 1
+            items: List[Tuple[str, Dict[str, Any]]] = pool["items"]
+            if len(items) < self.variants and all(r != response for r, _ in items):
+                items.append((response, dict(meta or {})))
+            while len(self._pools) > self.max_keys:
+                self._pools.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "keys": len(self._pools),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,258 @@
+### 로컬 어휘 색인(한국어 문자 n-gram BM25) + 벡터 검색 하이브리드 ###
+#
+# 검색 모드
+#   vector  : 질의 임베딩(원격) -> FAISS. 기존 방식
+#   hybrid  : BM25 와 벡터 검색 결과를 RRF(reciprocal rank fusion)로 합침
+#   lexical : BM25 만 사용. 네트워크 호출 없음 (임베딩 API 가 느리거나 죽었을 때)
+# vector / hybrid 에서 질의 임베딩이 embed_timeout 을 넘기거나 실패하면 BM25 결과로 대신 응답
+#
+# 캐릭터 샤드: character 를 주면 그 멤버 섹션 청크 + 공용 청크(섹션 없음) 안에서만 검색
+#   (청크 태그는 ingest.tag_sections 가 metadata["characters"] 에 기록)
+
+from __future__ import annotations
+import asyncio
+import math
+import re
+import time
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from ingest import tag_sections
+
+MODE_VECTOR = "vector"
+MODE_HYBRID = "hybrid"
+MODE_LEXICAL = "lexical"
+MODES = (MODE_VECTOR, MODE_HYBRID, MODE_LEXICAL)
+
+NGRAM_SIZES = (2, 3)
+TOKEN_RE = re.compile(r"[0-9a-z가-힣]+")
+
+
+def char_ngrams(text: str, sizes: Sequence[int] = NGRAM_SIZES) -> List[str]:
+    """
+    한국어는 조사/어미가 붙어서 단어 단위로는 잘 안 맞으므로 어절 안의 문자 n-gram 을 색인어로 사용
+    ("연락했는데" 와 "연락" 이 "연락" bigram 으로 만남). n 보다 짧은 어절은 그대로 한 개
+    """
+    grams = []
+    shortest = min(sizes)
+    for token in TOKEN_RE.findall((text or "").lower()):
+        if len(token) < shortest:
+            grams.append(token)
+            continue
+        for n in sizes:
+            grams.extend(token[i:i + n] for i in range(len(token) - n + 1))
+    return grams
+
+
+class BM25Index:
+    """
+    메모리 BM25 역색인. 문서 번호 = FAISS 행 번호 (MmapVectorStore.docstore.all() 순서)
+    문서 길이가 고정이라 색인어별 BM25 가중치를 미리 계산해 두고, 검색은 가중치를 더하기만 함
+    """
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], n_docs: int):
+        self.postings = postings
+        self.n_docs = n_docs
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75,
+                   sizes: Sequence[int] = NGRAM_SIZES) -> "BM25Index":
+        counts = [Counter(char_ngrams(text, sizes)) for text in texts]
+        n_docs = len(counts)
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        avg_len = float(lengths.mean()) if n_docs and lengths.mean() > 0 else 1.0
+        raw: Dict[str, Tuple[List[int], List[int]]] = {}
+        for doc_id, c in enumerate(counts):
+            for term, tf in c.items():
+                docs, tfs = raw.setdefault(term, ([], []))
+                docs.append(doc_id)
+                tfs.append(tf)
+        postings = {}
+        for term, (docs, tfs) in raw.items():
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = tfs + k1 * (1 - b + b * lengths[docs] / avg_len)
+            postings[term] = (docs, (idf * tfs * (k1 + 1) / norm).astype(np.float32))
+        return cls(postings, n_docs)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document], **kwargs: Any) -> "BM25Index":
+        return cls.from_texts((doc.page_content for doc in documents), **kwargs)
+
+    def search(self, query: str, k: int = 4, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """(문서 번호, BM25 점수) 높은 순. 겹치는 색인어가 없는 문서는 제외. mask: 검색할 문서만 True"""
+        if self.n_docs == 0:
+            return []
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(char_ngrams(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        if mask is not None:
+            scores[~mask] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        return sorted(((int(i), float(scores[i])) for i in hits), key=lambda h: -h[1])
+
+
+class Shard:
+    """한 캐릭터의 검색 범위: 행 번호, BM25 용 mask, FAISS 용 IDSelector (한 번만 만들어 재사용)"""
+
+    def __init__(self, rows: np.ndarray, n_docs: int):
+        self.rows = rows
+        self.mask = np.zeros(n_docs, dtype=bool)
+        self.mask[rows] = True
+        self.selector = faiss.IDSelectorBatch(rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def character_shards(documents: Sequence[Document], characters: Sequence[str]) -> Dict[str, Shard]:
+    """캐릭터 -> (그 멤버 섹션 청크 + 공용 청크) 샤드. 태그가 하나도 없는 인덱스면 {} (샤드 없이 전체 검색)"""
+    tags = [doc.metadata.get("characters") for doc in documents]
+    if not any(tags):
+        return {}
+    general = [row for row, t in enumerate(tags) if not t]
+    shards = {}
+    for name in characters:
+        rows = sorted(set(general) | {row for row, t in enumerate(tags) if t and name in t})
+        if rows:
+            shards[name] = Shard(np.array(rows, dtype=np.int64), len(documents))
+    return shards
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int, rrf_k: int = 60,
+             weights: Optional[Sequence[float]] = None) -> List[int]:
+    """여러 순위 목록 -> sum(weight / (rrf_k + 순위)). 점수 척도(L2 거리 vs BM25)가 달라도 합칠 수 있음"""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, row in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + weight / (rrf_k + rank + 1)
+    return sorted(fused, key=lambda row: -fused[row])[:k]
+
+
+class HybridRetriever:
+    """
+    MmapVectorStore + 같은 청크로 만든 BM25Index.
+    asearch 는 BM25(로컬)를 질의 임베딩과 동시에 시작해서, 임베딩이 늦거나 실패해도 BM25 결과로 바로 응답
+    """
+
+    def __init__(self, store, lexical: BM25Index, mode: str = MODE_HYBRID, embed_timeout: Optional[float] = None,
+                 lexical_weight: float = 1.0, candidates: int = 20, rrf_k: int = 60,
+                 shards: Optional[Dict[str, Shard]] = None):
+        if mode not in MODES:
+            raise ValueError(f"지원하지 않는 검색 모드: {mode} ({', '.join(MODES)})")
+        self.store = store
+        self.lexical = lexical
+        self.mode = mode
+        self.embed_timeout = embed_timeout
+        self.lexical_weight = lexical_weight
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.shards = shards or {}
+        self._lock = Lock()
+        self.counts: Dict[str, int] = {}
+
+    @classmethod
+    def build(cls, store, characters: Sequence[str] = (), **kwargs: Any) -> "HybridRetriever":
+        """characters 를 주면 캐릭터 샤드도 만듦 (태그 없이 만든 예전 인덱스는 여기서 섹션 머리글로 태그)"""
+        start = time.perf_counter()
+        documents = store.docstore.all()
+        lexical = BM25Index.from_documents(documents)
+        if characters and "characters" not in store.manifest:
+            by_source: Dict[str, List[Document]] = {}
+            for doc in documents:
+                by_source.setdefault(doc.metadata.get("source", ""), []).append(doc)
+            for chunks in by_source.values():
+                tag_sections(chunks, characters)
+        shards = character_shards(documents, characters) if characters else {}
+        print(f"[RAG] BM25 색인 생성 ({lexical.n_docs}개 청크, 색인어 {len(lexical.postings)}개, "
+              f"캐릭터 샤드 {len(shards)}개, {(time.perf_counter() - start) * 1000:.0f}ms)")
+        return cls(store, lexical, shards=shards, **kwargs)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def _depth(self, k: int) -> int:
+        return max(k, self.candidates)
+
+    def _rows(self, mode: str, k: int, lexical_rows: List[int], vector_rows: Optional[List[int]]) -> List[int]:
+        if mode == MODE_LEXICAL or vector_rows is None:
+            return lexical_rows[:k]
+        if mode == MODE_VECTOR:
+            return vector_rows[:k]
+        return rrf_fuse([vector_rows, lexical_rows], k, self.rrf_k, [1.0, self.lexical_weight])
+
+    def _shard(self, character: Optional[str]) -> Optional[Shard]:
+        return self.shards.get(character) if character else None
+
+    def _lexical(self, query: str, depth: int, shard: Optional[Shard]) -> List[int]:
+        return [row for row, _ in self.lexical.search(query, depth, shard.mask if shard else None)]
+
+    def _vector(self, vector: List[float], depth: int, shard: Optional[Shard]) -> List[int]:
+        return [row for row, _ in self.store.search_rows(vector, depth, shard.selector if shard else None)]
+
+    def _documents(self, rows: List[int]) -> List[Document]:
+        docs = self.store.docstore.get_many(rows)
+        return [docs[row] for row in rows if row in docs]
+
+    def search_rows(self, query: str, k: int = 4, mode: Optional[str] = None,
+                    vector: Optional[List[float]] = None, character: Optional[str] = None) -> List[int]:
+        """동기 검색 (시작 시 페르소나 청크 준비, 벤치마크). vector 를 주면 질의 임베딩을 생략"""
+        mode = mode or self.mode
+        depth = self._depth(k)
+        shard = self._shard(character)
+        lexical_rows = self._lexical(query, depth, shard) if mode != MODE_VECTOR else []
+        vector_rows = None
+        if mode != MODE_LEXICAL:
+            if vector is None:
+                vector = self.store.embeddings.embed_query(query)
+            vector_rows = self._vector(vector, depth, shard)
+        return self._rows(mode, k, lexical_rows, vector_rows)
+
+    def search(self, query: str, k: int = 4, mode: Optional[str] = None,
+               character: Optional[str] = None) -> List[Document]:
+        return self._documents(self.search_rows(query, k, mode, character=character))
+
+    async def asearch(self, query: str, k: int = 4, mode: Optional[str] = None,
+                      character: Optional[str] = None) -> List[Document]:
+        mode = mode or self.mode
+        self._count(mode)
+        depth = self._depth(k)
+        shard = self._shard(character)
+        loop = asyncio.get_running_loop()
+        lexical_future = loop.run_in_executor(None, self._lexical, query, depth, shard)
+        vector_rows = None
+        if mode != MODE_LEXICAL:
+            try:
+                vector = await asyncio.wait_for(self.store.embeddings.aembed_query(query), self.embed_timeout)
+                vector_rows = await loop.run_in_executor(None, self._vector, vector, depth, shard)
+            except Exception as e:
+                # 임베딩 API 지연/장애: 이미 계산 중인 BM25 결과로 대신 응답
+                self._count("lexical_fallback")
+                reason = "시간 초과" if isinstance(e, asyncio.TimeoutError) else str(e)
+                print(f"[RAG] 질의 임베딩 실패({reason}) - BM25 결과로 대신 응답")
+        lexical_rows = await lexical_future
+        rows = self._rows(mode, k, lexical_rows, vector_rows)
+        return await loop.run_in_executor(None, self._documents, rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            "mode": self.mode,
+            "chunks": self.lexical.n_docs,
+            "terms": len(self.lexical.postings),
+            "shards": {name: len(shard) for name, shard in self.shards.items()},
+            **counts,
+        }
@@ -0,0 +1,85 @@
+### 웹 검색 결과 TTL 캐시 + single-flight (동일 검색 동시 요청은 한 번만 호출) ###
+
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlightTTLCache:
+    """
+    key -> (값, 저장 시각, 조회에 걸린 시간) 을 TTL 동안 보관.
+    - 캐시에 없으면 fetch 를 한 번만 실행하고, 같은 key 의 동시 요청은 그 결과를 함께 기다림
+    - fetch 는 별도 Task 로 돌기 때문에 기다리던 요청이 타임아웃으로 취소돼도 결과는 캐시에 남음
+    - 빈 결과(실패 등)는 캐시하지 않음
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.inflight_joins = 0
+        self.saved_seconds = 0.0
+
+    def _get_fresh(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def _run(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        start = time.perf_counter()
+        try:
+            value = await fetch()
+            latency = time.perf_counter() - start
+            if value:
+                self._entries[key] = (value, time.time(), latency)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value, latency
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._get_fresh(key)
+        if entry is not None:
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._run(key, fetch))
+            self._inflight[key] = task
+            value, _ = await asyncio.shield(task)
+            return value
+
+        self.inflight_joins += 1
+        waited_from = time.perf_counter()
+        value, latency = await asyncio.shield(task)
+        self.saved_seconds += max(latency - (time.perf_counter() - waited_from), 0.0)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses + self.inflight_joins
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "inflight_joins": self.inflight_joins,
+            "size": len(self._entries),
+            "hit_rate": round((self.hits + self.inflight_joins) / total, 4) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
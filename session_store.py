@@ -0,0 +1,411 @@
+### 세션(대화 내역) 저장소: 메모리 / SQLite(WAL, 멀티 워커 공유) ###
+
+from __future__ import annotations
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class SessionStore(ABC):
+    """
+    세션 저장소 인터페이스. TTL 만료는 저장소가 직접 처리함.
+    - get_or_create(session_id): 살아있는 세션이면 갱신 후 그대로, 아니면 새 id 발급
+    - append(session_id, lines): 히스토리 추가 (최근 max_history_lines 줄만 유지)
+    - history_text(session_id): 히스토리를 줄바꿈으로 합친 문자열
+    - reset(session_id): 히스토리(+요약) 비우기. 세션이 없으면 False
+    - history_lines / summary / apply_summary: 오래된 대화를 요약으로 접는 압축 단계용
+    - generation: 히스토리 앞부분이 바뀔 때(초기화, 상한 초과로 잘림, 요약 적용)마다 1씩 증가.
+      압축은 history_snapshot 으로 읽은 generation 이 그대로일 때만 결과를 적용함
+    blocking 이 True 인 저장소(디스크 I/O)는 async 코드에서 call() 로 불러야 이벤트 루프를 막지 않음
+    """
+
+    blocking = False
+
+    async def call(self, method: str, *args):
+        """이벤트 루프에서 저장소 메서드 호출. blocking 저장소는 스레드 풀에서 실행"""
+        fn = getattr(self, method)
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    @abstractmethod
+    def get_or_create(self, session_id: Optional[str]) -> str: ...
+
+    @abstractmethod
+    def append(self, session_id: str, lines: List[str]): ...
+
+    @abstractmethod
+    def history_text(self, session_id: str) -> str: ...
+
+    @abstractmethod
+    def reset(self, session_id: str) -> bool: ...
+
+    @abstractmethod
+    def history_lines(self, session_id: str) -> List[str]: ...
+
+    @abstractmethod
+    def history_snapshot(self, session_id: str) -> Tuple[int, List[str]]:
+        """(generation, 히스토리 줄) 을 한 번에 읽음"""
+
+    @abstractmethod
+    def summary(self, session_id: str) -> str: ...
+
+    @abstractmethod
+    def apply_summary(self, session_id: str, summary: str, folded_count: int,
+                      generation: Optional[int] = None) -> bool:
+        """
+        요약을 교체하고, 요약에 접힌 가장 오래된 folded_count 줄을 히스토리에서 제거.
+        generation 이 주어졌는데 현재 값과 다르면(그 사이 초기화/잘림) 아무것도 바꾸지 않고 False
+        """
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    단일 프로세스용 메모리 저장소.
+    sessions 는 last_seen 오래된 순으로 정렬된 OrderedDict 라서 만료/한도 초과 세션은 항상 맨 앞에 모임.
+    앞에서부터 필요한 만큼만 제거하므로 전체 스캔이 없음.
+    전역 lock 은 dict 구조 변경에만 짧게 잡고, 히스토리 읽기/쓰기는 세션별 lock 사용.
+    lock 순서: 세션 lock -> 전역 lock (반대로 잡지 않음)
+    """
+
+    def __init__(self, ttl_seconds: float, max_history_lines: int,
+                 max_sessions: int = 10000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_history_lines = max_history_lines
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def _history_bytes(lines: List[str]) -> int:
+        return sum(len(line.encode("utf-8")) for line in lines)
+
+    def _evict_locked(self, now: float):
+        while self.sessions:
+            sid, data = next(iter(self.sessions.items()))
+            over_limit = len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes
+            # 용량 초과로는 방금 사용한 마지막 세션까지 지우지 않음
+            if now - data["last_seen"] > self.ttl_seconds or (over_limit and len(self.sessions) > 1):
+                del self.sessions[sid]
+                self.total_bytes -= data["bytes"]
+            else:
+                break
+
+    def _touch_locked(self, session_id: str) -> Optional[dict]:
+        data = self.sessions.get(session_id)
+        if data is not None:
+            data["last_seen"] = time.time()
+            self.sessions.move_to_end(session_id)
+        return data
+
+    def _set_history(self, session_id: str, data: dict, history: List[str]):
+        """세션 lock 을 잡은 상태에서 호출. 히스토리 교체 + 전역 용량 갱신/초과분 제거"""
+        data["history"] = history
+        new_bytes = self._history_bytes(history)
+        with self._lock:
+            if self.sessions.get(session_id) is data:
+                self.total_bytes += new_bytes - data["bytes"]
+                data["bytes"] = new_bytes
+                self._evict_locked(time.time())
+            else:
+                data["bytes"] = new_bytes
+
+    def cleanup(self):
+        with self._lock:
+            self._evict_locked(time.time())
+
+    def get_or_create(self, session_id: Optional[str]) -> str:
+        with self._lock:
+            self._evict_locked(time.time())
+            if session_id and self._touch_locked(session_id) is not None:
+                return session_id
+            new_id = str(uuid.uuid4())
+            self.sessions[new_id] = {
+                "history": [], "summary": "", "generation": 0, "last_seen": time.time(), "bytes": 0, "lock": Lock()
+            }
+            self._evict_locked(time.time())
+            return new_id
+
+    def append(self, session_id: str, lines: List[str]):
+        with self._lock:
+            data = self._touch_locked(session_id)
+        if data is None: return
+        with data["lock"]:
+            history = data["history"] + lines
+            if len(history) > self.max_history_lines:
+                data["generation"] += 1
+            self._set_history(session_id, data, history[-self.max_history_lines:])
+
+    def history_text(self, session_id: str) -> str:
+        with self._lock:
+            data = self.sessions.get(session_id)
+        if data is None: return ""
+        with data["lock"]:
+            return "\n".join(data["history"])
+
+    def reset(self, session_id: str) -> bool:
+        with self._lock:
+            data = self._touch_locked(session_id)
+        if data is None: return False
+        with data["lock"]:
+            data["summary"] = ""
+            data["generation"] += 1
+            self._set_history(session_id, data, [])
+        return True
+
+    def history_lines(self, session_id: str) -> List[str]:
+        with self._lock:
+            data = self.sessions.get(session_id)
+        if data is None: return []
+        with data["lock"]:
+            return list(data["history"])
+
+    def history_snapshot(self, session_id: str) -> Tuple[int, List[str]]:
+        with self._lock:
+            data = self.sessions.get(session_id)
+        if data is None: return 0, []
+        with data["lock"]:
+            return data["generation"], list(data["history"])
+
+    def summary(self, session_id: str) -> str:
+        with self._lock:
+            data = self.sessions.get(session_id)
+        if data is None: return ""
+        with data["lock"]:
+            return data["summary"]
+
+    def apply_summary(self, session_id: str, summary: str, folded_count: int,
+                      generation: Optional[int] = None) -> bool:
+        with self._lock:
+            data = self.sessions.get(session_id)
+        if data is None: return False
+        with data["lock"]:
+            if generation is not None and generation != data["generation"]:
+                return False
+            data["summary"] = summary
+            data["generation"] += 1
+            self._set_history(session_id, data, data["history"][folded_count:])
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self.sessions), "bytes": self.total_bytes}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    여러 uvicorn 워커 프로세스가 함께 쓰는 SQLite(WAL) 저장소. 서버를 재시작해도 대화가 유지됨.
+    - 연결은 스레드별로 하나씩 (sqlite3 연결은 스레드 간 공유 불가)
+    - 만료는 last_seen 인덱스로 오래된 것부터 삭제 (cleanup_interval 마다 한 번)
+    - 만료된 세션은 삭제 전이라도 없는 세션으로 취급
+    - 모든 호출이 디스크를 기다리므로 blocking=True (async 코드에서는 call() 로 스레드에서 실행)
+    - 쓰기 잠금은 busy_timeout 초까지만 기다리고 sqlite3.OperationalError("database is locked") 로 실패
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, ttl_seconds: float, max_history_lines: int,
+                 max_sessions: int = 100000, cleanup_interval: float = 30.0, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.ttl_seconds = ttl_seconds
+        self.max_history_lines = max_history_lines
+        self.max_sessions = max_sessions
+        self.cleanup_interval = cleanup_interval
+        self._local = threading.local()
+        self._last_cleanup = 0.0
+
+        db = self._conn()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL,
+                summary TEXT NOT NULL DEFAULT '',
+                generation INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions(last_seen);
+            CREATE TABLE IF NOT EXISTS history (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                line TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_session ON history(session_id, seq);
+        """)
+        columns = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+        if "summary" not in columns:
+            db.execute("ALTER TABLE sessions ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+        if "generation" not in columns:
+            db.execute("ALTER TABLE sessions ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or getattr(self._local, "pid", None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _alive(self, db: sqlite3.Connection, session_id: str, now: float) -> bool:
+        row = db.execute(
+            "SELECT 1 FROM sessions WHERE id = ? AND last_seen >= ?",
+            (session_id, now - self.ttl_seconds),
+        ).fetchone()
+        return row is not None
+
+    def cleanup(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl_seconds,))
+            db.execute(
+                "DELETE FROM sessions WHERE id IN ("
+                " SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def get_or_create(self, session_id: Optional[str]) -> str:
+        self.cleanup()
+        db = self._conn()
+        now = time.time()
+        if session_id:
+            cur = db.execute(
+                "UPDATE sessions SET last_seen = ? WHERE id = ? AND last_seen >= ?",
+                (now, session_id, now - self.ttl_seconds),
+            )
+            if cur.rowcount:
+                return session_id
+        new_id = str(uuid.uuid4())
+        db.execute("INSERT INTO sessions (id, last_seen) VALUES (?, ?)", (new_id, now))
+        return new_id
+
+    def append(self, session_id: str, lines: List[str]):
+        db = self._conn()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._alive(db, session_id, now):
+                db.execute("ROLLBACK")
+                return
+            db.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (now, session_id))
+            db.executemany(
+                "INSERT INTO history (session_id, line) VALUES (?, ?)",
+                [(session_id, line) for line in lines],
+            )
+            trimmed = db.execute(
+                "DELETE FROM history WHERE session_id = ? AND seq NOT IN ("
+                " SELECT seq FROM history WHERE session_id = ? ORDER BY seq DESC LIMIT ?)",
+                (session_id, session_id, self.max_history_lines),
+            ).rowcount
+            if trimmed:
+                db.execute("UPDATE sessions SET generation = generation + 1 WHERE id = ?", (session_id,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def history_text(self, session_id: str) -> str:
+        return "\n".join(self.history_lines(session_id))
+
+    def reset(self, session_id: str) -> bool:
+        db = self._conn()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._alive(db, session_id, now):
+                db.execute("ROLLBACK")
+                return False
+            db.execute(
+                "UPDATE sessions SET last_seen = ?, summary = '', generation = generation + 1 WHERE id = ?",
+                (now, session_id),
+            )
+            db.execute("DELETE FROM history WHERE session_id = ?", (session_id,))
+            db.execute("COMMIT")
+            return True
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def history_lines(self, session_id: str) -> List[str]:
+        db = self._conn()
+        if not self._alive(db, session_id, time.time()):
+            return []
+        rows = db.execute(
+            "SELECT line FROM history WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def history_snapshot(self, session_id: str) -> Tuple[int, List[str]]:
+        db = self._conn()
+        # 읽기 트랜잭션 하나로 묶어서 generation 과 히스토리가 같은 시점 값이 되게 함
+        db.execute("BEGIN")
+        try:
+            row = db.execute(
+                "SELECT generation FROM sessions WHERE id = ? AND last_seen >= ?",
+                (session_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return 0, []
+            rows = db.execute(
+                "SELECT line FROM history WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            return row[0], [r[0] for r in rows]
+        finally:
+            db.execute("COMMIT")
+
+    def summary(self, session_id: str) -> str:
+        row = self._conn().execute(
+            "SELECT summary FROM sessions WHERE id = ? AND last_seen >= ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return row[0] if row else ""
+
+    def apply_summary(self, session_id: str, summary: str, folded_count: int,
+                      generation: Optional[int] = None) -> bool:
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT generation FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or (generation is not None and generation != row[0]):
+                db.execute("ROLLBACK")
+                return False
+            db.execute(
+                "UPDATE sessions SET summary = ?, generation = generation + 1 WHERE id = ?",
+                (summary, session_id),
+            )
+            db.execute(
+                "DELETE FROM history WHERE seq IN ("
+                " SELECT seq FROM history WHERE session_id = ? ORDER BY seq LIMIT ?)",
+                (session_id, folded_count),
+            )
+            db.execute("COMMIT")
+            return True
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        count = self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "sessions": count}
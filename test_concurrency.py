@@ -0,0 +1,460 @@
+"""
+무도연애상담소 동시성 테스트 (오프라인)
+- 느린 가짜 LLM 으로 /chat 동시 요청 처리 확인
+- RAG / 웹 검색 병렬 실행 및 타임아웃 확인
+- /chat/stream SSE 스트리밍 및 히스토리 최종본 확인, 중간에 끊겨도 LLM 대기열 자리 반납
+- 웹 검색 캐시 single-flight 확인
+- /chat/batch 순서 보장, 공유 작업 중복 제거, 항목별 에러 확인, 같은 session_id 항목의 세션 공유
+- 첫 턴 응답 캐시: 적중, 대화 중/인덱스 버전 변경 시 새로 생성, /chat 한 번에 히스토리는 한 번만 읽음
+- LLM 대기열: 우선순위, 가득 찼을 때 429 + Retry-After 확인
+- LLM 백엔드 헤지/페일오버 (지연이 정해진 가짜 백엔드)
+- 서버/API 키 없이 실행 가능: python test_concurrency.py 또는 pytest
+"""
+import asyncio
+import json
+import time
+
+import httpx
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from test_support import LLM_LATENCY, SlowFakeLLM, patched_final, use_fake_backends
+import final
+from postprocessing import postprocess_response, postprocess_llm_output
+from search_cache import SingleFlightTTLCache
+from llm_router import HedgedChatModel
+from response_cache import ResponseVariantCache
+from admission import AdmissionController, AdmissionRejected, PRIORITY_ONGOING, PRIORITY_NEW
+from session_store import InMemorySessionStore
+
+N_REQUESTS = 10
+
+
+async def _send_concurrent(n: int) -> float:
+    transport = httpx.ASGITransport(app=final.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        payloads = [
+            {"user_gender": "남성", "character": "박명수", "message": f"고민 {i}"}
+            for i in range(n)
+        ]
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[client.post("/chat", json=p) for p in payloads])
+        elapsed = time.perf_counter() - start
+
+    for r in responses:
+        assert r.status_code == 200, r.text
+    return elapsed
+
+
+def test_concurrent_chat_is_non_blocking():
+    """N개의 동시 요청이 LLM 지연 N배가 아니라 약 1배 안에 끝나야 함"""
+    with use_fake_backends():
+        elapsed = asyncio.run(_send_concurrent(N_REQUESTS))
+    print(f"{N_REQUESTS}개 동시 요청: {elapsed:.2f}s (LLM 지연 {LLM_LATENCY}s)")
+    assert elapsed < LLM_LATENCY * 3, f"요청이 직렬화됨: {elapsed:.2f}s"
+
+
+def test_context_providers_run_in_parallel_with_timeouts():
+    """RAG 와 검색이 동시에 돌고, 제한 시간을 넘긴 제공자는 프롬프트/플래그에서 빠져야 함"""
+    async def fake_rag(character, query=""):
+        await asyncio.sleep(0.3)
+        return "박명수 배경 지식"
+
+    async def fake_search(query, max_results=3, cache_key=None):
+        await asyncio.sleep(5)
+        return "[검색 결과 (사실 기반)]"
+
+    async def run():
+        transport = httpx.ASGITransport(app=final.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = time.perf_counter()
+            r = await client.post("/chat", json={
+                "user_gender": "남성", "character": "박명수", "message": "강남 데이트 코스 추천"
+            })
+            return r, time.perf_counter() - start
+
+    with use_fake_backends(llm=SlowFakeLLM(latency=0), tavily_client=object()), \
+            patched_final(get_character_context=fake_rag, perform_web_search=fake_search,
+                          RAG_TIMEOUT_SECONDS=1.0, WEB_SEARCH_TIMEOUT_SECONDS=0.4):
+        r, elapsed = asyncio.run(run())
+
+    assert r.status_code == 200, r.text
+    data = r.json()
+    assert data["rag_used"] is True
+    assert data["web_search_used"] is False
+    assert elapsed < 0.3 + 0.4 - 0.05, f"RAG/검색이 직렬로 실행됨: {elapsed:.2f}s"
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_matches_full_postprocessing():
+    """스트리밍 조각은 문장 단위로 오고, 히스토리에는 전체 후처리 결과가 저장되어야 함"""
+    raw = "답변: **형님**, 그건 충분히 이해합니다. (웃음) 일단 연락해보세요! 그리고 기다려요. 끝."
+
+    async def run():
+        transport = httpx.ASGITransport(app=final.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.post("/chat/stream", json={
+                "user_gender": "남성", "character": "박명수", "message": "썸녀가 연락을 안 받아요"
+            })
+            return r
+
+    with use_fake_backends(llm=FakeListChatModel(responses=[raw])):
+        r = asyncio.run(run())
+        assert r.status_code == 200, r.text
+        events = _parse_sse(r.text)
+        history = asyncio.run(final.get_history_text(events[-1][1]["session_id"]))
+
+    kinds = [e for e, _ in events]
+    assert kinds[0] == "meta" and kinds[-1] == "done"
+    assert kinds.count("delta") >= 2
+
+    expected = postprocess_llm_output("박명수", raw)
+    done = events[-1][1]
+    assert done["response"] == expected
+    streamed = " ".join(d["text"] for e, d in events if e == "delta")
+    assert streamed == expected
+    assert history.endswith(f"박명수: {expected}")
+
+
+def test_chat_stream_releases_slot_on_disconnect():
+    """meta 만 받고 끊거나 스트림을 한 번도 읽지 않아도 LLM 대기열 자리가 반납되어야 함"""
+    def request():
+        return final.ChatRequest(user_gender="남성", character="박명수", message="썸녀가 연락을 안 받아요")
+
+    async def run():
+        response = await final.chat_stream_endpoint(request())
+        first = await response.body_iterator.__anext__()
+        assert first.startswith("event: meta")
+        assert final.llm_admission.stats()["in_flight"] == 1
+        await response.body_iterator.aclose()
+        assert final.llm_admission.stats()["in_flight"] == 0
+
+        untouched = await final.chat_stream_endpoint(request())
+        assert final.llm_admission.stats()["in_flight"] == 1
+        await untouched.background()
+        await untouched.body_iterator.aclose()
+        assert final.llm_admission.stats()["in_flight"] == 0
+
+    with use_fake_backends(llm=FakeListChatModel(responses=["일단 연락해보세요. 그리고 기다려요."]),
+                           llm_admission=AdmissionController(max_concurrent=2, max_queue=2, max_wait_seconds=5)):
+        asyncio.run(run())
+
+
+def test_search_cache_single_flight():
+    """같은 키의 동시 검색은 한 번만 호출되고, 이후 요청은 캐시에서 응답해야 함"""
+    cache = SingleFlightTTLCache(ttl_seconds=60)
+    calls = []
+
+    async def fake_tavily():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "[검색 결과 (사실 기반)]"
+
+    async def run():
+        key = final.search_cache_key("강남 데이트 좋은 곳 알려줘")
+        same_key = final.search_cache_key("형님! 강남에서 데이트하기 좋은 곳 알려주세요!")
+        assert key == same_key
+        results = await asyncio.gather(*[cache.get_or_fetch(key, fake_tavily) for _ in range(5)])
+        results.append(await cache.get_or_fetch(same_key, fake_tavily))
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["inflight_joins"] == 4 and stats["hits"] == 1
+
+
+class FlakyFakeLLM(SlowFakeLLM):
+    """프롬프트에 '실패' 가 들어 있으면 예외를 내는 가짜 LLM. 동시에 실행 중인 호출 수의 최댓값을 기록"""
+    active: int = 0
+    peak: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if "실패" in messages[-1].content:
+            raise RuntimeError("fake llm failure")
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.active -= 1
+
+
+def test_chat_batch_order_dedup_and_inline_errors():
+    """배치 결과는 요청 순서대로, 같은 RAG/검색은 한 번만, 실패 항목만 error 로 와야 함"""
+    rag_calls, search_calls = [], []
+
+    async def fake_rag(character, query=""):
+        rag_calls.append((character, query))
+        await asyncio.sleep(0.05)
+        return f"{character} 배경 지식"
+
+    async def fake_search(query, max_results=3, cache_key=None):
+        search_calls.append(query)
+        await asyncio.sleep(0.05)
+        return "[검색 결과 (사실 기반)]"
+
+    messages = ["강남 데이트 코스 추천해줘", "강남 데이트 코스 추천해줘", "고백할까요?", "실패해줘", "고백할까요?", "홍대 맛집 추천"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=final.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/chat/batch", json={
+                "requests": [{"user_gender": "남성", "character": "박명수", "message": m} for m in messages],
+                "max_concurrency": 3,
+            })
+
+    llm = FlakyFakeLLM(latency=0.3)
+    with use_fake_backends(llm=llm, tavily_client=object()), \
+            patched_final(get_character_context=fake_rag, perform_web_search=fake_search):
+        r = asyncio.run(run())
+
+    assert r.status_code == 200, r.text
+    results = r.json()["results"]
+    assert len(results) == len(messages)
+    assert results[3]["error"] and results[3]["response"] is None
+    for i, item in enumerate(results):
+        if i != 3:
+            assert item["error"] is None and item["response"] == postprocess_response("박명수", "야, 그냥 솔직하게 말해.")
+            assert item["rag_used"] is True
+    assert [item["web_search_used"] for item in results] == [True, True, False, False, False, True]
+    assert len(rag_calls) == 4 and len(search_calls) == 2
+    # 성공하는 LLM 호출 5개 / 동시 3개 -> 동시에 실행된 호출은 최대 3개 (제한이 없으면 5, 직렬이면 1)
+    assert llm.peak == 3, f"동시 실행 제한이 다르게 동작함: 최대 {llm.peak}개"
+
+
+def test_chat_batch_shares_unknown_session_across_waves():
+    """처음 보는(또는 만료된) 같은 session_id 항목들은 wave 가 달라도 새 세션 하나를 함께 써야 함"""
+    messages = ["안녕하세요 처음 왔어요", "아까 한 말 기억나요?", "마지막 질문이요"]
+
+    async def run():
+        transport = httpx.ASGITransport(app=final.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.post("/chat/batch", json={
+                "requests": [{"session_id": "client-abc", "user_gender": "남성", "character": "박명수", "message": m}
+                             for m in messages] + [{"user_gender": "여성", "character": "유재석", "message": "고백할까요?"}],
+            })
+            assert r.status_code == 200, r.text
+            results = r.json()["results"]
+            return results, await final.session_store.call("history_lines", results[0]["session_id"])
+
+    with use_fake_backends(llm=SlowFakeLLM(latency=0.01)):
+        results, history = asyncio.run(run())
+
+    session_ids = [item["session_id"] for item in results]
+    assert all(item["error"] is None for item in results)
+    assert len(set(session_ids[:3])) == 1 and session_ids[3] != session_ids[0]
+    assert [line for line in history if line.startswith("User: ")] == [f"User: {m}" for m in messages]
+
+
+class CountingFakeLLM(SlowFakeLLM):
+    """호출할 때마다 번호가 붙은 답을 돌려주는 가짜 LLM"""
+    calls: int = 0
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"답변 {self.calls}."))])
+
+
+def test_response_cache_hits_and_misses():
+    """첫 턴의 같은 질문은 캐시에서, 대화 중이거나 인덱스 버전이 바뀌면 새로 생성"""
+    class FakeIndexManager:
+        version = "v1"
+
+        def check_disk(self):
+            pass
+
+    cache = ResponseVariantCache(variants=1, max_keys=10)
+    with use_fake_backends(llm=CountingFakeLLM(latency=0), response_cache=cache, index_manager=FakeIndexManager()), \
+            patched_final(RESPONSE_CACHE_ENABLED=True):
+        async def run():
+            transport = httpx.ASGITransport(app=final.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                async def ask(message, session_id=None):
+                    r = await client.post("/chat", json={
+                        "user_gender": "남성", "character": "박명수", "message": message, "session_id": session_id
+                    })
+                    return r.json()
+
+                first = await ask("고백할까요?")
+                cached = await ask("  고백할까요 ")
+                ongoing = await ask("고백할까요?", first["session_id"])
+                final.index_manager.version = "v2"
+                reindexed = await ask("고백할까요?")
+                return first, cached, ongoing, reindexed
+
+        first, cached, ongoing, reindexed = asyncio.run(run())
+        stats = final.response_cache.stats()
+        assert final.llm.calls == 3
+        assert cached["response"] == first["response"] and cached["session_id"] != first["session_id"]
+        assert ongoing["response"] != first["response"] and reindexed["response"] != first["response"]
+        assert stats["hits"] == 1 and stats["misses"] == 2 and stats["keys"] == 2
+
+
+class ReadCountingSessionStore(InMemorySessionStore):
+    """히스토리를 읽는 저장소 호출(history_text / history_lines) 수를 세는 세션 저장소"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.history_reads = 0
+
+    async def call(self, method, *args):
+        if method in ("history_text", "history_lines"):
+            self.history_reads += 1
+        return await super().call(method, *args)
+
+
+def test_chat_reads_history_once_per_request():
+    """캐시 키 / 경로 분류 / 프롬프트 / 대기열 우선순위가 요청 처음에 읽은 히스토리 하나를 나눠 써야 함"""
+    store = ReadCountingSessionStore(final.SESSION_TTL_SECONDS, final.MAX_HISTORY_LINES)
+    with use_fake_backends(llm=SlowFakeLLM(latency=0), session_store=store), \
+            patched_final(RESPONSE_CACHE_ENABLED=True, LLM_PRIORITIZE_ONGOING=True):
+        async def run():
+            transport = httpx.ASGITransport(app=final.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                reads = []
+                session_id = None
+                for message in ["고백할까요?", "네", "썸녀한테 먼저 연락해도 될까요?"]:
+                    before = store.history_reads
+                    r = await client.post("/chat", json={
+                        "user_gender": "남성", "character": "박명수", "message": message, "session_id": session_id
+                    })
+                    session_id = r.json()["session_id"]
+                    reads.append(store.history_reads - before)
+                return reads
+
+        assert asyncio.run(run()) == [1, 1, 1]
+
+
+def test_admission_priority_and_queue_full():
+    """자리가 나면 진행 중인 세션이 먼저, 대기열이 가득 차면 바로 거절되어야 함"""
+    controller = AdmissionController(max_concurrent=1, max_queue=2, max_wait_seconds=5)
+    order = []
+
+    async def job(name, priority):
+        async with controller.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0.05)
+
+    async def run():
+        first = asyncio.create_task(job("first", PRIORITY_NEW))
+        await asyncio.sleep(0)
+        new = asyncio.create_task(job("new", PRIORITY_NEW))
+        await asyncio.sleep(0)
+        ongoing = asyncio.create_task(job("ongoing", PRIORITY_ONGOING))
+        await asyncio.sleep(0)
+        assert controller.stats()["queued"] == 2
+        try:
+            await controller.acquire(PRIORITY_ONGOING)
+            raise AssertionError("대기열이 가득 찼는데 거절되지 않음")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full" and e.retry_after >= 1
+        await asyncio.gather(first, new, ongoing)
+
+    asyncio.run(run())
+    assert order == ["first", "ongoing", "new"]
+    stats = controller.stats()
+    assert stats["admitted"] == 3 and stats["rejected"] == 1 and stats["in_flight"] == 0
+
+
+def test_chat_returns_429_when_llm_queue_is_full():
+    """LLM 대기열이 가득 차면 500 이 아니라 429 + Retry-After 로 응답해야 함"""
+    with use_fake_backends(llm=SlowFakeLLM(latency=0.3),
+                           llm_admission=AdmissionController(max_concurrent=2, max_queue=1, max_wait_seconds=5)):
+        async def run():
+            transport = httpx.ASGITransport(app=final.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await asyncio.gather(*[
+                    client.post("/chat", json={"user_gender": "남성", "character": "박명수", "message": f"고민 {i}"})
+                    for i in range(5)
+                ])
+
+        responses = asyncio.run(run())
+        stats = final.llm_admission.stats()
+
+    codes = sorted(r.status_code for r in responses)
+    assert codes == [200, 200, 200, 429, 429], codes
+    for r in responses:
+        if r.status_code == 429:
+            assert int(r.headers["Retry-After"]) >= 1
+    assert stats["rejected"] == 2 and stats["max_queue_seen"] == 1
+
+
+BACKEND_EVENTS = []
+
+
+class ScriptedFakeLLM(SlowFakeLLM):
+    """정해진 지연 후 답하거나(fail=True 면) 에러를 내는 가짜 백엔드. 호출/취소 기록을 BACKEND_EVENTS 에 남김"""
+    fail: bool = False
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        BACKEND_EVENTS.append(f"{self.reply}:start")
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            BACKEND_EVENTS.append(f"{self.reply}:cancelled")
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.reply} down")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+def test_hedged_llm_hedges_and_fails_over():
+    """primary 가 늦으면 secondary 답을 쓰고 primary 는 취소, primary 에러면 secondary 로 페일오버"""
+    def router(primary_latency, secondary_latency, primary_fail=False):
+        BACKEND_EVENTS.clear()
+        return HedgedChatModel(
+            primary=ScriptedFakeLLM(reply="openai", latency=primary_latency, fail=primary_fail),
+            secondary=ScriptedFakeLLM(reply="google", latency=secondary_latency),
+            hedge_after_seconds=0.1,
+        )
+
+    async def timed(model):
+        start = time.perf_counter()
+        result = await model.ainvoke("고민 있어요")
+        return result.content, time.perf_counter() - start
+
+    fast = router(0.02, 0.02)
+    assert asyncio.run(timed(fast))[0] == "openai"
+    assert BACKEND_EVENTS == ["openai:start"]
+
+    slow = router(2.0, 0.1)
+    reply, elapsed = asyncio.run(timed(slow))
+    assert reply == "google" and elapsed < 0.5, elapsed
+    assert BACKEND_EVENTS == ["openai:start", "google:start", "openai:cancelled"]
+    assert slow.stats()["hedged"] == 1 and slow.stats()["wins_secondary"] == 1
+
+    down = router(0.02, 0.02, primary_fail=True)
+    assert asyncio.run(timed(down))[0] == "google"
+    assert BACKEND_EVENTS == ["openai:start", "google:start"]
+    assert down.stats()["failover"] == 1 and down.stats()["wins_secondary"] == 1
+
+    async def stream(model):
+        return "".join([chunk.content async for chunk in model.astream("고민 있어요")])
+
+    assert asyncio.run(stream(router(2.0, 0.1))) == "google"
+
+
+if __name__ == "__main__":
+    test_concurrent_chat_is_non_blocking()
+    test_context_providers_run_in_parallel_with_timeouts()
+    test_chat_stream_matches_full_postprocessing()
+    test_chat_stream_releases_slot_on_disconnect()
+    test_search_cache_single_flight()
+    test_chat_batch_order_dedup_and_inline_errors()
+    test_chat_batch_shares_unknown_session_across_waves()
+    test_response_cache_hits_and_misses()
+    test_chat_reads_history_once_per_request()
+    test_admission_priority_and_queue_full()
+    test_chat_returns_429_when_llm_queue_is_full()
+    test_hedged_llm_hedges_and_fails_over()
+    print("✅ 동시성 테스트 통과")
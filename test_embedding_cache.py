@@ -0,0 +1,57 @@
+"""
+질의 임베딩 캐시 테스트 (오프라인)
+- 메모리/디스크 적중, 재시작 후 유지, 디스크 파일은 첫 조회 때 생성
+- 실행: python test_embedding_cache.py 또는 pytest
+"""
+import os
+import asyncio
+import tempfile
+
+from test_support import CountingEmbeddings
+from embedding_cache import CachedQueryEmbeddings
+
+
+class QueryCountingEmbeddings(CountingEmbeddings):
+    """질의 임베딩 호출을 queries 에 기록"""
+
+    def __init__(self, dim: int = 16):
+        super().__init__(dim)
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def test_embedding_cache_hits_and_persists():
+    """정규화한 같은 질의는 메모리에서, 재시작 뒤에는 디스크에서 응답하고 파일은 첫 조회 때 생겨야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embedding_cache.sqlite")
+        base = QueryCountingEmbeddings()
+        cache = CachedQueryEmbeddings(base, provider="openai", model="test", disk_path=path)
+        assert not os.path.exists(path)
+
+        async def run(cache):
+            first = await cache.aembed_query("고백 타이밍  언제가 좋아요")
+            again = await cache.aembed_query(" 고백 타이밍 언제가 좋아요 ")
+            return first, again
+
+        first, again = asyncio.run(run(cache))
+        assert first == again and base.queries == ["고백 타이밍  언제가 좋아요"]
+        assert cache.stats() == {"hits": 1, "disk_hits": 0, "misses": 1, "size": 1, "hit_rate": 0.5}
+        assert os.path.exists(path)
+
+        restarted = CachedQueryEmbeddings(base, provider="openai", model="test", disk_path=path)
+        assert restarted.embed_query("고백 타이밍 언제가 좋아요") == first
+        assert restarted.embed_query("고백 타이밍 언제가 좋아요") == first
+        assert base.queries == ["고백 타이밍  언제가 좋아요"]
+        assert restarted.stats()["disk_hits"] == 1 and restarted.stats()["hits"] == 1
+        # 다른 모델의 캐시는 섞이지 않음
+        other = CachedQueryEmbeddings(base, provider="openai", model="other", disk_path=path)
+        other.embed_query("고백 타이밍 언제가 좋아요")
+        assert len(base.queries) == 2 and other.stats()["misses"] == 1
+
+
+if __name__ == "__main__":
+    test_embedding_cache_hits_and_persists()
+    print("✅ 임베딩 캐시 테스트 통과")
@@ -0,0 +1,135 @@
+"""
+인덱스 교체 테스트 (오프라인)
+- 오래된 인덱스 감지, 기존 인덱스로 응답하면서 재구축 후 교체, /admin/reload_index (ADMIN_TOKEN 필수)
+- 다른 프로세스가 인덱스 잠금을 잡고 있으면 재구축하지 않음
+- 실행: python test_index_manager.py 또는 pytest
+"""
+import os
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from test_support import CountingEmbeddings, text_chunks, use_fake_backends
+import final
+from index_manager import VectorIndexManager
+from vector_index import index_lock
+
+
+class SlowEmbeddings(CountingEmbeddings):
+    """문서 임베딩이 느린 CountingEmbeddings (재구축이 진행 중인 동안 검색해 보기 위함)"""
+    delay: float = 0.0
+
+    def embed_documents(self, texts):
+        time.sleep(self.delay)
+        return super().embed_documents(texts)
+
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+def make_manager(tmp, embedding, pdf_text):
+    data_dir = os.path.join(tmp, "data")
+    os.makedirs(data_dir)
+    pdf = os.path.join(data_dir, "a.pdf")
+    with open(pdf, "w", encoding="utf-8") as f:
+        f.write(pdf_text)
+    manager = VectorIndexManager(
+        os.path.join(tmp, "index"), data_dir, embedding,
+        prepare=final.prepare_rag,
+        on_swap=final.set_vectorstore,
+        check_interval=0,
+        load_chunks=text_chunks
+    )
+    return manager, pdf
+
+
+def test_index_hot_swap_and_admin_reload():
+    """PDF 가 바뀌면 오래된 인덱스로 감지하고, 재구축 동안 기존 인덱스로 응답한 뒤 새 인덱스로 교체되어야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        embedding = SlowEmbeddings()
+        manager, a = make_manager(tmp, embedding, "박명수 청크\n유재석 청크\n")
+        with use_fake_backends(index_manager=manager, ADMIN_TOKEN=ADMIN_TOKEN):
+            manager.load_initial()
+            old_store = final.vectorstore
+            assert old_store.index.ntotal == 2 and manager.staleness() == []
+            assert final.persona_docs["박명수"][0].page_content == "박명수 청크"
+            embedding.embedded.clear()
+
+            with open(a, "w", encoding="utf-8") as f:
+                f.write("박명수 청크\n하하 청크\n")
+            assert manager.staleness() == [f"변경된 파일: {a}"]
+
+            async def run():
+                embedding.delay = 0.5
+                transport = httpx.ASGITransport(app=final.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test",
+                                             headers={"X-Admin-Token": ADMIN_TOKEN}) as client:
+                    started = await client.post("/admin/reload_index", params={"rebuild": "true"})
+                    assert started.json()["status"] == "started"
+                    await asyncio.sleep(0.1)
+                    # 재구축 중: 기존 인덱스로 계속 검색됨
+                    assert manager.rebuilding and final.vectorstore is old_store
+                    assert (await final.get_character_context("유재석", "유재석 청크 찾아주세요")).startswith("유재석 청크")
+                    busy = await client.post("/admin/reload_index", params={"rebuild": "true"})
+                    assert busy.json()["status"] == "already_running"
+                    while manager.busy:
+                        await asyncio.sleep(0.05)
+                    stats = (await client.get("/stats")).json()["vector_index"]
+                    assert stats["swaps"] == 2 and stats["stale_reasons"] == [] and stats["last_error"] is None
+                    # 디스크 인덱스가 그대로면 다시 읽지 않음
+                    same = await client.post("/admin/reload_index")
+                    assert same.json()["status"] == "up_to_date"
+
+            asyncio.run(run())
+            assert embedding.embedded == ["하하 청크"]
+            assert final.vectorstore is not old_store and final.vectorstore.index.ntotal == 2
+            assert final.vectorstore.similarity_search("하하 청크", k=1)[0].page_content == "하하 청크"
+            # 교체 전에 연 인덱스도 디렉터리가 지워진 뒤 계속 검색 가능
+            assert old_store.similarity_search("유재석 청크", k=1)[0].page_content == "유재석 청크"
+
+
+def test_admin_requires_token():
+    """ADMIN_TOKEN 이 없으면 로컬 요청이라도 /admin/* 는 꺼져 있고, 있으면 같은 토큰만 통과"""
+    async def post(headers=None):
+        transport = httpx.ASGITransport(app=final.app, client=("127.0.0.1", 12345))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/admin/reload_index", headers=headers)
+
+    with use_fake_backends(ADMIN_TOKEN=None):
+        assert asyncio.run(post()).status_code == 403
+        assert asyncio.run(post({"X-Admin-Token": ""})).status_code == 403
+    with use_fake_backends(ADMIN_TOKEN=ADMIN_TOKEN):
+        assert asyncio.run(post()).status_code == 403
+        assert asyncio.run(post({"X-Admin-Token": "wrong"})).status_code == 403
+        assert asyncio.run(post({"X-Admin-Token": ADMIN_TOKEN})).status_code == 503  # 토큰은 통과, RAG 없음
+
+
+def test_rebuild_skipped_while_another_process_holds_lock():
+    """다른 프로세스(여기서는 다른 스레드의 잠금)가 인덱스를 쓰는 중이면 임베딩하지 않고 busy_elsewhere"""
+    with tempfile.TemporaryDirectory() as tmp:
+        embedding = CountingEmbeddings()
+        manager, a = make_manager(tmp, embedding, "박명수 청크\n")
+        with use_fake_backends(index_manager=manager):
+            manager.load_initial()
+            version = manager.version
+            embedding.embedded.clear()
+            with open(a, "w", encoding="utf-8") as f:
+                f.write("하하 청크\n")
+
+            with index_lock(manager.index_path):
+                result = asyncio.run(manager.rebuild())
+            assert result["status"] == "busy_elsewhere" and manager.version == version
+            assert embedding.embedded == [] and not manager.busy
+
+            # 잠금이 풀리면 다음 재구축은 정상 진행
+            assert asyncio.run(manager.rebuild())["status"] == "rebuilt"
+            assert embedding.embedded == ["하하 청크"] and manager.version != version
+
+
+if __name__ == "__main__":
+    test_index_hot_swap_and_admin_reload()
+    test_admin_requires_token()
+    test_rebuild_skipped_while_another_process_holds_lock()
+    print("✅ 인덱스 교체 테스트 통과")
@@ -0,0 +1,79 @@
+"""
+증분 수집 테스트 (오프라인)
+- 새 청크만 임베딩, 사라진 청크 제거
+- 여러 파일에 같은 청크가 있어도 바뀌지 않은 파일의 청크는 빠지지 않음 (청크 해시로 재사용)
+- 실행: python test_ingest.py 또는 pytest
+"""
+import os
+import tempfile
+
+from test_support import CountingEmbeddings, text_chunks
+from ingest import ingest_files
+from vector_index import MmapVectorStore
+
+
+def test_incremental_ingest_embeds_only_new_chunks():
+    """두 번째 수집부터는 바뀐 청크만 임베딩하고, 사라진 청크의 벡터는 인덱스에서 빠져야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        a, b = os.path.join(tmp, "a.txt"), os.path.join(tmp, "b.txt")
+        index_path = os.path.join(tmp, "index")
+        with open(a, "w", encoding="utf-8") as f:
+            f.write("박명수 청크\n유재석 청크\n")
+        with open(b, "w", encoding="utf-8") as f:
+            f.write("노홍철 청크\n유재석 청크\n")
+        embedding = CountingEmbeddings()
+
+        first = ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        assert first["embedded"] == 3 and first["duplicates"] == 1
+
+        embedding.embedded.clear()
+        again = ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        assert embedding.embedded == [] and again["kept"] == 3 and again["files_reparsed"] == 0
+
+        with open(b, "w", encoding="utf-8") as f:
+            f.write("하하 청크\n")
+        changed = ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        assert embedding.embedded == ["하하 청크"]
+        assert changed["removed"] == 1 and changed["kept"] == 2 and changed["files_reparsed"] == 1
+
+        store = MmapVectorStore.load(index_path, embedding)
+        assert store.index.ntotal == 3
+        assert store.similarity_search("하하 청크", k=1)[0].page_content == "하하 청크"
+        assert store.similarity_search("박명수 청크", k=1)[0].page_content == "박명수 청크"
+        assert set(store.manifest["files"]) == {a, b}
+        assert store.manifest["embedding_model"] == "CountingEmbeddings"
+
+
+def test_unchanged_file_keeps_chunk_shared_with_changed_file():
+    """겹치는 청크의 대표가 다른 파일에 기록돼 있어도, 그 파일이 바뀌었을 때 그대로인 파일의 청크가 남아야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        a, b = os.path.join(tmp, "a.txt"), os.path.join(tmp, "b.txt")
+        index_path = os.path.join(tmp, "index")
+        with open(a, "w", encoding="utf-8") as f:
+            f.write("박명수 청크\n유재석 청크\n")
+        with open(b, "w", encoding="utf-8") as f:
+            f.write("노홍철 청크\n유재석 청크\n")
+        embedding = CountingEmbeddings()
+        ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        manifest = MmapVectorStore.load(index_path, embedding).manifest
+        assert manifest["files"][a]["chunks"] == manifest["files"][b]["chunks"] == 2
+
+        embedding.embedded.clear()
+        with open(a, "w", encoding="utf-8") as f:
+            f.write("박명수 청크\n")
+        changed = ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        assert embedding.embedded == [] and changed["removed"] == 0 and changed["kept"] == 3
+
+        store = MmapVectorStore.load(index_path, embedding)
+        assert store.index.ntotal == 3 and store.manifest["files"][b]["chunks"] == 2
+        shared = store.similarity_search("유재석 청크", k=1)[0]
+        assert shared.page_content == "유재석 청크" and shared.metadata["source"] == b
+
+        again = ingest_files(index_path, [a, b], embedding, load_chunks=text_chunks)
+        assert again["files_reparsed"] == 0 and again["kept"] == 3 and embedding.embedded == []
+
+
+if __name__ == "__main__":
+    test_incremental_ingest_embeds_only_new_chunks()
+    test_unchanged_file_keeps_chunk_shared_with_changed_file()
+    print("✅ 수집 테스트 통과")
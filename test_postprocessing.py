@@ -0,0 +1,26 @@
+"""
+응답 후처리 테스트 (오프라인)
+- 고정 코퍼스(postprocess_cases.jsonl)에서 최초 구현과 같은 결과 (공개 함수 / 서버 경로 각각)
+- 실행: python test_postprocessing.py 또는 pytest
+"""
+import pytest
+
+from test_support import load_cases
+from postprocessing import postprocess_response, postprocess_llm_output
+
+# 최초 구현(baseline 커밋 280ba51)으로 만든 기대값. response = 그때의 postprocess_response,
+# llm_output = 그때 final.py /chat 의 '괄호 제거 -> ㅇㅇ님 치환 -> postprocess_response'. 후처리 규칙을 바꾸면 함께 다시 만들 것
+POSTPROCESS_CASES = load_cases("postprocess_cases.jsonl")
+
+
+@pytest.mark.parametrize("case", POSTPROCESS_CASES, ids=[f"{i}-{c['character']}" for i, c in enumerate(POSTPROCESS_CASES)])
+def test_postprocess_matches_previous_implementation(case):
+    """고정 코퍼스에서 postprocess_response / 서버 후처리 결과가 이전 구현과 글자 하나까지 같아야 함"""
+    assert postprocess_response(case["character"], case["raw"]) == case["response"]
+    assert postprocess_llm_output(case["character"], case["raw"]) == case["llm_output"]
+
+
+if __name__ == "__main__":
+    for case in POSTPROCESS_CASES:
+        test_postprocess_matches_previous_implementation(case)
+    print("✅ 후처리 테스트 통과")
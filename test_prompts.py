@@ -0,0 +1,103 @@
+"""
+프롬프트 조립 테스트 (오프라인)
+- 캐릭터 프롬프트: 미리 컴파일한 템플릿이 이전 렌더링(prompt_render_cases.jsonl)과 같고 고정 부분이 맨 앞
+- 고정 프롬프트 토큰 수는 import 때가 아니라 처음 쓸 때 셈 (import 만으로 tiktoken 인코딩을 불러오지 않음)
+- 토큰 예산: 우선순위대로 섹션 배분, 답변 예산 확보, 히스토리는 최근 줄부터 유지 (근사치 토크나이저)
+- 실행: python test_prompts.py 또는 pytest
+"""
+import subprocess
+import sys
+
+import pytest
+
+from test_support import TEST_DIR, load_cases, patched_final
+import final
+from prompt_budget import PromptSection, TokenCounter, fit_sections, TOKENIZER_APPROX
+
+# 캐릭터별 템플릿 컴파일 이전 구현(요청마다 f-string)으로 렌더링한 프롬프트. 캐릭터 설정/문구를 바꾸면 함께 다시 만들 것
+PROMPT_RENDER_CASES = load_cases("prompt_render_cases.jsonl")
+
+
+def _expected_prompt_after_reorder(case) -> str:
+    """
+    이전 프롬프트에서 의도한 변경만 적용: 규칙 안의 사용자 성별을 고정 부분 뒤 [사용자 정보] 로 옮김.
+    그 외(페르소나/규칙 문구, 배경 지식/검색/대화 내역/사용자 메시지 배치)는 글자 하나까지 같아야 함
+    """
+    gender_rule = f"1. **사용자 성별:** {case['user_gender']}\n"
+    end_of_rules = "- [대화 내역]을 참고하여 문맥을 자연스럽게 이으십시오.\n"
+    prompt = case["prompt"].replace(gender_rule, "1. **사용자 성별:** 아래 [사용자 정보] 참고.\n", 1)
+    cut = prompt.index(end_of_rules) + len(end_of_rules)
+    return prompt[:cut] + f"\n[사용자 정보]\n- 사용자 성별: {case['user_gender']}\n" + prompt[cut:]
+
+
+@pytest.mark.parametrize("case", PROMPT_RENDER_CASES, ids=[f"{i}-{c['character']}" for i, c in enumerate(PROMPT_RENDER_CASES)])
+def test_character_prompt_matches_previous_render(case):
+    """캐릭터별로 미리 컴파일한 템플릿이 이전 구현과 같은 프롬프트를 만들고, 고정 부분이 맨 앞에 오는지"""
+    compiled = final.get_character_prompt(case["character"])
+    prompt = compiled["template"].format(
+        dynamic_system=final.build_dynamic_system(case["user_gender"], case["rag_context"], case["web_search_context"]),
+        chat_history=case["chat_history"],
+        user_message=case["user_message"]
+    )
+    assert prompt == _expected_prompt_after_reorder(case)
+    assert prompt.startswith(compiled["static_prefix"])
+    assert case["user_gender"] not in compiled["static_prefix"]
+
+
+def test_prompt_sections_fit_budget_in_priority_order():
+    """필수 섹션은 항상, 나머지는 우선순위대로 채우고 답변 예산만큼은 비워 둬야 함. 히스토리는 최근 줄부터 남김"""
+    counter = TokenCounter(tokenizer=TOKENIZER_APPROX)
+    assert counter.load() == TOKENIZER_APPROX and counter.stats()["mode"] == "approx"
+    assert counter.count("고백 ok?") == 2 + 1 and counter.count("") == 0
+
+    history = "\n".join(f"User: {'가' * 9}{i}" for i in range(10))  # 줄마다 한글 9 + (영문/숫자/줄바꿈 8자)/4 = 11토큰
+    sections = [
+        PromptSection("system", "나" * 50, required=True),
+        PromptSection("rag", "다" * 30),
+        PromptSection("history", history, trim="head"),
+        PromptSection("web_search", "라" * 40),
+        PromptSection("user_message", "마" * 10, required=True),
+    ]
+    priority = ["system", "user_message", "web_search", "rag", "history"]
+
+    fitted, report = fit_sections(sections, 200, priority, counter)
+    assert fitted["system"] == sections[0].text and fitted["web_search"] == sections[3].text
+    assert fitted["rag"] == sections[1].text
+    # 남은 70토큰 -> 최근 6줄 (11토큰씩)
+    assert fitted["history"].split("\n") == history.split("\n")[-6:]
+    assert report["history"] == {"original": counter.count(history), "used": counter.count(fitted["history"])}
+    assert sum(r["used"] for r in report.values()) <= 200
+
+    # 답변 예산 80을 빼면 history 는 빠지고 rag 는 잘림
+    fitted, report = fit_sections(sections, 200, priority, counter, reserve=80)
+    assert fitted["web_search"] == sections[3].text and fitted["history"] == ""
+    assert 0 < report["rag"]["used"] < report["rag"]["original"] and fitted["rag"].endswith("...")
+    assert sum(r["used"] for r in report.values()) <= 120
+
+    # 필수 섹션만으로 예산을 넘어도 필수 섹션은 그대로, 나머지는 비움
+    fitted, report = fit_sections(sections, 40, priority, counter)
+    assert fitted["system"] == sections[0].text and fitted["user_message"] == sections[4].text
+    assert fitted["rag"] == fitted["web_search"] == fitted["history"] == ""
+
+
+def test_static_prefix_tokens_counted_lazily():
+    """import final 은 토크나이저를 불러오지 않고, 고정 프롬프트 토큰 수는 첫 사용 때 한 번만 셈"""
+    probe = ("import final; "
+             "print(final.token_counter.mode, all(p['tokens'] is None for p in final.character_prompts.values()))")
+    out = subprocess.run([sys.executable, "-c", probe], cwd=TEST_DIR, capture_output=True, text=True, check=True)
+    assert out.stdout.strip().splitlines()[-1] == "None True"
+
+    counter = TokenCounter(tokenizer=TOKENIZER_APPROX)
+    persona = final._compile_character_prompt("박명수")
+    with patched_final(token_counter=counter):
+        assert final.static_prefix_tokens(persona) == counter.count(persona["static_prefix"]) > 0
+    persona["static_prefix"] = ""
+    assert final.static_prefix_tokens(persona) > 0  # 저장된 값을 다시 씀
+
+
+if __name__ == "__main__":
+    for case in PROMPT_RENDER_CASES:
+        test_character_prompt_matches_previous_render(case)
+    test_static_prefix_tokens_counted_lazily()
+    test_prompt_sections_fit_budget_in_priority_order()
+    print("✅ 프롬프트 테스트 통과")
@@ -20,11 +20,11 @@ def print_response(character, message, response_data):
     """응답 깔끔하게 출력"""
     print(f"\n👤 사용자: {message}")
     print(f"💬 {character}: {response_data['response']}")
-    print(f"\n📊 상태: 웹검색={response_data['web_search_used']} | RAG={response_data['rag_used']}")
+    print(f"\n📊 상태: 웹검색={response_data['web_search_used']} | RAG={response_data['rag_used']} | 경로={response_data.get('route', 'full')}")
 
 
 def test_simple_greeting():
-    """테스트 1: 간단한 인사 (RAG 사용 확인)"""
+    """테스트 1: 간단한 인사 (가벼운 메시지 경로 - RAG 미사용 확인)"""
     print_separator("테스트 1: 간단한 인사")
     
     payload = {
@@ -265,7 +265,7 @@ def test_rag_usage_summary():
     print_separator("테스트 10: RAG 사용 통계")
     
     characters = ["박명수", "노홍철", "유재석", "정준하", "정형돈", "하하", "광희", "연애의 신"]
-    message = "안녕하세요"
+    message = "썸 타는 사람한테 먼저 연락해도 될까요?"  # 인사만 하면 가벼운 메시지 경로라 RAG 를 쓰지 않음
     
     rag_stats = {"사용": 0, "미사용": 0}
     
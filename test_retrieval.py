@@ -0,0 +1,110 @@
+"""
+검색 테스트 (오프라인)
+- BM25 + 벡터 하이브리드 검색: 어휘 검색만으로 응답(네트워크 없음), 임베딩 장애 시 BM25 로 대체
+- 캐릭터 샤드: 멤버 섹션 태그, 그 멤버 + 공용 청크 안에서만 검색
+- 실행: python test_retrieval.py 또는 pytest
+"""
+import os
+import asyncio
+import tempfile
+
+from langchain_core.documents import Document
+
+from test_support import CountingEmbeddings, text_chunks
+from ingest import ingest_files, stale_reasons
+from vector_index import MmapVectorStore
+from retrieval import HybridRetriever, BM25Index, char_ngrams, MODE_HYBRID, MODE_LEXICAL
+
+
+class DownEmbeddings(CountingEmbeddings):
+    """질의 임베딩 API 가 죽은 상황 (문서 임베딩은 색인 구축용으로만 사용)"""
+    queries = 0
+
+    def embed_query(self, text):
+        self.queries += 1
+        raise ConnectionError("임베딩 API 응답 없음")
+
+
+def test_hybrid_retrieval_and_lexical_fallback():
+    """BM25 는 조사가 붙은 질의도 n-gram 으로 찾고, 임베딩 API 가 죽어도 BM25 결과로 응답해야 함"""
+    assert "연락" in char_ngrams("먼저 연락했는데")
+    chunks = [
+        "썸 타는 사람에게 먼저 연락하는 타이밍",
+        "이별 후에 전 연인에게 다시 연락해도 될까",
+        "소개팅 첫 만남 대화 주제",
+        "고백을 거절당했을 때 마음 정리",
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        with open(os.path.join(data_dir, "a.pdf"), "w", encoding="utf-8") as f:
+            f.write("\n".join(chunks) + "\n")
+        ingest_files(os.path.join(tmp, "index"), [os.path.join(data_dir, "a.pdf")], CountingEmbeddings(),
+                     load_chunks=text_chunks)
+        embedding = DownEmbeddings()
+        store = MmapVectorStore.load(os.path.join(tmp, "index"), embedding)
+        retriever = HybridRetriever.build(store, mode=MODE_HYBRID, embed_timeout=1.0)
+
+        lexical = BM25Index.from_texts(chunks)
+        assert lexical.search("소개팅에서 무슨 대화를 하죠", k=1)[0][0] == 2
+
+        async def run():
+            offline = await retriever.asearch("전 연인한테 연락해도 되나요?", k=1, mode=MODE_LEXICAL)
+            assert offline[0].page_content == chunks[1]
+            assert embedding.queries == 0  # 어휘 검색만 하면 임베딩 호출 없음
+            fallback = await retriever.asearch("고백 거절당했어요", k=2)
+            assert fallback[0].page_content == chunks[3]
+            assert embedding.queries == 1
+
+        asyncio.run(run())
+        stats = retriever.stats()
+        assert stats["lexical"] == 1 and stats["hybrid"] == 1 and stats["lexical_fallback"] == 1
+
+        # 임베딩이 정상이면 두 순위를 합침: 양쪽 모두 1위인 청크가 1위
+        store = MmapVectorStore.load(os.path.join(tmp, "index"), CountingEmbeddings())
+        retriever = HybridRetriever.build(store, mode=MODE_HYBRID)
+        assert retriever.search("이별 후에 전 연인에게 다시 연락해도 될까", k=1)[0].page_content == chunks[1]
+
+
+def _paragraph_chunks(path):
+    with open(path, encoding="utf-8") as f:
+        return [Document(page_content=part.strip("\n"), metadata={"source": path})
+                for part in f.read().split("\n\n") if part.strip()]
+
+
+def test_character_shards_limit_search_space():
+    """청크에 멤버 섹션 태그가 붙고, 캐릭터 검색은 그 멤버 섹션 + 공용 청크 안에서만 이뤄져야 함"""
+    characters = ["박명수", "유재석"]
+    with tempfile.TemporaryDirectory() as tmp:
+        members, general = os.path.join(tmp, "members.pdf"), os.path.join(tmp, "general.pdf")
+        with open(members, "w", encoding="utf-8") as f:
+            f.write("무도 연애 상담소\n-  박명수  호통 개그\n\n"
+                    "연애 특징: 밀당을 싫어함\n\n"
+                    "마무리 문장\n-  유재석  메인 MC\n\n"
+                    "연애 특징: 밀당 없이 배려함\n")
+        with open(general, "w", encoding="utf-8") as f:
+            f.write("첫 데이트 장소 고르는 법\n")
+        index_path = os.path.join(tmp, "index")
+        ingest_files(index_path, [members, general], CountingEmbeddings(),
+                     load_chunks=_paragraph_chunks, characters=characters)
+        store = MmapVectorStore.load(index_path, CountingEmbeddings())
+        tags = [doc.metadata["characters"] for doc in store.docstore.all()]
+        assert tags == [["박명수"], ["박명수"], ["박명수", "유재석"], ["유재석"], []]
+        assert stale_reasons(store.manifest, [members, general], CountingEmbeddings(), characters) == []
+        assert stale_reasons(store.manifest, [members, general], CountingEmbeddings(), characters + ["하하"])
+
+        retriever = HybridRetriever.build(store, characters=characters, mode=MODE_LEXICAL)
+        assert {name: len(shard) for name, shard in retriever.shards.items()} == {"박명수": 4, "유재석": 3}
+        found = [doc.page_content for doc in retriever.search("연애 특징 밀당", k=5, character="유재석")]
+        assert found[0] == "연애 특징: 밀당 없이 배려함" and "연애 특징: 밀당을 싫어함" not in found
+        assert "첫 데이트 장소 고르는 법" in [doc.page_content for doc in retriever.search("데이트", k=2, character="박명수")]
+        # 벡터 검색도 샤드 안에서만 (FAISS IDSelector)
+        vector = CountingEmbeddings().embed_query("연애 특징: 밀당을 싫어함")
+        rows = retriever.search_rows("", k=5, mode="vector", vector=vector, character="유재석")
+        assert set(rows) <= set(retriever.shards["유재석"].rows.tolist()) and 1 not in rows
+
+
+if __name__ == "__main__":
+    test_hybrid_retrieval_and_lexical_fallback()
+    test_character_shards_limit_search_space()
+    print("✅ 검색 테스트 통과")
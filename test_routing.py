@@ -0,0 +1,111 @@
+"""
+메시지 경로 / 검색 여부 테스트 (오프라인)
+- 가벼운 메시지(인사 등) 경로: RAG 없이 작은 모델로 처리, 맞장구는 대화 첫 메시지일 때만
+- 짧은 상담 질문도 검색, 질문 검색 결과가 페르소나 청크보다 앞에 오고 잘리지 않음
+- 실행: python test_routing.py 또는 pytest
+"""
+import asyncio
+
+import httpx
+from langchain_core.documents import Document
+
+from test_support import SlowFakeLLM, patched_final, use_fake_backends
+import final
+from message_router import TrivialMessageClassifier
+from postprocessing import postprocess_response
+
+
+def test_trivial_messages_skip_rag_and_use_fast_model():
+    """인사는 RAG 없이 작은 모델로, 상담 질문은 전체 파이프라인으로 가고 route 가 응답/통계에 남아야 함"""
+    rag_calls = []
+
+    async def fake_rag(character, query=""):
+        rag_calls.append(query)
+        return f"{character} 배경 지식"
+
+    with use_fake_backends(llm=SlowFakeLLM(latency=0, reply="큰 모델 답변."),
+                           fast_llm=SlowFakeLLM(latency=0, reply="야, 왔냐."),
+                           get_character_context=fake_rag):
+        before = final.route_stats.stats()
+        async def run():
+            transport = httpx.ASGITransport(app=final.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                greeting = await client.post("/chat", json={
+                    "user_gender": "남성", "character": "박명수", "message": "형님 안녕하세요 ㅎㅎ"
+                })
+                question = await client.post("/chat", json={
+                    "user_gender": "남성", "character": "박명수", "message": "썸녀한테 먼저 연락해도 될까요?",
+                    "session_id": greeting.json()["session_id"]
+                })
+                # 대화 중의 "네" 는 앞 답변에 대한 대답일 수 있으므로 전체 경로
+                reply = await client.post("/chat", json={
+                    "user_gender": "남성", "character": "박명수", "message": "네 형님",
+                    "session_id": greeting.json()["session_id"]
+                })
+                first_ack = await client.post("/chat", json={
+                    "user_gender": "남성", "character": "박명수", "message": "네 형님"
+                })
+                return greeting.json(), question.json(), reply.json(), first_ack.json()
+
+        greeting, question, reply, first_ack = asyncio.run(run())
+        after = final.route_stats.stats()
+
+    assert greeting["route"] == "trivial" and greeting["rag_used"] is False
+    assert greeting["response"] == postprocess_response("박명수", "야, 왔냐.")
+    assert question["route"] == "full" and question["rag_used"] is True
+    assert question["response"] == postprocess_response("박명수", "큰 모델 답변.")
+    assert reply["route"] == "full" and first_ack["route"] == "trivial"
+    assert rag_calls == ["썸녀한테 먼저 연락해도 될까요?", "네 형님"]
+    assert after["trivial:greeting"] == before.get("trivial:greeting", 0) + 1
+    assert after["trivial:ack"] == before.get("trivial:ack", 0) + 1
+    assert after["full"] == before.get("full", 0) + 2
+
+
+def test_ack_is_trivial_only_without_history():
+    """인사/감사/작별은 대화 중에도 가벼운 메시지, 맞장구는 히스토리가 없을 때만"""
+    classifier = TrivialMessageClassifier(["박명수", "명수"])
+    for message in ["네", "응 ㅋㅋ", "그래요!", "좋아요 형님"]:
+        assert classifier.classify(message) == "ack"
+        assert classifier.classify(message, has_history=True) is None
+    assert classifier.classify("고마워요 명수형", has_history=True) == "thanks"
+    assert classifier.classify("안녕하세요", has_history=True) == "greeting"
+    assert classifier.classify("네 근데 고백은 언제 해요?") is None
+
+
+class RecordingRetriever:
+    """질의를 기록하고 정해진 청크를 돌려주는 가짜 검색기"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    async def asearch(self, query, k=3, character=None):
+        self.queries.append(query)
+        return self.docs[:k]
+
+
+def test_short_questions_use_retrieval_and_hits_come_first():
+    """짧아도 상담 질문이면 검색하고, 긴 페르소나 청크에 밀려 질문 검색 결과가 잘리지 않아야 함"""
+    persona = [Document(page_content="박명수 페르소나 " + "가" * 1000)]
+    hit = Document(page_content="고백은 타이밍보다 진심이 중요함")
+    retriever = RecordingRetriever([hit])
+    with patched_final(rag_retriever=retriever, persona_docs={"박명수": persona}):
+        async def run():
+            return {q: await final.get_character_context("박명수", q)
+                    for q in ["고백할까요?", "헤어졌어요 ㅠㅠ", "형님 안녕하세요 ㅎㅎ", ""]}
+
+        contexts = asyncio.run(run())
+
+    assert retriever.queries == ["고백할까요?", "헤어졌어요 ㅠㅠ"]
+    context = contexts["고백할까요?"]
+    assert context.startswith(hit.page_content) and "박명수 페르소나" in context
+    assert len(context) <= final.RAG_CONTEXT_MAX_CHARS + len("...")
+    assert contexts["형님 안녕하세요 ㅎㅎ"].startswith("박명수 페르소나")
+    assert contexts[""] == contexts["형님 안녕하세요 ㅎㅎ"]
+
+
+if __name__ == "__main__":
+    test_trivial_messages_skip_rag_and_use_fast_model()
+    test_ack_is_trivial_only_without_history()
+    test_short_questions_use_retrieval_and_hits_come_first()
+    print("✅ 경로 테스트 통과")
@@ -0,0 +1,86 @@
+"""
+세션 저장소 테스트 (오프라인)
+- SQLite 세션 저장소: 워커 간 공유, 히스토리 상한, 요약 적용, 초기화
+- 대화 내역 압축: 요약하는 동안 초기화/잘림이 생기면 결과를 버림
+- 실행: python test_session_store.py 또는 pytest
+"""
+import os
+import asyncio
+import tempfile
+
+from session_store import InMemorySessionStore, SQLiteSessionStore
+from history_summary import compact_session_history
+
+
+def test_sqlite_session_store_shared_between_workers():
+    """워커마다 따로 연 SQLite 저장소가 같은 세션을 보고, 히스토리 상한/초기화가 양쪽에 반영되어야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.sqlite")
+        worker_a = SQLiteSessionStore(path, ttl_seconds=60, max_history_lines=4)
+        worker_b = SQLiteSessionStore(path, ttl_seconds=60, max_history_lines=4)
+
+        async def run():
+            session_id = await worker_a.call("get_or_create", None)
+            assert await worker_b.call("get_or_create", session_id) == session_id
+            await worker_a.call("append", session_id, ["User: 1", "박명수: 1"])
+            await worker_b.call("append", session_id, ["User: 2", "박명수: 2", "User: 3", "박명수: 3"])
+            assert await worker_a.call("history_lines", session_id) == ["User: 2", "박명수: 2", "User: 3", "박명수: 3"]
+
+            await worker_a.call("apply_summary", session_id, "1~2턴 요약", 2)
+            assert await worker_b.call("summary", session_id) == "1~2턴 요약"
+            assert await worker_b.call("history_text", session_id) == "User: 3\n박명수: 3"
+
+            assert await worker_b.call("reset", session_id) is True
+            assert await worker_a.call("history_lines", session_id) == []
+            assert await worker_a.call("summary", session_id) == ""
+            assert await worker_a.call("reset", "no-such-session") is False
+            assert await worker_a.call("get_or_create", "no-such-session") != "no-such-session"
+
+        assert worker_a.blocking  # async 경로에서는 스레드에서 실행
+        asyncio.run(run())
+        assert worker_b.stats()["sessions"] == 2
+
+
+def test_compaction_drops_summary_when_history_changes():
+    """요약하는 동안 초기화되거나 상한 초과로 잘리면 요약 결과를 버리고, 새로 붙은 줄만 있으면 적용해야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [InMemorySessionStore(ttl_seconds=60, max_history_lines=8),
+                  SQLiteSessionStore(os.path.join(tmp, "sessions.sqlite"), ttl_seconds=60, max_history_lines=8)]
+        for store in stores:
+            def during_summary(action):
+                async def summarize(previous_summary, lines):
+                    await action()
+                    return f"{len(lines)}줄 요약"
+                return summarize
+
+            async def run():
+                turns = [f"User: {i}" for i in range(6)]
+                session_id = store.get_or_create(None)
+                store.append(session_id, turns)
+
+                async def reset():
+                    store.reset(session_id)
+                assert not await compact_session_history(store, session_id, during_summary(reset), 4, 2)
+                assert store.history_lines(session_id) == [] and store.summary(session_id) == ""
+
+                store.append(session_id, turns)
+                async def trim():
+                    store.append(session_id, ["User: 6", "User: 7", "User: 8"])
+                assert not await compact_session_history(store, session_id, during_summary(trim), 4, 2)
+                assert store.history_lines(session_id)[0] == "User: 1" and store.summary(session_id) == ""
+
+                async def grow():
+                    store.append(session_id, ["User: 9"])
+                assert store.reset(session_id)
+                store.append(session_id, turns)
+                assert await compact_session_history(store, session_id, during_summary(grow), 4, 2)
+                assert store.summary(session_id) == "4줄 요약"
+                assert store.history_lines(session_id) == ["User: 4", "User: 5", "User: 9"]
+
+            asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_sqlite_session_store_shared_between_workers()
+    test_compaction_drops_summary_when_history_changes()
+    print("✅ 세션 저장소 테스트 통과")
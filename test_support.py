@@ -0,0 +1,111 @@
+"""
+테스트 공용 도우미 (오프라인)
+- API 키 없이 final 을 import 할 수 있도록 가짜 키를 먼저 설정
+- 가짜 LLM / 결정적 임베딩 / 텍스트 파일 청크 로더
+- final 모듈 전역을 테스트 동안만 바꾸고 되돌리는 patched_final / use_fake_backends
+"""
+import os
+import asyncio
+import contextlib
+import hashlib
+import json
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-offline-test")
+os.environ.setdefault("GOOGLE_API_KEY", "offline-test")
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+import final
+from admission import AdmissionController
+from response_cache import ResponseVariantCache
+from search_cache import SingleFlightTTLCache
+from session_store import InMemorySessionStore
+
+LLM_LATENCY = 0.5
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_cases(name: str):
+    """테스트 디렉터리의 JSONL 고정 코퍼스"""
+    with open(os.path.join(TEST_DIR, name), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class SlowFakeLLM(BaseChatModel):
+    """고정 지연 후 고정 답변을 돌려주는 가짜 LLM (async 경로만 논블로킹)"""
+    latency: float = LLM_LATENCY
+    reply: str = "야, 그냥 솔직하게 말해."
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+
+@contextlib.contextmanager
+def patched_final(**values):
+    """final 모듈 전역을 테스트 동안만 바꾸고, 끝나면(실패해도) 원래 값으로 되돌림 -> 테스트 순서와 무관"""
+    original = {name: getattr(final, name) for name in values}
+    for name, value in values.items():
+        setattr(final, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(final, name, value)
+
+
+def use_fake_backends(**overrides):
+    """가짜 LLM, RAG/검색 없음, 빈 세션 저장소/캐시/대기열. overrides 로 일부만 바꿔 씀"""
+    response_cache = ResponseVariantCache(final.RESPONSE_CACHE_VARIANTS, final.RESPONSE_CACHE_MAX_KEYS)
+    backends = {
+        "llm": SlowFakeLLM(),
+        "fast_llm": None,
+        "vectorstore": None,
+        "rag_retriever": None,
+        "persona_docs": {},
+        "index_manager": None,
+        "tavily_client": None,
+        "session_store": InMemorySessionStore(final.SESSION_TTL_SECONDS, final.MAX_HISTORY_LINES,
+                                              final.SESSION_MAX_COUNT, final.SESSION_MAX_BYTES),
+        "search_cache": SingleFlightTTLCache(final.SEARCH_CACHE_TTL_SECONDS, final.SEARCH_CACHE_MAX_ENTRIES),
+        "response_cache": response_cache,
+        "llm_admission": AdmissionController(final.LLM_MAX_CONCURRENCY, final.LLM_MAX_QUEUE,
+                                             final.LLM_QUEUE_TIMEOUT_SECONDS),
+    }
+    backends.update(overrides)
+    return patched_final(**backends)
+
+
+class CountingEmbeddings(Embeddings):
+    """텍스트 해시로 만든 결정적 벡터. 임베딩한 텍스트를 embedded 에 기록"""
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+        self.embedded = []
+
+    def embed_query(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[i % len(digest)] / 255 for i in range(self.dim)]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self.embed_query(t) for t in texts]
+
+
+def text_chunks(path):
+    with open(path, encoding="utf-8") as f:
+        return [Document(page_content=line.strip(), metadata={"source": path, "line": i})
+                for i, line in enumerate(f) if line.strip()]
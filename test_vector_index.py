@@ -0,0 +1,159 @@
+"""
+벡터 인덱스 테스트 (오프라인)
+- 인덱스 저장: CURRENT 포인터 교체, 직전 버전 보존, 예전 형식 디렉터리 이전
+- 쓰기 잠금: 다른 프로세스가 잡고 있으면 기다림, 동시에 저장해도 CURRENT 는 항상 있는 버전, 모르는/새 디렉터리는 지우지 않음
+- 압축 인덱스(PQ / IVF+SQ8): 종류를 바꿔도 재임베딩 없음, 샤드 검색 유지
+- 실행: python test_vector_index.py 또는 pytest
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from test_support import CountingEmbeddings, text_chunks
+from ingest import ingest_files, stale_reasons
+from vector_index import (MmapVectorStore, CURRENT_FILE, index_lock, is_mmap_index, read_manifest, resolve_index_dir,
+                          save_index)
+
+
+def index_of(n):
+    index = faiss.IndexFlatL2(4)
+    index.add(np.arange(n * 4, dtype=np.float32).reshape(n, 4))
+    return index, [Document(page_content=f"청크 {i}") for i in range(n)]
+
+
+def test_save_index_swaps_pointer_and_keeps_previous_version():
+    """새 버전은 CURRENT 교체로 한 번에 보이고, 직전 버전만 남고, 예전 형식 디렉터리도 옮겨져야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index")
+        # 예전 형식: 버전 디렉터리 없이 path 바로 아래에 파일
+        legacy = os.path.join(tmp, "legacy")
+        save_index(legacy, *index_of(1))
+        with open(os.path.join(legacy, CURRENT_FILE), encoding="utf-8") as f:
+            os.replace(os.path.join(legacy, f.read()), path)
+        assert is_mmap_index(path) and read_manifest(path)["count"] == 1
+        legacy_store = MmapVectorStore.load(path, CountingEmbeddings())
+
+        versions = []
+        for n in (2, 3, 4):
+            save_index(path, *index_of(n))
+            with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+                versions.append(f.read())
+            assert read_manifest(path)["count"] == n
+            assert MmapVectorStore.load(path, CountingEmbeddings()).index.ntotal == n
+        assert not os.path.exists(os.path.join(path, "manifest.json"))  # 예전 형식 파일은 정리됨
+        assert sorted(name for name in os.listdir(path) if name.startswith("v-")) == sorted(versions[-2:])
+        # 교체 전에 연 예전 형식 인덱스도 계속 검색 가능
+        assert legacy_store.similarity_search_by_vector([0.0] * 4, k=1)[0].page_content == "청크 0"
+
+
+HOLD_LOCK_SCRIPT = """
+import sys
+from vector_index import index_lock
+with index_lock(sys.argv[1]):
+    print("locked", flush=True)
+    sys.stdin.readline()
+"""
+
+
+def test_index_lock_serializes_writers():
+    """다른 프로세스가 쓰기 잠금을 잡고 있으면 기다리고, 동시에 저장해도 CURRENT 는 항상 완성된 버전을 가리켜야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index")
+        holder = subprocess.Popen([sys.executable, "-c", HOLD_LOCK_SCRIPT, path], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            assert holder.stdout.readline().strip() == "locked"
+            with index_lock(path, blocking=False) as acquired:
+                assert acquired is False
+            saved = threading.Event()
+            writer = threading.Thread(target=lambda: (save_index(path, *index_of(1)), saved.set()))
+            writer.start()
+            time.sleep(0.3)
+            assert not saved.is_set() and not is_mmap_index(path)  # 잠금이 풀릴 때까지 기다림
+            holder.stdin.write("\n")
+            holder.stdin.flush()
+            writer.join(10)
+            assert saved.is_set() and read_manifest(path)["count"] == 1
+        finally:
+            holder.kill()
+            holder.wait()
+
+        with index_lock(path) as outer:
+            with index_lock(path) as inner:  # 같은 스레드에서는 다시 잡아도 통과 (ingest_files -> save_index)
+                assert outer and inner
+
+        errors = []
+
+        def write_many(n):
+            try:
+                for _ in range(5):
+                    save_index(path, *index_of(n))
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=write_many, args=(n,)) for n in (2, 3)]
+        for t in writers:
+            t.start()
+        for t in writers:
+            t.join()
+        assert errors == []
+        assert os.path.isdir(resolve_index_dir(path)) and read_manifest(path)["count"] in (2, 3)
+        assert MmapVectorStore.load(path, CountingEmbeddings()).index.ntotal == read_manifest(path)["count"]
+
+
+def test_save_index_prunes_only_versions_older_than_previous():
+    """정리는 직전 버전보다 오래된 v-* 만. 형식을 모르는 디렉터리와 더 새 디렉터리(다른 writer 것)는 남겨야 함"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index")
+        save_index(path, *index_of(1))
+        old = os.path.join(path, "v-1-1")
+        newer = os.path.join(path, f"v-{time.time_ns() + 10 ** 12}-99999")
+        unknown = [os.path.join(path, name) for name in ("v-latest", "backup")]
+        for d in [old, newer] + unknown:
+            os.makedirs(d)
+        save_index(path, *index_of(2))
+        save_index(path, *index_of(3))
+        assert not os.path.exists(old)
+        assert os.path.isdir(newer) and all(os.path.isdir(d) for d in unknown)
+        assert read_manifest(path)["count"] == 3
+
+
+def test_compressed_index_switch_reuses_vectors():
+    """인덱스 종류를 바꾸면 저장된 원본 벡터로 다시 만들고(재임베딩 없음), 샤드 검색은 PQ 에서도 샤드 안에서만"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path, index_path = os.path.join(tmp, "a.txt"), os.path.join(tmp, "index")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(f"상담 청크 {i}" for i in range(300)) + "\n")
+        embedding = CountingEmbeddings()
+        ingest_files(index_path, [path], embedding, load_chunks=text_chunks)
+        exact = MmapVectorStore.load(index_path, embedding).vectors()
+
+        for spec in ["PQ4x4", "IVF4,SQ8"]:
+            embedding.embedded.clear()
+            result = ingest_files(index_path, [path], embedding, load_chunks=text_chunks, index_spec=spec)
+            assert embedding.embedded == [] and result["kept"] == 300
+            store = MmapVectorStore.load(index_path, embedding, nprobe=4)
+            assert store.manifest["index_spec"] == spec
+            assert np.array_equal(store.vectors(), exact)  # 복원값이 아니라 원본 벡터
+            assert stale_reasons(store.manifest, [path], embedding, index_spec=spec) == []
+            assert stale_reasons(store.manifest, [path], embedding) == [f"인덱스 종류: {spec} -> Flat"]
+
+            shard = faiss.IDSelectorBatch(np.arange(0, 300, 3, dtype=np.int64))
+            rows = [row for row, _ in store.search_rows(exact[7].tolist(), 5, shard)]
+            assert len(rows) == 5 and all(row % 3 == 0 for row in rows)
+            assert store.similarity_search("상담 청크 12", k=1)[0].page_content == "상담 청크 12"
+
+
+if __name__ == "__main__":
+    test_save_index_swaps_pointer_and_keeps_previous_version()
+    test_index_lock_serializes_writers()
+    test_save_index_prunes_only_versions_older_than_previous()
+    test_compressed_index_switch_reuses_vectors()
+    print("✅ 벡터 인덱스 테스트 통과")
@@ -0,0 +1,373 @@
+### 메모리 매핑 FAISS 인덱스 + SQLite 문서 저장소 (pickle 없음, 워커끼리 페이지 캐시 공유) ###
+#
+# 디렉터리 구성 (<path>/CURRENT 가 가리키는 <path>/v-<시각>-<pid>/ 안. 예전 형식은 <path>/ 바로 아래)
+#   CURRENT          : 지금 쓰는 버전 디렉터리 이름. 새 버전을 다 쓴 뒤 os.replace 로 한 번에 교체 (경로가 비는 순간 없음)
+#   .lock            : 프로세스 간 쓰기 잠금 (fcntl.flock). 수집/저장/교체는 이 잠금을 잡은 프로세스 하나만 함
+#   index.faiss      : FAISS 인덱스. 읽기 전용 mmap 으로 열어서 여러 워커가 같은 페이지 캐시를 씀
+#   docstore.sqlite  : 청크 본문/메타데이터 (id = FAISS 행 번호)
+#   manifest.json    : 형식 버전, 벡터 수, 차원, 원본 정보, index_spec
+#   vectors.npy      : 압축 인덱스(index_spec != Flat)일 때만. 원본 float32 벡터 (증분 수집 때 재사용, 서버는 읽지 않음)
+#
+# index_spec 은 faiss.index_factory 문자열: Flat(정확) / SQfp16 / SQ8 / PQ{m} / OPQ{m},PQ{m} / IVF{n},Flat / IVF{n},SQ8 ...
+# (python benchmark.py compress 로 recall / 지연시간 / 크기 비교)
+#
+# 기존 LangChain FAISS 디렉터리(index.faiss + index.pkl) 변환:
+#   python vector_index.py convert vector_db_openai [vector_index_openai]
+
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: 프로세스 간 잠금 없음 -> 인덱스를 쓰는 프로세스(서버 워커 / ingest.py)는 하나만 띄울 것
+    fcntl = None
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+MANIFEST_FILE = "manifest.json"
+RAW_VECTORS_FILE = "vectors.npy"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+FORMAT_VERSION = 1
+DEFAULT_INDEX_SPEC = "Flat"
+
+# 벡터를 복사하지 않고 파일을 그대로 매핑 (구버전 faiss 는 IO_FLAG_MMAP)
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def resolve_index_dir(path: str) -> str:
+    """CURRENT 가 있으면 그것이 가리키는 버전 디렉터리, 없으면(예전 형식) path 그대로"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        return path
+
+
+_held_locks = threading.local()
+
+
+@contextlib.contextmanager
+def index_lock(path: str, blocking: bool = True):
+    """
+    인덱스 루트(path)의 .lock 에 프로세스 간 배타 잠금. 수집 -> 저장 -> CURRENT 교체 -> 정리를 하는 동안 잡고 있음
+    (동시에 쓰는 두 프로세스가 서로의 버전 디렉터리를 지우거나, 지워진 디렉터리를 CURRENT 로 가리키지 않도록)
+    같은 스레드에서 다시 잡으면 그대로 통과 (ingest_files -> save_index).
+    blocking=False 면 다른 쪽이 잡고 있을 때 기다리지 않고 False 를 넘겨줌
+    """
+    root = os.path.abspath(path)
+    held = getattr(_held_locks, "paths", None)
+    if held is None:
+        held = _held_locks.paths = set()
+    if root in held:
+        yield True
+        return
+    os.makedirs(root, exist_ok=True)
+    fd = os.open(os.path.join(root, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        acquired = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                acquired = False
+        if acquired:
+            held.add(root)
+        try:
+            yield acquired
+        finally:
+            held.discard(root)
+    finally:
+        os.close(fd)  # 닫으면 flock 도 풀림
+
+
+def _version_time(name: str) -> Optional[int]:
+    """v-<time_ns>-<pid> 의 time_ns. 형식이 다르면 None (모르는 디렉터리는 정리 대상이 아님)"""
+    parts = name.split("-")
+    if len(parts) != 3 or parts[0] != "v" or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+
+def is_mmap_index(path: str) -> bool:
+    return os.path.exists(os.path.join(resolve_index_dir(path), MANIFEST_FILE))
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(resolve_index_dir(path), MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SQLiteDocstore:
+    """
+    FAISS 행 번호 -> Document. 읽기 전용.
+    연결은 열 때 한 번만 만들어서 스레드끼리 공유 (검색은 executor 스레드에서 실행됨).
+    인덱스가 교체되어 디렉터리가 지워져도, 이미 열린 연결로 교체 전 요청을 끝까지 처리할 수 있음
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._db, self._pid = self._connect(), os.getpid()
+            return self._db.execute(sql, list(params)).fetchall()
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Document]:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        rows = self._query(f"SELECT id, page_content, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids)
+        return {row[0]: Document(page_content=row[1], metadata=json.loads(row[2])) for row in rows}
+
+    def count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def all(self) -> List[Document]:
+        """FAISS 행 순서대로 전체 문서 (증분 수집용)"""
+        rows = self._query("SELECT page_content, metadata FROM chunks ORDER BY id")
+        return [Document(page_content=row[0], metadata=json.loads(row[1])) for row in rows]
+
+    @staticmethod
+    def write(path: str, documents: List[Document]):
+        db = sqlite3.connect(path)
+        try:
+            db.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+            db.executemany(
+                "INSERT INTO chunks (id, page_content, metadata) VALUES (?, ?, ?)",
+                ((i, doc.page_content, json.dumps(doc.metadata or {}, ensure_ascii=False, default=str))
+                 for i, doc in enumerate(documents))
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+class MmapVectorStore:
+    """
+    읽기 전용 벡터 저장소. 검색 메서드 이름/결과/점수는 LangChain FAISS(IndexFlatL2) 의 similarity_search 와 같음.
+    쓰기 API(add_texts 등)가 없으므로 LangChain VectorStore 를 상속하지 않음.
+    새 문서 추가는 ingest.ingest_files (-> save_index) 로 새 버전을 만들어서 함.
+    path: 실제 파일이 있는 버전 디렉터리
+    """
+
+    def __init__(self, embedding: Embeddings, index, docstore: SQLiteDocstore, manifest: Dict[str, Any], path: str = "",
+                 nprobe: int = 8):
+        self._embedding = embedding
+        self.index = index
+        self.docstore = docstore
+        self.manifest = manifest
+        self.path = path
+        self.nprobe = nprobe
+        self._ivf = faiss.try_extract_index_ivf(index)
+        if self._ivf is not None:
+            self._ivf.nprobe = nprobe
+        self._selector_supported = True
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings, nprobe: int = 8) -> "MmapVectorStore":
+        """nprobe: IVF 인덱스에서 검색할 클러스터 수 (클수록 정확, 느림)"""
+        path = resolve_index_dir(path)
+        manifest = read_manifest(path)
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"지원하지 않는 인덱스 형식: {manifest.get('format')}")
+        index = faiss.read_index(os.path.join(path, INDEX_FILE), MMAP_FLAGS)
+        return cls(embedding, index, SQLiteDocstore(os.path.join(path, DOCSTORE_FILE)), manifest, path, nprobe)
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    def vectors(self) -> np.ndarray:
+        """
+        저장된 전체 벡터 (ntotal x d). 증분 수집 때 기존 벡터를 다시 임베딩하지 않고 재사용하는 용도.
+        압축 인덱스는 복원값이 원본과 달라서 vectors.npy 의 원본을 씀
+        """
+        raw_path = os.path.join(self.path, RAW_VECTORS_FILE) if self.path else ""
+        if raw_path and os.path.exists(raw_path):
+            return np.load(raw_path)
+        if self.index.ntotal == 0:
+            return np.zeros((0, self.index.d), dtype=np.float32)
+        return self.index.reconstruct_n(0, self.index.ntotal)
+
+    def search_rows(self, embedding: List[float], k: int = 4, selector=None) -> List[Tuple[int, float]]:
+        """
+        (FAISS 행 번호, L2 거리) 가까운 순. 문서 조회 없이 순위만 필요할 때 (하이브리드 검색)
+        selector: faiss.IDSelector - 이 행들 안에서만 검색 (캐릭터 샤드). mmap 인덱스를 복사하지 않음
+        """
+        if self.index.ntotal == 0:
+            return []
+        query = np.array([embedding], dtype=np.float32)
+        if selector is not None and self._selector_supported:
+            if self._ivf is not None:
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            try:
+                scores, positions = self.index.search(query, k, params=params)
+                return [(int(p), float(s)) for p, s in zip(positions[0], scores[0]) if p != -1]
+            except RuntimeError:
+                # IndexPQ 등 IDSelector 를 지원하지 않는 인덱스: 넉넉히 검색한 뒤 거름
+                self._selector_supported = False
+        fetch = k if selector is None else min(self.index.ntotal, max(k * 8, 64))
+        while True:
+            scores, positions = self.index.search(query, fetch, params=None)
+            hits = [(int(p), float(s)) for p, s in zip(positions[0], scores[0])
+                    if p != -1 and (selector is None or selector.is_member(int(p)))]
+            if len(hits) >= k or fetch >= self.index.ntotal:
+                return hits[:k]
+            fetch = min(self.index.ntotal, fetch * 4)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        hits = self.search_rows(embedding, k)
+        docs = self.docstore.get_many(p for p, _ in hits)
+        return [(docs[p], s) for p, s in hits if p in docs]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        # 임베딩은 aembed_query, FAISS 검색 + 문서 조회는 executor 에서
+        vector = await self._embedding.aembed_query(query)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.similarity_search_by_vector, vector, k)
+
+
+def save_index(path: str, index, documents: List[Document], source: str = "", extra: Optional[Dict[str, Any]] = None,
+               raw_vectors: Optional[np.ndarray] = None):
+    """
+    path 아래 새 버전 디렉터리에 다 쓴 뒤 CURRENT 를 os.replace 로 바꿔서 교체.
+    다른 워커는 교체 전후 어느 시점에 읽어도 완성된 버전 하나를 봄 (경로가 없거나 쓰는 중인 순간이 없음)
+    쓰기는 index_lock 을 잡고 함 (호출하는 쪽이 이미 잡았으면 그대로 이어서)
+    raw_vectors: 압축 인덱스일 때 원본 벡터 (vectors.npy)
+    """
+    if index.ntotal != len(documents):
+        raise ValueError(f"벡터 수({index.ntotal})와 문서 수({len(documents)})가 다릅니다.")
+    with index_lock(path):
+        _write_version(path, index, documents, source, extra, raw_vectors)
+
+
+def _write_version(path: str, index, documents: List[Document], source: str, extra: Optional[Dict[str, Any]],
+                   raw_vectors: Optional[np.ndarray]):
+    previous = resolve_index_dir(path) if is_mmap_index(path) else None
+    version = f"v-{time.time_ns()}-{os.getpid()}"
+    target = os.path.join(path, version)
+    os.makedirs(target)
+    faiss.write_index(index, os.path.join(target, INDEX_FILE))
+    if raw_vectors is not None:
+        np.save(os.path.join(target, RAW_VECTORS_FILE), np.ascontiguousarray(raw_vectors, dtype=np.float32))
+    SQLiteDocstore.write(os.path.join(target, DOCSTORE_FILE), documents)
+    manifest = {
+        "format": FORMAT_VERSION,
+        "count": index.ntotal,
+        "dim": index.d,
+        "index_type": type(index).__name__,
+        "source": source,
+        "created_at": int(time.time()),
+        **(extra or {}),
+    }
+    with open(os.path.join(target, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    pointer = os.path.join(path, f".{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(path, CURRENT_FILE))
+
+    # 직전 버전은 CURRENT 를 막 읽은 워커가 열 수 있도록 남겨 두고, 그보다 오래된 버전만 지움
+    # 형식을 모르는 디렉터리나 직전 버전보다 새 디렉터리는 건드리지 않음
+    # (이미 열려 있는 mmap / SQLite 연결은 파일이 지워져도 계속 유효함)
+    previous_time = _version_time(os.path.basename(previous)) if previous and previous != path else None
+    if previous_time is not None:
+        for name in os.listdir(path):
+            created = _version_time(name)
+            if created is not None and created < previous_time:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    if previous == path:
+        # 예전 형식(path 바로 아래 파일)에서 처음 옮겨 온 경우
+        for name in (INDEX_FILE, DOCSTORE_FILE, MANIFEST_FILE, RAW_VECTORS_FILE):
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+
+def build_index(vectors: np.ndarray, spec: str = DEFAULT_INDEX_SPEC):
+    """faiss.index_factory 문자열로 인덱스 생성 (IVF/PQ/SQ 는 주어진 벡터로 학습)"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    try:
+        index = faiss.index_factory(vectors.shape[1], spec)
+        if not index.is_trained:
+            index.train(vectors)
+    except RuntimeError as e:
+        raise ValueError(f"인덱스 '{spec}' 를 벡터 {len(vectors)}개 x {vectors.shape[1]}차원으로 만들 수 없습니다: {e}") from e
+    index.add(vectors)
+    return index
+
+
+def convert_faiss_dir(src: str, dst: str):
+    """LangChain FAISS.save_local 디렉터리(index.faiss + index.pkl) -> mmap 인덱스 디렉터리 (변환 시 한 번만 pickle 로드)"""
+    index = faiss.read_index(os.path.join(src, "index.faiss"))
+    with open(os.path.join(src, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    documents = []
+    for i in range(index.ntotal):
+        doc = docstore.search(index_to_docstore_id[i])
+        if not isinstance(doc, Document):
+            raise ValueError(f"{src}: {i}번 벡터의 문서를 찾을 수 없습니다.")
+        documents.append(Document(page_content=doc.page_content, metadata=dict(doc.metadata or {})))
+    save_index(dst, index, documents, source=os.path.basename(os.path.normpath(src)))
+    return len(documents)
+
+
+def default_destination(src: str) -> str:
+    name = os.path.basename(os.path.normpath(src)).replace("vector_db_", "vector_index_")
+    return os.path.join(os.path.dirname(os.path.normpath(src)), name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="벡터 인덱스 도구")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="LangChain FAISS 디렉터리를 mmap 인덱스로 변환")
+    p_convert.add_argument("src", nargs="+", help="예) vector_db_openai vector_db_google")
+    p_convert.add_argument("--dst", default=None, help="src 가 하나일 때만 지정 가능 (기본: vector_db_* -> vector_index_*)")
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        if args.dst and len(args.src) > 1:
+            parser.error("--dst 는 src 가 하나일 때만 쓸 수 있습니다.")
+        for src in args.src:
+            dst = args.dst or default_destination(src)
+            count = convert_faiss_dir(src, dst)
+            print(f"[변환] {src} -> {dst} ({count}개 청크)")